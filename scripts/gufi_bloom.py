@@ -0,0 +1,313 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# per-directory bloom filters of entry names
+#
+# exact name searches such as gufi_find -name core.12345 have to read
+# every entry of every directory. this adds a database next to each
+# database of an index that holds a bloom filter of the names of the
+# entries of each directory (including rolled up entries), so that
+# gufi_find can skip the entries of directories that definitely do
+# not have a name.
+#
+# the filters are stored as rows of 63 bit integers so that gufi_query
+# can test them without any extra functions. the bit positions of a
+# name are (h1 + i * h2) % nbits for i in [0, nhashes), where h1 and
+# h2 come from the MD5 of the name, so the positions of a name can be
+# found by SQL given only h1 and h2.
+#
+# the filters are attached by gufi_query with -Q (see
+# gufi_index.attach), one directory at a time. directories without
+# a filter, such as ones created or reindexed after this was run,
+# have all of their entries searched.
+
+import argparse
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import sys
+
+import gufi_common
+import gufi_index
+
+# name of the database added to each index directory
+DBNAME = 'gufi_bloom.db'
+
+NAME_BLOOM = 'name_bloom'
+
+# every row repeats the size of its filter so that filters of
+# different sizes for the same directory (from rolling up) can be
+# told apart. words without any bits set are not stored.
+COLUMNS = 'pinode TEXT, nbits INT64, nhashes INT64, word INT64, bits INT64'
+
+# name of the view of the filters of the directory being processed
+VIEW = 'name_bloom_view'
+
+# rows of the view that belong to the directory being processed
+# (rolled up directories see the filters of their children too)
+CURRENT = 'pinode IN (SELECT inode FROM {0})'.format(gufi_common.ESUMMARY)
+
+# bits stored in each row (SQLite integers are signed 64 bit)
+WORD_BITS = 63
+
+# fewest bits in a filter
+MIN_BITS = WORD_BITS
+
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+# characters that make a shell pattern match more than one name
+GLOB_SPECIAL = set('*?[')
+
+CREATE = [
+    'CREATE TABLE {0}.{1}({2});'.format(gufi_index.ADDED_NAME, NAME_BLOOM, COLUMNS),
+    'CREATE INDEX {0}.{1}_idx ON {1}(pinode, word);'.format(gufi_index.ADDED_NAME, NAME_BLOOM),
+]
+
+# true if any filter of the directory being processed has every bit
+# of a name set. a name might be in a directory if any of its filters
+# says so, and filters of the same size can be combined bit by bit,
+# so each bit position only has to be found in one filter of a size.
+CONTAINS = '''EXISTS (
+WITH RECURSIVE
+  filter(nbits, nhashes) AS (SELECT DISTINCT nbits, nhashes FROM {0} WHERE {1}),
+  hash(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM hash WHERE i + 1 < (SELECT MAX(nhashes) FROM filter)),
+  position(nbits, nhashes, bit) AS (SELECT nbits, nhashes, ({{h1}} + hash.i * {{h2}}) % nbits FROM filter, hash WHERE hash.i < nhashes)
+SELECT 1 FROM position
+WHERE EXISTS (SELECT 1 FROM {0} AS w
+              WHERE ({1}) AND (w.nbits == position.nbits) AND (w.nhashes == position.nhashes) AND
+                    (w.word == position.bit / {2}) AND (((w.bits >> (position.bit % {2})) & 1) == 1))
+GROUP BY nbits, nhashes
+HAVING COUNT(*) == nhashes
+)'''.format(VIEW, CURRENT, WORD_BITS)
+
+def to_bytes(name):
+    '''names are hashed as bytes so that any name can be hashed'''
+    if isinstance(name, bytes):
+        return name
+    if sys.version_info.major < 3:
+        return name.encode('utf-8')
+    return name.encode('utf-8', 'surrogateescape')
+
+def hashes(name):
+    '''the two hashes that the bit positions of a name are derived from'''
+    h1, h2 = struct.unpack('<II', hashlib.md5(to_bytes(name)).digest()[:8]) # nosec
+    return h1, h2 | 1
+
+def size(count, false_positive_rate):
+    '''number of bits and hashes of a filter holding count names'''
+    count = max(count, 1)
+    bits = max(int(math.ceil(-count * math.log(false_positive_rate) / (math.log(2) ** 2))), MIN_BITS)
+    return bits, max(int(round(-math.log(false_positive_rate, 2))), 1)
+
+def positions(name, bits, count):
+    '''bit positions of a name in a filter'''
+    h1, h2 = hashes(name)
+    return [(h1 + i * h2) % bits for i in range(count)]
+
+def build(names, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    '''
+    Build a bloom filter
+
+    Returns:
+        (number of bits, number of hashes, dictionary of word -> bits)
+    '''
+
+    names = set(names)
+    bits, count = size(len(names), false_positive_rate)
+
+    words = {}
+    for name in names:
+        for position in positions(name, bits, count):
+            word, bit = divmod(position, WORD_BITS)
+            words[word] = words.get(word, 0) | (1 << bit)
+
+    return bits, count, words
+
+def available(path):
+    '''
+    Check whether an index directory has name bloom filters
+
+    This is only used to decide whether to use the filters at all.
+    Every directory is checked again while querying.
+    '''
+
+    return os.path.isfile(os.path.join(path, DBNAME))
+
+def attach():
+    '''
+    gufi_query arguments that create the view of the filters of
+    each directory (see gufi_index.attach)
+    '''
+
+    return gufi_index.attach(DBNAME, NAME_BLOOM, COLUMNS, VIEW)
+
+def exact_names(patterns):
+    '''
+    Get the names matched by a list of shell patterns if none of them
+    have special characters
+
+    Returns:
+        list of names, or None if any pattern can match more than one name
+    '''
+
+    for pattern in patterns:
+        if GLOB_SPECIAL & set(pattern):
+            return None
+    return list(patterns)
+
+def might_have(names):
+    '''
+    Condition that is true when the directory being processed may have
+    entries with any of the names: either there is no filter for the
+    directory, or a filter might have at least one of them
+
+    The condition does not reference the entries, so it is only
+    evaluated once per directory.
+    '''
+
+    return '((NOT EXISTS (SELECT 1 FROM {0} WHERE {1})) OR {2})'.format(
+        VIEW, CURRENT, ' OR '.join(contains(name) for name in names))
+
+def contains(name):
+    '''SQL that is true if a filter of the directory being processed might have a name'''
+    h1, h2 = hashes(name)
+    return CONTAINS.format(h1=h1, h2=h2)
+
+def fill(false_positive_rate):
+    '''function that fills the added database (see gufi_index.add_db)'''
+    def func(db):
+        # names do not have to be valid UTF-8
+        db.text_factory = bytes
+        names = {}
+        for pinode, name in db.execute('SELECT pinode, name FROM {0};'.format(gufi_common.PENTRIES)):
+            if name is not None:
+                names.setdefault(pinode, []).append(name)
+
+        rows = []
+        for pinode, dir_names in names.items():
+            bits, count, words = build(dir_names, false_positive_rate)
+            pinode = pinode.decode('utf-8')
+            rows += [(pinode, bits, count, word, word_bits)
+                     for word, word_bits in sorted(words.items())]
+
+        for sql in CREATE:
+            db.execute(sql)
+        db.executemany('INSERT INTO {0}.{1} VALUES (?, ?, ?, ?, ?);'.format(gufi_index.ADDED_NAME, NAME_BLOOM),
+                       rows)
+        db.commit()
+    return func
+
+def process(path, remove=False, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    '''create (or remove) the name bloom filters of one index directory'''
+    if remove:
+        gufi_index.remove_db(path, DBNAME)
+    else:
+        gufi_index.add_db(path, DBNAME, fill(false_positive_rate))
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_bloom',
+                                     description='Generate per-directory bloom filters of entry names in a GUFI index')
+    parser.add_argument('index',
+                        help='index directory to start at')
+    parser.add_argument('--threads', '-n',
+                        metavar='count',
+                        type=gufi_common.get_positive,
+                        default=1,
+                        help='number of directories to process at a time')
+    parser.add_argument('--false-positive-rate',
+                        metavar='rate',
+                        type=gufi_common.get_fraction,
+                        default=DEFAULT_FALSE_POSITIVE_RATE,
+                        help='fraction of names not in a directory that its filter reports as present')
+    parser.add_argument('--remove',
+                        action='store_true',
+                        help='remove the bloom filters')
+    parser.add_argument('--skip-file',
+                        dest='skip',
+                        metavar='filename',
+                        type=str,
+                        default=None,
+                        help='Name of file containing directory basenames to skip')
+
+    args = parser.parse_args(argv[1:])
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+
+    def process_one(directory):
+        try:
+            process(directory.path, args.remove, args.false_positive_rate)
+        except (OSError, sqlite3.Error) as err:
+            sys.stderr.write('Could not process {0}: {1}\n'.format(directory.path, err))
+            return False
+        return True
+
+    results = gufi_index.map_threads(process_one,
+                                     list(gufi_index.walk(args.index, skip)),
+                                     args.threads)
+
+    return 0 if all(results) else 1
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,409 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# catalog of the size of each index, for estimating how much of the
+# index a query will touch and reporting its progress
+#
+# the catalog holds the number of directories and the total size of
+# their database files at each level of each top level subtree of an
+# index root. it is refreshed by stat-ing the database files, without
+# opening them:
+#
+#     gufi_catalog.py update [subtree ...] [--index name[,name...]|all]
+#
+# gufi_find and gufi_stats use it for --estimate, which prints the
+# number of directories and bytes a query is expected to touch instead
+# of running it, and --progress, which compares the bytes gufi_query
+# has read so far with that estimate to print how far along it is.
+
+import argparse
+import collections
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import gufi_config
+import gufi_index
+
+# the directory at the index root is the subtree ''
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS catalog(indexroot TEXT, subtree TEXT, level INTEGER, dirs INTEGER, bytes INTEGER, PRIMARY KEY (indexroot, subtree, level)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS refreshed(indexroot TEXT, subtree TEXT, time INTEGER, PRIMARY KEY (indexroot, subtree)) WITHOUT ROWID;
+'''
+
+# exact is False when the catalog only has the totals of a larger
+# subtree. refreshed is None when the directories were stat-ed directly.
+Estimate = collections.namedtuple('Estimate', ['dirs', 'bytes', 'exact', 'refreshed'])
+
+def count(path, skip=None, max_level=None):
+    '''number of directories and bytes of database files at each level under a path'''
+    levels = {}
+    for directory in gufi_index.walk(path, skip, max_level):
+        dirs, size = levels.get(directory.level, (0, 0))
+        levels[directory.level] = (dirs + 1, size + directory.size)
+    return levels
+
+class Catalog(object): # pylint: disable=useless-object-inheritance
+    '''directory counts and database sizes of the subtrees of index roots'''
+
+    def __init__(self, filename, readonly=False, timeout=60):
+        self.filename = filename
+        if readonly:
+            self.db = sqlite3.connect(gufi_index.file_uri(filename), uri=True, timeout=timeout)
+        else:
+            self.db = sqlite3.connect(filename, timeout=timeout)
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self, indexroot, subtrees=None, skip=None, threads=1):
+        '''
+        Recount the subtrees of an index root
+
+        Args:
+            indexroot: index root
+            subtrees:  top level directories to recount (default: all
+                       of them, dropping the ones that no longer exist)
+            skip:      directory basenames to not descend into
+            threads:   number of subtrees to count at a time
+
+        Returns:
+            number of directories counted
+        '''
+
+        indexroot = os.path.normpath(indexroot)
+        everything = subtrees is None
+        if everything:
+            skipped = gufi_index.SKIP | set(skip or [])
+            subtrees = [''] + sorted(child for child in gufi_index.subdirectories(indexroot)
+                                     if child not in skipped)
+
+        def recount(subtree):
+            if not subtree:
+                return count(indexroot, skip, 0)
+            # levels are counted from the index root
+            return dict((level + 1, totals) for level, totals in
+                        count(os.path.join(indexroot, subtree), skip).items())
+
+        counts = gufi_index.map_threads(recount, subtrees, threads)
+        now = int(time.time())
+
+        with self.db:
+            if everything:
+                self.db.execute('DELETE FROM catalog WHERE indexroot == ?;', (indexroot,))
+                self.db.execute('DELETE FROM refreshed WHERE indexroot == ?;', (indexroot,))
+
+            for subtree, levels in zip(subtrees, counts):
+                self.db.execute('DELETE FROM catalog WHERE (indexroot == ?) AND (subtree == ?);', (indexroot, subtree))
+                self.db.executemany('INSERT INTO catalog VALUES (?, ?, ?, ?, ?);',
+                                    [(indexroot, subtree, level, dirs, size)
+                                     for level, (dirs, size) in levels.items()])
+                self.db.execute('INSERT OR REPLACE INTO refreshed VALUES (?, ?, ?);', (indexroot, subtree, now))
+
+        return sum(dirs for levels in counts for dirs, _ in levels.values())
+
+    def estimate(self, indexroot, path, mindepth=None, maxdepth=None):
+        '''
+        Estimate the directories and bytes under a path between two
+        levels below it
+
+        Returns:
+            Estimate, or None if the catalog does not have the subtree
+        '''
+
+        indexroot = os.path.normpath(indexroot)
+        rel = gufi_index.relpath(path, indexroot)
+        start = gufi_index.depth(rel)
+
+        params = {'indexroot': indexroot,
+                  'lo': start + (mindepth or 0),
+                  'hi': start + maxdepth if maxdepth is not None else -1}
+
+        if start == 0:
+            subtree = ''
+            condition = '1'
+        else:
+            subtree = rel.split(os.path.sep)[0]
+            condition = 'subtree == :subtree'
+            params['subtree'] = subtree
+
+        refreshed = self.db.execute('''SELECT MIN(time), COUNT(*) FROM refreshed
+                                       WHERE (indexroot == :indexroot) AND ((:subtree == '') OR (subtree == :subtree));''',
+                                    {'indexroot': indexroot, 'subtree': subtree}).fetchone()
+        if refreshed[1] == 0:
+            return None
+
+        dirs, size = self.db.execute('''SELECT TOTAL(dirs), TOTAL(bytes) FROM catalog
+                                        WHERE (indexroot == :indexroot) AND {0} AND
+                                              (level >= :lo) AND ((:hi < 0) OR (level <= :hi));'''.format(condition),
+                                     params).fetchone()
+
+        return Estimate(int(dirs), int(size), start <= 1, refreshed[0])
+
+def open_catalog(config):
+    '''
+    Open the catalog set in a server config for reading
+
+    Returns:
+        Catalog, or None if it could not be opened
+    '''
+
+    try:
+        return Catalog(config.catalog, readonly=True)
+    except sqlite3.Error as err:
+        sys.stderr.write('Not using catalog {0}: {1}\n'.format(config.catalog, err))
+        return None
+
+def levels(query_cmd):
+    '''the minimum and maximum levels (-y and -z) of a gufi_query command'''
+    found = {'-y': None, '-z': None}
+    for flag, value in zip(query_cmd, query_cmd[1:]):
+        if flag in found:
+            found[flag] = int(value)
+    return found['-y'], found['-z']
+
+def estimate(config, query_cmd, sources):
+    '''
+    Estimate the directories and bytes a gufi_query command will touch
+
+    Directories queried without descending are stat-ed directly.
+
+    Args:
+        config:    gufi_config.Server
+        query_cmd: gufi_query command without the paths
+        sources:   list of (index root, paths passed to query_cmd)
+
+    Returns:
+        Estimate, or None if the catalog could not be used
+    '''
+
+    mindepth, maxdepth = levels(query_cmd)
+
+    if maxdepth == 0:
+        dirs = size = 0
+        if not mindepth:
+            for _, paths in sources:
+                for path in paths:
+                    try:
+                        size += os.lstat(os.path.join(path, gufi_index.DBNAME)).st_size
+                        dirs += 1
+                    except OSError:
+                        pass
+        return Estimate(dirs, size, True, None)
+
+    if config.catalog is None:
+        return None
+
+    catalog = open_catalog(config)
+    if catalog is None:
+        return None
+
+    total = None
+    try:
+        for indexroot, paths in sources:
+            for path in paths:
+                found = catalog.estimate(indexroot, path, mindepth, maxdepth)
+                if found is None:
+                    return None
+                if total is not None:
+                    found = Estimate(total.dirs + found.dirs,
+                                     total.bytes + found.bytes,
+                                     total.exact and found.exact,
+                                     min(total.refreshed, found.refreshed))
+                total = found
+    finally:
+        catalog.close()
+
+    return total
+
+def print_estimate(found, out=sys.stdout):
+    '''print the result of estimate'''
+    if found is None:
+        out.write('No estimate: the catalog does not cover the paths\n')
+        return 1
+
+    out.write('Directories: {0}{1}\n'.format('' if found.exact else 'at most ', found.dirs))
+    out.write('Database bytes: {0}{1}\n'.format('' if found.exact else 'at most ', found.bytes))
+    if found.refreshed is not None:
+        out.write('Catalog refreshed: {0}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(found.refreshed))))
+    return 0
+
+def read_bytes(pid):
+    '''number of bytes a process has read so far, or None if it is not available'''
+    try:
+        with open('/proc/{0}/io'.format(pid), 'r') as io: # pylint: disable=unspecified-encoding
+            for line in io:
+                name, _, value = line.partition(':')
+                if name == 'rchar':
+                    return int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+class Progress(object): # pylint: disable=useless-object-inheritance
+    '''
+    Periodically print how much of its expected input a running
+    gufi_query has read, and when it is expected to finish
+    '''
+
+    def __init__(self, total, out=sys.stderr, interval=1.0):
+        self.total = total     # expected bytes, or None
+        self.out = out
+        self.interval = interval
+        self.pid = None
+        self.started = None
+        self.done = threading.Event()
+        self.thread = None
+        self.width = 0
+
+    def line(self, read, elapsed):
+        '''the progress report after reading some bytes'''
+        if read is None:
+            return '{0:.0f}s elapsed'.format(elapsed)
+
+        if not self.total:
+            return '{0} bytes read, {1:.0f}s elapsed'.format(read, elapsed)
+
+        # gufi_query may read more than the estimate
+        fraction = min(float(read) / self.total, 0.999)
+        eta = '{0:.0f}s'.format(elapsed * (1 - fraction) / fraction) if fraction else 'unknown'
+        return '{0:.1f}% of {1} bytes read, {2:.0f}s elapsed, ETA {3}'.format(
+            100 * fraction, self.total, elapsed, eta)
+
+    def report(self, line, end):
+        if self.out.isatty():
+            # overwrite the previous report
+            self.out.write('\r' + line.ljust(self.width) + end)
+            self.width = len(line)
+        else:
+            self.out.write(line + end)
+        self.out.flush()
+
+    def watch(self):
+        end = '' if self.out.isatty() else '\n'
+        while not self.done.wait(self.interval):
+            self.report(self.line(read_bytes(self.pid), time.time() - self.started), end)
+
+    def start(self, pid):
+        '''start reporting the progress of a process'''
+        self.pid = pid
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''stop reporting and print the total time'''
+        self.done.set()
+        self.thread.join()
+        self.report('done in {0:.0f}s'.format(time.time() - self.started), '\n')
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_catalog',
+                                     description='Maintain the catalog of the sizes of the subtrees of the index')
+    parser.add_argument('action',
+                        choices=['update'],
+                        help='update: recount the directories and database sizes')
+    parser.add_argument('subtrees',
+                        nargs='*',
+                        help='top level directories of the index to recount (default: all of them)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets Catalog')
+    parser.add_argument('--index',
+                        metavar='name[,name...]|all',
+                        help='recount these indexes from the server config instead of IndexRoot')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    if config.catalog is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.CATALOG, args.config))
+        return 1
+
+    try:
+        indexes = config.select_indexes(args.index)
+    except ValueError as err:
+        parser.error(str(err))
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+
+    catalog = Catalog(config.catalog)
+    try:
+        for _, indexroot in indexes:
+            dirs = catalog.refresh(indexroot, args.subtrees or None, skip, config.threads)
+            print('{0}: {1} directories'.format(indexroot, dirs))
+    finally:
+        catalog.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
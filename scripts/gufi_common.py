@@ -63,9 +63,13 @@
 
 import argparse
 import grp
+import numbers
+import os
 import pwd
 import re
+import subprocess
 import sys
+from collections import OrderedDict
 
 if (sys.version_info.major < 3) or ((sys.version_info.major == 3) and sys.version_info.minor < 3):
     from pipes import quote as sanitize
@@ -104,11 +108,19 @@ VRXSUMMARY  = 'vrxsummary'
 VRXPENTRIES = 'vrxpentries'
 TREESUMMARY = 'treesummary'
 
+# views with only the rows of the directory being processed
+# (created by gufi_query; needed when using -Q)
+ESUMMARY    = 'esummary'
+EVRSUMMARY  = 'evrsummary'
+EVRPENTRIES = 'evrpentries'
+
 SUMMARY_NAMES = [
     SUMMARY,
     XSUMMARY,
     VRSUMMARY,
     VRXSUMMARY,
+    ESUMMARY,
+    EVRSUMMARY,
 ]
 
 ENTRIES_NAMES = [
@@ -117,8 +129,12 @@ ENTRIES_NAMES = [
     XPENTRIES,
     VRPENTRIES,
     VRXPENTRIES,
+    EVRPENTRIES,
 ]
 
+# --index value that selects all of the indexes in the server config
+INDEX_ALL = 'all'
+
 # some common column names
 LEVEL   = 'level'
 INODE   = 'inode'
@@ -145,6 +161,13 @@ def get_non_negative(value):
         raise argparse.ArgumentTypeError("{0} is an invalid non-negative int value".format(value))
     return ivalue
 
+def get_fraction(value):
+    '''Make sure the value is a number in (0, 1].'''
+    fvalue = float(value)
+    if (fvalue <= 0) or (fvalue > 1):
+        raise argparse.ArgumentTypeError("{0} is not in (0, 1]".format(value))
+    return fvalue
+
 def get_char(value):
     '''Make sure the value is a single character.'''
     if len(value) != 1:
@@ -157,6 +180,53 @@ def get_size(value):
         raise argparse.ArgumentTypeError("{0} is not a valid size".format(value))
     return value
 
+def get_indexes(value):
+    '''Make sure the value is a list of name:path pairs separated by commas.'''
+    indexes = OrderedDict()
+    for pair in value.split(','):
+        name, sep, path = pair.partition(':')
+        name = name.strip()
+        path = path.strip()
+        if (not sep) or (not name) or (not path) or (name == INDEX_ALL):
+            raise argparse.ArgumentTypeError("{0} is not a valid name:path pair".format(pair))
+        if name in indexes:
+            raise argparse.ArgumentTypeError("index {0} is listed more than once".format(name))
+        indexes[name] = os.path.normpath(path)
+    return indexes
+
+# settings that can be set in a tuning profile
+PROFILE_SETTINGS = {
+    'Threads'      : get_positive,
+    'OutputBuffer' : get_non_negative,
+    'Memory'       : get_non_negative,
+    'Subdirs'      : get_non_negative,
+    'Compress'     : lambda value: bool(get_non_negative(value)),
+}
+
+def get_profiles(value):
+    '''Make sure the value is a list of prefix:Key=value[,Key=value...] profiles separated by semicolons.'''
+    profiles = OrderedDict()
+    for profile in value.split(';'):
+        prefix, sep, settings = profile.rpartition(':')
+        prefix = prefix.strip()
+        if (not sep) or (not prefix):
+            raise argparse.ArgumentTypeError("{0} is not a valid prefix:settings profile".format(profile))
+
+        parsed = {}
+        for setting in settings.split(','):
+            key, sep, val = setting.partition('=')
+            key = key.strip()
+            if (not sep) or (key not in PROFILE_SETTINGS):
+                raise argparse.ArgumentTypeError("{0} is not a valid profile setting. Known settings: {1}".format(
+                    setting, ', '.join(sorted(PROFILE_SETTINGS))))
+            parsed[key] = PROFILE_SETTINGS[key](val.strip())
+
+        prefix = os.path.normpath(prefix)
+        if prefix in profiles:
+            raise argparse.ArgumentTypeError("profile {0} is listed more than once".format(prefix))
+        profiles[prefix] = parsed
+    return profiles
+
 def get_port(port):
     '''Make sure the value is an integer between 0 and 65536'''
 
@@ -256,6 +326,10 @@ def build_query(select, tables, where=None, group_by=None,
         order_by:    ORDER BY columns
         num_results: number of results to limit by
 
+    Values should be passed in as named parameters (see param())
+    instead of being formatted into the strings. The parameters
+    are bound by the caller.
+
     Returns:
         A query of the form:
 
@@ -293,6 +367,90 @@ def build_query(select, tables, where=None, group_by=None,
 
     return query
 
+# ###############################################
+# query parameters
+#
+# queries are built with named parameters (:name) and a separate
+# dictionary of typed values. queries run with the sqlite3 module can
+# bind the dictionary directly. gufi_query only accepts SQL text, so
+# bind() renders each value as a literal of the matching SQL type when
+# the gufi_query command is created.
+#
+# the values are still part of the text of the gufi_query command, so
+# queries with different values are different queries to gufi_query
+# and to anything keyed on the command. values that change on every
+# run, such as the current time, should be computed by SQLite while
+# querying instead of being passed as parameters (see gufi_find).
+
+# quoted strings and identifiers are skipped when looking for parameters
+PARAMETER = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|:([A-Za-z_][A-Za-z0-9_]*)""")
+
+def param(params, value):
+    '''
+    Add a value to a dictionary of parameters
+
+    Args:
+        params: dictionary of parameter name -> value
+        value:  value to add
+
+    Returns:
+        the placeholder to use in the query
+    '''
+
+    name = 'p{0}'.format(len(params))
+    while name in params:
+        name += '_'
+    params[name] = value
+    return ':' + name
+
+def sql_literal(value):
+    '''
+    Convert a Python value into a SQL literal of the matching type
+
+    Strings are quoted and escaped, so they are never interpreted as SQL.
+    '''
+
+    # pylint: disable=too-many-return-statements
+
+    if value is None:
+        return SQLITE3_NULL
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    if isinstance(value, float):
+        if value != value: # pylint: disable=comparison-with-itself
+            return SQLITE3_NULL
+        if value in [float('inf'), float('-inf')]:
+            # SQLite converts out of range values into infinity
+            return '9e999' if value > 0 else '-9e999'
+        return repr(value)
+    if (sys.version_info.major > 2) and isinstance(value, (bytes, bytearray)):
+        return 'X\'{0}\''.format(''.join('{0:02x}'.format(c) for c in bytearray(value)))
+    return '\'{0}\''.format(str(value).replace('\'', '\'\''))
+
+def bind(sql, params):
+    '''
+    Replace the named parameters in a query with literals
+
+    Args:
+        sql:    query containing named parameters (:name)
+        params: dictionary of parameter name -> value
+
+    Returns:
+        the query without any parameters
+
+    Raises:
+        KeyError if a parameter does not have a value
+    '''
+
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        return sql_literal(params[match.group(2)])
+
+    return PARAMETER.sub(replace, sql)
+
 # a helper function to show the gufi_query being executed. Helpful for debugging and education.
 # use escaping so it can be copy-pasted into a bash shell and executed correctly
 def print_query(query_tokens):
@@ -306,6 +464,45 @@ def print_query(query_tokens):
     print('GUFI query is \n  {0}'.format(formatted_string))
     sys.stdout.flush()
 
+def run_command(cmd, stdout=None, replace=False, trace=None, progress=None): # pylint: disable=too-many-arguments
+    '''
+    Run a command whose output does not need to be processed
+
+    Args:
+        cmd:     command as a list
+        stdout:  file object to send the output to (default: inherit)
+        replace: replace the current process with the command instead
+                 of forking and waiting for it to finish. Only do this
+                 when nothing else needs to run afterwards.
+        trace:   gufi_trace.Trace to record the run in. The process is
+                 not replaced when tracing.
+        progress: gufi_catalog.Progress to report the progress of the
+                 run with. The process is not replaced when reporting.
+
+    Returns:
+        The return code of the command. Does not return if replace is
+        True and the command was started.
+    '''
+
+    if trace is not None:
+        return trace.run(cmd, stdout, progress)
+
+    if replace and (progress is None):
+        # anything buffered would be lost when the process is replaced
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if stdout is not None:
+            os.dup2(stdout.fileno(), sys.stdout.fileno())
+        os.execv(cmd[0], cmd)
+
+    proc = subprocess.Popen(cmd, stdout=stdout) # pylint: disable=consider-using-with
+    if progress is not None:
+        progress.start(proc.pid)
+    proc.communicate()                          # block until the command finishes
+    if progress is not None:
+        progress.stop()
+    return proc.returncode
+
 def add_common_flags(parser):
     '''Common GUFI tool flags'''
     parser.add_argument('--delim',
@@ -339,3 +536,354 @@ def add_common_flags(parser):
     parser.add_argument('--verbose', '-V',
                         action='store_true',
                         help='Show the gufi_query being executed')
+
+    parser.add_argument('--explain',
+                        action='store_true',
+                        help='Show the query plans of the generated SQL statements instead of running the query')
+
+    parser.add_argument('--trace-out',
+                        metavar='filename',
+                        type=str,
+                        default=None,
+                        help='Write a Chrome trace of where the time of this run was spent')
+
+# ###############################################
+# typed streaming of gufi_query output
+#
+# gufi_query prints each row as its columns separated by a single
+# character delimiter and terminated by a newline. NULLs are printed
+# as empty columns.
+
+# the delimiter gufi_query uses when '-d x' is passed in
+RECORD_SEPARATOR = '\x1e'
+
+# number of bytes to read from gufi_query at a time
+STREAM_CHUNK_SIZE = 1 << 16
+
+# typed formats gufi_output.py can write rows in instead of text
+OUTPUT_FORMATS = ['arrow', 'npy', 'sqlite']
+
+# constraints that can follow the declared type of a column
+COLUMN_CONSTRAINTS = ['CONSTRAINT', 'PRIMARY', 'NOT', 'NULL', 'UNIQUE',
+                      'CHECK', 'DEFAULT', 'COLLATE', 'REFERENCES',
+                      'GENERATED', 'AS']
+
+# constraints that can appear in place of a column
+TABLE_CONSTRAINTS = ['CONSTRAINT', 'PRIMARY', 'UNIQUE', 'CHECK', 'FOREIGN']
+
+if sys.version_info.major < 3:
+    def to_text(value):
+        return value
+else:
+    def to_text(value):
+        # file names are not required to be valid UTF-8
+        return value.decode('utf-8', 'surrogateescape')
+
+def to_integer(value):
+    return int(value) if len(value) else None
+
+def to_real(value):
+    return float(value) if len(value) else None
+
+def to_blob(value):
+    return value
+
+def to_numeric(value):
+    if not len(value):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return to_text(value)
+
+def affinity(declared):
+    '''
+    Get the function that converts a column printed by gufi_query
+    into a Python value using the rules SQLite uses to determine the
+    affinity of a column from its declared type
+
+    https://www.sqlite.org/datatype3.html
+    3.1. Determination Of Column Affinity
+    '''
+
+    declared = declared.upper()
+
+    if SQLITE3_INT in declared:
+        return to_integer
+    for text in ['CHAR', 'CLOB', SQLITE3_TEXT]:
+        if text in declared:
+            return to_text
+    if (SQLITE3_BLOB in declared) or (len(declared) == 0):
+        return to_blob
+    for real in ['REAL', 'FLOA', 'DOUB']:
+        if real in declared:
+            return to_real
+    return to_numeric
+
+def split_columns(definitions):
+    '''split the column definitions of a CREATE TABLE on top level commas outside of quotes'''
+    columns = []
+    depth = 0
+    start = 0
+    quote = None
+    for i, c in enumerate(definitions):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in '\'"`':
+            quote = c
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif (c == ',') and (depth == 0):
+            columns += [definitions[start:i]]
+            start = i + 1
+    columns += [definitions[start:]]
+    return [column.strip() for column in columns if len(column.strip())]
+
+def schema_columns(create):
+    '''
+    Get the names and conversion functions of the columns of a CREATE
+    TABLE statement
+
+    Args:
+        create: CREATE TABLE statement
+
+    Returns:
+        A list of (name, conversion function), one per column
+    '''
+
+    match = re.search(r'CREATE\s+(?:TEMP\w*\s+)?TABLE\s+[^(]*\((.*)\)', create,
+                      re.IGNORECASE | re.DOTALL)
+    if not match:
+        raise ValueError('Could not find a table definition in "{0}"'.format(create))
+
+    columns = []
+    for column in split_columns(match.group(1)):
+        if re.match(r'\w*', column).group(0).upper() in TABLE_CONSTRAINTS:
+            continue
+
+        tokens = column.split()
+
+        declared = []
+        for token in tokens[1:]:
+            if token.upper() in COLUMN_CONSTRAINTS:
+                break
+            declared += [token]
+
+        columns += [(tokens[0].strip('"`[]'), affinity(' '.join(declared)))]
+
+    return columns
+
+def schema_types(create):
+    '''
+    Get the conversion functions of the columns of a CREATE TABLE statement
+
+    Args:
+        create: CREATE TABLE statement
+
+    Returns:
+        A list with one conversion function per column
+    '''
+
+    return [convert for _, convert in schema_columns(create)]
+
+def select_columns(select):
+    '''
+    Get the result columns of a SELECT statement
+
+    Returns:
+        A list of the expressions between SELECT and the top level FROM,
+        or None if they could not be found
+    '''
+
+    match = re.match(r'\s*SELECT\s+(?:(?:DISTINCT|ALL)\s+)?', select, re.IGNORECASE)
+    if not match:
+        return None
+
+    depth = 0
+    quote = None
+    start = match.end()
+    for i in range(start, len(select)):
+        c = select[i]
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in '\'"`':
+            quote = c
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif (depth == 0) and re.match(r'\bFROM\b', select[i:i + 5], re.IGNORECASE) and \
+             ((i == 0) or not (select[i - 1].isalnum() or select[i - 1] == '_')):
+            return split_columns(select[start:i])
+
+    return split_columns(select[start:].rstrip().rstrip(';'))
+
+def column_types(query_cmd):
+    '''
+    Get the conversion functions of the columns a gufi_query command prints
+
+    The final aggregation table (-K) is used if it exists. Otherwise, the
+    per-thread table (-I) is used. When the query printing the results
+    (-G, or -E/-S without -K) selects other columns than the ones of the
+    table, each result column that is a column of the table gets its
+    type, and the rest are converted to whichever of integer, real, and
+    text each value looks like.
+
+    Args:
+        query_cmd: gufi_query command as a list
+
+    Returns:
+        A list with one conversion function per column, or None if no
+        table was created
+    '''
+
+    def flag_value(flag):
+        if flag in query_cmd[:-1]:
+            return query_cmd[query_cmd.index(flag) + 1]
+        return None
+
+    for flag in ['-K', '-I']:
+        create = flag_value(flag)
+        if create is None:
+            continue
+
+        columns = schema_columns(create)
+
+        # the statement that prints the results
+        printer = flag_value('-G')
+        if (printer is None) and (flag == '-I'):
+            for statement in [flag_value('-E'), flag_value('-S')]:
+                if (statement is not None) and not statement.lstrip().upper().startswith('INSERT'):
+                    printer = statement
+                    break
+
+        results = select_columns(printer) if printer else None
+        if (results is None) or (results == ['*']):
+            return [convert for _, convert in columns]
+
+        types = dict(columns)
+        converts = []
+        for result in results:
+            # the name of a column, possibly with its table name
+            name = re.match(r'^(?:\w+\.)?["`]?(\w+)["`]?$', result)
+            converts += [types.get(name.group(1), to_numeric) if name else to_numeric]
+        return converts
+
+    return None
+
+def parse_rows(chunks, types, delim=RECORD_SEPARATOR):
+    '''
+    Convert chunks of gufi_query output into rows
+
+    Newlines in any column except for the last one are handled by
+    counting delimiters instead of splitting on newlines. The caller
+    is responsible for picking a delimiter that does not appear in
+    the data.
+
+    Args:
+        chunks: iterable of bytes
+        types:  list of conversion functions, one per column, or
+                None to return all columns as text
+        delim:  the column delimiter
+
+    Returns:
+        A generator of row tuples
+    '''
+
+    delim = delim.encode('latin-1')
+    newline = '\n'.encode('latin-1')
+    columns = len(types) if types else 0
+
+    buf = ''.encode('latin-1')
+    fields = []
+    for chunk in chunks:
+        buf += chunk
+        start = 0
+        while True:
+            # the last column is terminated by a newline
+            sep = delim if len(fields) < (columns - 1) else newline
+            end = buf.find(sep, start)
+            if end < 0:
+                break
+
+            if types:
+                fields += [buf[start:end]]
+                if len(fields) == columns:
+                    yield tuple(convert(field) for convert, field in zip(types, fields))
+                    fields = []
+            else:
+                yield tuple(to_text(field) for field in buf[start:end].split(delim))
+
+            start = end + 1
+
+        buf = buf[start:]
+
+    if len(fields) or len(buf):
+        raise ValueError('gufi_query output ended in the middle of a row')
+
+def stream_rows(query_cmd, types=None, chunk_size=STREAM_CHUNK_SIZE):
+    '''
+    Run a gufi_query command and yield its results as typed rows as
+    they are printed
+
+    gufi_query blocks when its output is not being read, so rows are
+    only produced as fast as they are consumed. If the delimiter is
+    not set with -d, the ASCII Record Separator is used.
+
+    Args:
+        query_cmd:  gufi_query command as a list, including the paths
+        types:      list of conversion functions, one per column
+                    (default: taken from the -K or -I table)
+        chunk_size: maximum number of bytes to read at once
+
+    Returns:
+        A generator of row tuples
+
+    Raises:
+        subprocess.CalledProcessError if gufi_query fails
+    '''
+
+    if types is None:
+        types = column_types(query_cmd)
+
+    cmd = list(query_cmd)
+    if '-d' in cmd[:-1]:
+        delim = cmd[cmd.index('-d') + 1]
+        if delim == 'x':
+            delim = RECORD_SEPARATOR
+    else:
+        cmd = cmd[:1] + ['-d', 'x'] + cmd[1:]
+        delim = RECORD_SEPARATOR
+
+    query = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0) # pylint: disable=consider-using-with
+    fd = query.stdout.fileno()
+
+    def read():
+        while True:
+            chunk = os.read(fd, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    done = False
+    try:
+        for row in parse_rows(read(), types, delim):
+            yield row
+        done = True
+    finally:
+        # stop gufi_query if the caller stopped early
+        if not done:
+            query.kill()
+        query.stdout.close()
+        query.wait()
+
+    if query.returncode:
+        raise subprocess.CalledProcessError(query.returncode, cmd)
@@ -64,6 +64,7 @@
 import argparse
 import os
 import sys
+from collections import OrderedDict
 
 import gufi_common
 
@@ -71,14 +72,14 @@ import gufi_common
 PATH = '@CONFIG_FILE@'
 
 class Config(object): # pylint: disable=too-few-public-methods,useless-object-inheritance
-    def __init__(self, settings, config_reference=PATH):
+    def __init__(self, settings, config_reference=PATH, optional=None):
         # path string
         if isinstance(config_reference, str):
             with open(config_reference, 'r') as config_file: # pylint: disable=unspecified-encoding
-                self.config = self._read_lines(settings, config_file, config_reference)
+                self.config = self._read_lines(settings, config_file, config_reference, optional)
         # iterable object containing lines
         elif self._check_iterable(config_reference):
-            self.config = self._read_lines(settings, config_reference, config_reference)
+            self.config = self._read_lines(settings, config_reference, config_reference, optional)
         else:
             raise TypeError('Cannot convert {0} to a config'.format(type(config_reference)))
 
@@ -91,7 +92,11 @@ class Config(object): # pylint: disable=too-few-public-methods,useless-object-in
         return True
 
     @staticmethod
-    def _read_lines(settings, lines, path):
+    def _read_lines(settings, lines, path, optional=None):
+        # optional settings are not required to be in the config
+        if optional is None:
+            optional = {}
+
         out = {}
         for line in lines:
             line = line.strip()
@@ -105,12 +110,14 @@ class Config(object): # pylint: disable=too-few-public-methods,useless-object-in
             key, value = line.split('=', 1)
 
             # only store known keys
-            if key in settings:
-                # some values need to be parsed
-                if settings[key]:
-                    out[key] = settings[key](value)
-                else:
-                    out[key] = value
+            for known in [settings, optional]:
+                if key in known:
+                    # some values need to be parsed
+                    if known[key]:
+                        out[key] = known[key](value)
+                    else:
+                        out[key] = value
+                    break
 
         for key in settings:
             if key not in out:
@@ -119,11 +126,24 @@ class Config(object): # pylint: disable=too-few-public-methods,useless-object-in
         return out
 
 class Server(Config):
-    THREADS      = 'Threads'      # number of threads to use
-    QUERY        = 'Query'        # absolute path of gufi_query
-    STAT         = 'Stat'         # absolute path of gufi_stat_bin
-    INDEXROOT    = 'IndexRoot'    # absolute path of root directory for GUFI to traverse
-    OUTPUTBUFFER = 'OutputBuffer' # size of per-thread buffers used to buffer prints
+    THREADS         = 'Threads'         # number of threads to use
+    QUERY           = 'Query'           # absolute path of gufi_query
+    STAT            = 'Stat'            # absolute path of gufi_stat_bin
+    INDEXROOT       = 'IndexRoot'       # absolute path of root directory for GUFI to traverse
+    OUTPUTBUFFER    = 'OutputBuffer'    # size of per-thread buffers used to buffer prints
+    STATSCACHE      = 'StatsCache'      # absolute path of the directory holding the gufi_stats partial results cache of each user (optional)
+    RESULTCACHE     = 'ResultCache'     # absolute path of the directory holding cached query results (optional)
+    RESULTCACHESIZE = 'ResultCacheSize' # maximum size of each user's cached query results in bytes (optional)
+    INDEXES         = 'Indexes'         # named index roots that can be selected with --index (optional)
+    HISTORY         = 'History'         # absolute path of the directory holding the run history of each user (optional)
+    PROFILES        = 'Profiles'        # gufi_query settings used under index path prefixes (optional)
+    TRIGRAMINDEX    = 'TrigramIndex'    # absolute path of the sidecar trigram index of names (optional)
+    OWNERINDEX      = 'OwnerIndex'      # absolute path of the sidecar index of the directories of each owner (optional)
+    INODEINDEX      = 'InodeIndex'      # absolute path of the sidecar index of the locations of each inode (optional)
+    SUMMARYMIRROR   = 'SummaryMirror'   # absolute path of the sidecar copy of the summary rows of the index (optional)
+    CATALOG         = 'Catalog'         # absolute path of the catalog of the sizes of the subtrees of each index (optional)
+    WORKLOAD        = 'Workload'        # absolute path of the directory holding the query log of each user (optional)
+    TREESUMMARYSTATE = 'TreesummaryState' # absolute path of the state of the index the treesummary tables were computed from (optional)
 
     # key -> str to value converter
     SETTINGS = {
@@ -134,9 +154,26 @@ class Server(Config):
         OUTPUTBUFFER : gufi_common.get_non_negative
     }
 
+    # settings that do not have to be in the config
+    OPTIONAL = {
+        STATSCACHE      : os.path.normpath,
+        RESULTCACHE     : os.path.normpath,
+        RESULTCACHESIZE : gufi_common.get_positive,
+        INDEXES         : gufi_common.get_indexes,
+        HISTORY         : os.path.normpath,
+        PROFILES        : gufi_common.get_profiles,
+        TRIGRAMINDEX    : os.path.normpath,
+        OWNERINDEX      : os.path.normpath,
+        INODEINDEX      : os.path.normpath,
+        SUMMARYMIRROR   : os.path.normpath,
+        CATALOG         : os.path.normpath,
+        WORKLOAD        : os.path.normpath,
+        TREESUMMARYSTATE : os.path.normpath,
+    }
+
     def __init__(self, config_reference):
         # pylint: disable=super-with-arguments
-        super(Server, self).__init__(Server.SETTINGS, config_reference)
+        super(Server, self).__init__(Server.SETTINGS, config_reference, Server.OPTIONAL)
 
     @property
     def threads(self):
@@ -163,6 +200,209 @@ class Server(Config):
         '''return size of per-thread buffers used to buffer prints'''
         return self.config[Server.OUTPUTBUFFER]
 
+    @property
+    def statscache(self):
+        '''return absolute path of the directory holding the gufi_stats partial results cache of each user, or None'''
+        return self.config.get(Server.STATSCACHE)
+
+    @property
+    def resultcache(self):
+        '''return absolute path of the directory holding cached query results, or None'''
+        return self.config.get(Server.RESULTCACHE)
+
+    @property
+    def resultcachesize(self):
+        '''return maximum size of each user's cached query results in bytes, or None'''
+        return self.config.get(Server.RESULTCACHESIZE)
+
+    @property
+    def indexes(self):
+        '''return named index roots in the order they were listed (empty if not set)'''
+        return self.config.get(Server.INDEXES, OrderedDict())
+
+    @property
+    def history(self):
+        '''return absolute path of the directory holding the run history of each user, or None'''
+        return self.config.get(Server.HISTORY)
+
+    @property
+    def profiles(self):
+        '''return gufi_query settings keyed on index path prefix (empty if not set)'''
+        return self.config.get(Server.PROFILES, OrderedDict())
+
+    @property
+    def trigramindex(self):
+        '''return absolute path of the sidecar trigram index of names, or None'''
+        return self.config.get(Server.TRIGRAMINDEX)
+
+    @property
+    def ownerindex(self):
+        '''return absolute path of the sidecar index of the directories of each owner, or None'''
+        return self.config.get(Server.OWNERINDEX)
+
+    @property
+    def inodeindex(self):
+        '''return absolute path of the sidecar index of the locations of each inode, or None'''
+        return self.config.get(Server.INODEINDEX)
+
+    @property
+    def summarymirror(self):
+        '''return absolute path of the sidecar copy of the summary rows of the index, or None'''
+        return self.config.get(Server.SUMMARYMIRROR)
+
+    @property
+    def catalog(self):
+        '''return absolute path of the catalog of the sizes of the subtrees of each index, or None'''
+        return self.config.get(Server.CATALOG)
+
+    @property
+    def workload(self):
+        '''return absolute path of the directory holding the query log of each user, or None'''
+        return self.config.get(Server.WORKLOAD)
+
+    @property
+    def treesummarystate(self):
+        '''return absolute path of the state of the index the treesummary tables were computed from, or None'''
+        return self.config.get(Server.TREESUMMARYSTATE)
+
+    def profile(self, paths):
+        '''
+        Find the gufi_query settings to use for a set of index paths
+
+        Every profile whose prefix contains the deepest directory shared
+        by all of the paths is applied, from the shortest prefix to the
+        longest, on top of Threads and OutputBuffer. Relative prefixes
+        are under IndexRoot.
+
+        Args:
+            paths: index paths that will be queried together
+
+        Returns:
+            a Profile
+        '''
+
+        selected = Profile(self.threads, self.outputbuffer)
+
+        profiles = self.profiles
+        if not profiles:
+            return selected
+
+        common = common_directory(paths)
+        if common is None:
+            return selected
+
+        matches = []
+        for prefix, settings in profiles.items():
+            prefix = os.path.normpath(os.path.join(self.indexroot, prefix))
+            if (common == prefix) or common.startswith(prefix.rstrip(os.path.sep) + os.path.sep):
+                matches += [(len(prefix), prefix, settings)]
+
+        for _, prefix, settings in sorted(matches, key=lambda match: match[0]):
+            selected.update(prefix, settings)
+
+        return selected
+
+    def select_indexes(self, selector=None):
+        '''
+        Find the index roots to query
+
+        Args:
+            selector: None for IndexRoot, 'all' for every named index
+                      (or IndexRoot if there are none), or a comma
+                      separated list of index names
+
+        Returns:
+            list of (name, index root) pairs. The name of IndexRoot is None.
+
+        Raises:
+            ValueError if an index name is not in the config
+        '''
+
+        if selector is None:
+            return [(None, self.indexroot)]
+
+        indexes = self.indexes
+        if selector == gufi_common.INDEX_ALL:
+            return list(indexes.items()) or [(None, self.indexroot)]
+
+        selected = []
+        for name in selector.split(','):
+            if name not in indexes:
+                raise ValueError('Unknown index "{0}". Known indexes: {1}'.format(name, ', '.join(indexes) or 'none'))
+            if name not in [prev for prev, _ in selected]:
+                selected += [(name, indexes[name])]
+
+        return selected
+
+class Profile(object): # pylint: disable=too-few-public-methods,useless-object-inheritance
+    '''gufi_query settings selected for a set of index paths'''
+
+    def __init__(self, threads, outputbuffer):
+        self.threads = threads
+        self.outputbuffer = outputbuffer
+        self.memory = None    # -M
+        self.subdirs = None   # -C
+        self.compress = False # -e
+        self.prefix = None    # longest matching prefix
+
+    def update(self, prefix, settings):
+        '''apply the settings of a profile'''
+        self.threads = settings.get('Threads', self.threads)
+        self.outputbuffer = settings.get('OutputBuffer', self.outputbuffer)
+        self.memory = settings.get('Memory', self.memory)
+        self.subdirs = settings.get('Subdirs', self.subdirs)
+        self.compress = settings.get('Compress', self.compress)
+        self.prefix = prefix
+
+    def flags(self):
+        '''return the gufi_query flags other than -n and -B'''
+        flags = []
+        if self.memory is not None:
+            flags += ['-M', str(self.memory)]
+        if self.subdirs is not None:
+            flags += ['-C', str(self.subdirs)]
+        if self.compress:
+            flags += ['-e']
+        return flags
+
+def common_directory(paths):
+    '''return the deepest directory containing all of the paths, or None if there are no paths'''
+    split = [os.path.normpath(path).split(os.path.sep) for path in paths]
+    if not split:
+        return None
+
+    common = []
+    for parts in zip(*split):
+        if any(part != parts[0] for part in parts[1:]):
+            break
+        common += [parts[0]]
+
+    return os.path.sep.join(common) or os.path.sep
+
+# server configurations that have already been parsed, keyed on path
+SERVERS = {}
+
+def load_server(config_reference=PATH):
+    '''
+    Parse a server configuration only once per process
+
+    Configurations read from a path are parsed again if the file has
+    changed since it was last read. Other references are always parsed.
+    '''
+
+    if not isinstance(config_reference, str):
+        return Server(config_reference)
+
+    st = os.stat(config_reference)
+    signature = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    cached = SERVERS.get(config_reference)
+    if (cached is None) or (cached[0] != signature):
+        cached = (signature, Server(config_reference))
+        SERVERS[config_reference] = cached
+
+    return cached[1]
+
 class Client(Config):
     SERVER       = 'Server'       # hostname
     PORT         = 'Port'         # ssh port
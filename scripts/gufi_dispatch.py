@@ -0,0 +1,189 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# single entry point for the GUFI tools
+#
+# the tools are scripts, so the python interpreter compiles all of a
+# tool every time it is run. this loads the requested tool as a module
+# instead, which allows its bytecode to be cached, and only the
+# modules needed by the requested operation are imported. when run
+# from the command line, the process is replaced with gufi_query if
+# nothing needs to be done with the output.
+#
+# the tool is selected with the first argument:
+#
+#     gufi_dispatch.py find -name '*.c'
+#
+# or with the name this file is run as:
+#
+#     ln -s gufi_dispatch.py gufi_find
+#
+# the installed gufi_* executables are small launchers that call this
+# file (see gufi_launcher), and the tools themselves are installed as
+# gufi_*.py.
+#
+# other programs can import this module and call dispatch repeatedly.
+# the tools and the configuration file are only loaded once.
+
+import os
+import sys
+
+import gufi_config
+
+# tools that can be run through this file
+TOOLS = ['find', 'getfattr', 'ls', 'stat', 'stats']
+
+PREFIX = 'gufi_'
+
+# directory containing the tools
+DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+# tools that have already been loaded
+LOADED = {}
+
+def load(tool, directory=DIRECTORY):
+    '''
+    Load a tool as a module
+
+    The bytecode of the tool is cached in the same way as the
+    bytecode of imported modules if the directory is writable.
+    '''
+
+    module = LOADED.get(tool)
+    if module is not None:
+        return module
+
+    name = PREFIX + tool
+    path = os.path.join(directory, name + '.py')
+
+    # pylint: disable=import-outside-toplevel
+    if sys.version_info.major < 3:
+        import imp # pylint: disable=deprecated-module
+        module = imp.load_source(name, path)
+    else:
+        import importlib.machinery
+        import importlib.util
+        loader = importlib.machinery.SourceFileLoader(name, path)
+        spec = importlib.util.spec_from_loader(name, loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+
+    LOADED[tool] = module
+    return module
+
+def split(argv):
+    '''
+    Find the tool to run and the arguments to pass to it
+
+    Returns:
+        the tool and its arguments, starting with the name of the tool
+
+    Raises:
+        ValueError if a known tool was not selected
+    '''
+
+    name = os.path.basename(argv[0])
+    if name.startswith(PREFIX) and (name[len(PREFIX):] in TOOLS):
+        return name[len(PREFIX):], [name] + argv[1:]
+
+    if len(argv) < 2:
+        raise ValueError('usage: {0} {{{1}}} [args ...]'.format(name, ','.join(TOOLS)))
+
+    tool = argv[1]
+    if tool.startswith(PREFIX):
+        tool = tool[len(PREFIX):]
+
+    if tool not in TOOLS:
+        raise ValueError('{0}: unknown tool "{1}"'.format(name, argv[1]))
+
+    return tool, [PREFIX + tool] + argv[2:]
+
+def dispatch(argv, config_path=gufi_config.PATH, replace=False):
+    '''
+    Run a tool
+
+    Args:
+        argv:        the name of this file or of a tool, followed by
+                     the arguments of a tool. If argv[0] is not the name
+                     of a tool, argv[1] selects the tool.
+        config_path: server configuration file
+        replace:     allow the tool to replace the current process
+
+    Returns:
+        The return code of the tool
+    '''
+
+    tool, args = split(argv)
+    return load(tool).run(args, config_path, replace=replace)
+
+def run(argv):
+    try:
+        tool, args = split(argv)
+    except ValueError as err:
+        sys.stderr.write('{0}\n'.format(err))
+        return 1
+
+    return load(tool).run(args, gufi_config.PATH, replace=True)
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
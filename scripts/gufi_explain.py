@@ -0,0 +1,353 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+# show how SQLite runs the statements of a gufi_query command
+#
+# the per-directory statements (-T, -S, -E) are explained against the
+# database of a directory in the index, attached the same way gufi_query
+# attaches it, with the intermediate table (-I) available. the
+# aggregation statements (-J, -G) are explained with both the
+# intermediate and aggregate (-K) tables available. the GUFI SQL
+# functions only have to exist for a statement to be explained, so
+# they are replaced with functions that do nothing. external database
+# views (-Q) only have the rows of their template tables.
+
+import os
+import sqlite3
+import sys
+
+import gufi_index
+
+# gufi_query attaches the database of each directory with this name
+ATTACH_NAME = 'tree'
+
+# statements that create tables
+SETUP = ['-I', '-K']
+
+# views gufi_query -x creates on top of the xattrs of the directory
+# being processed. the xattrs of each directory are approximated
+# with the xattrs stored in its own database.
+XATTR_VIEWS = '''
+CREATE TEMP VIEW xattrs AS SELECT inode, name, value FROM {0}.xattrs_avail;
+CREATE TEMP VIEW xentries AS SELECT entries.*, xattrs.name as xattr_name, xattrs.value as xattr_value FROM entries LEFT JOIN xattrs ON entries.inode == xattrs.inode;
+CREATE TEMP VIEW xpentries AS SELECT pentries.*, xattrs.name as xattr_name, xattrs.value as xattr_value FROM pentries LEFT JOIN xattrs ON pentries.inode == xattrs.inode;
+CREATE TEMP VIEW xsummary AS SELECT summary.*, xattrs.name as xattr_name, xattrs.value as xattr_value FROM summary LEFT JOIN xattrs ON summary.inode == xattrs.inode;
+CREATE TEMP VIEW vrxpentries AS SELECT vrpentries.*, xattrs.name as xattr_name, xattrs.value as xattr_value FROM vrpentries LEFT JOIN xattrs ON vrpentries.inode == xattrs.inode;
+CREATE TEMP VIEW vrxsummary AS SELECT vrsummary.*, xattrs.name as xattr_name, xattrs.value as xattr_value FROM vrsummary LEFT JOIN xattrs ON vrsummary.inode == xattrs.inode;
+'''.format(ATTACH_NAME)
+
+# views gufi_query creates for queries that use external databases
+# when the directory being processed is not known
+EXTDB_VIEWS = '''
+CREATE TEMP VIEW esummary AS SELECT * FROM summary;
+CREATE TEMP VIEW epentries AS SELECT * FROM pentries;
+CREATE TEMP VIEW evrsummary AS SELECT * FROM vrsummary;
+CREATE TEMP VIEW evrpentries AS SELECT * FROM vrpentries;
+'''
+
+# -Q <basename> <table> <template.table> <view>
+EXTERNAL = '-Q'
+EXTERNAL_ARGS = 4
+
+# statements that are explained, in the order gufi_query runs them
+STATEMENTS = ['-T', '-S', '-E', '-J', '-G']
+
+# statements that are run once per directory
+PER_DIRECTORY = ['-T', '-S', '-E']
+
+SCALAR_FUNCTIONS = [
+    # addqueryfuncs
+    'uidtouser', 'gidtogroup', 'modetotxt', 'strftime', 'blocksize',
+    'human_readable_size', 'basename',
+    # addqueryfuncs_with_context
+    'path', 'epath', 'fpath', 'rpath', 'starting_point', 'level',
+    # gufi_query
+    'subdirs',
+    # sqlite3-pcre
+    'regexp',
+]
+
+AGGREGATE_FUNCTIONS = [
+    'stdevs', 'stdevp', 'median',
+    'log2_hist', 'mode_hist', 'time_hist', 'category_hist',
+    'category_hist_combine', 'mode_count',
+]
+
+class Aggregate(object): # pylint: disable=useless-object-inheritance
+    '''aggregate function that does nothing'''
+
+    def step(self, *args):
+        pass
+
+    def finalize(self): # pylint: disable=no-self-use
+        return None
+
+def nothing(*_args):
+    return None
+
+def add_functions(db):
+    for name in SCALAR_FUNCTIONS:
+        db.create_function(name, -1, nothing)
+    for name in AGGREGATE_FUNCTIONS:
+        db.create_aggregate(name, -1, Aggregate)
+
+def statements(query_cmd):
+    '''
+    Get the SQL passed to a gufi_query command
+
+    Returns:
+        dictionary of flag -> SQL
+    '''
+
+    sql = {}
+    for i, arg in enumerate(query_cmd[:-1]):
+        if arg in SETUP + STATEMENTS:
+            sql[arg] = query_cmd[i + 1]
+    return sql
+
+def externals(query_cmd):
+    '''
+    Get the external databases attached by a gufi_query command
+
+    Returns:
+        list of (basename, table, template, view)
+    '''
+
+    found = []
+    for i, arg in enumerate(query_cmd[:-EXTERNAL_ARGS]):
+        if arg == EXTERNAL:
+            found += [tuple(query_cmd[i + 1:i + 1 + EXTERNAL_ARGS])]
+    return found
+
+def representative(path):
+    '''find the first directory at or under path that has a database'''
+    for directory in gufi_index.walk(path):
+        return directory.path
+    return None
+
+def connect(query_cmd, dirname=None):
+    '''
+    Set up a database the statements of a gufi_query command can be
+    prepared in
+
+    The GUFI SQL functions are replaced with functions that do
+    nothing. If dirname is provided, its database is attached the same
+    way gufi_query attaches it. The setup statements (-I, -K) are run.
+    The views of external databases (-Q) are created from their
+    templates.
+
+    Returns:
+        (db, errors), where errors describes the setup that failed
+    '''
+
+    sql = statements(query_cmd)
+
+    db = sqlite3.connect('file::memory:', uri=True)
+    errors = []
+    try:
+        add_functions(db)
+
+        if dirname is not None:
+            db.execute('ATTACH ? AS {0};'.format(ATTACH_NAME), (gufi_index.db_uri(dirname),))
+
+            if '-x' in query_cmd:
+                try:
+                    db.executescript(XATTR_VIEWS)
+                except sqlite3.Error as err:
+                    errors += ['Could not create xattr views: {0}'.format(err)]
+
+            db.executescript(EXTDB_VIEWS)
+
+        for flag in SETUP:
+            if flag in sql:
+                try:
+                    db.executescript(sql[flag])
+                except sqlite3.Error as err:
+                    errors += ['Could not run {0}: {1}'.format(flag, err)]
+
+        for _, _, template, view in externals(query_cmd):
+            try:
+                db.execute('CREATE TEMP VIEW {0} AS SELECT * FROM {1};'.format(view, template))
+            except sqlite3.Error as err:
+                errors += ['Could not create view {0}: {1}'.format(view, err)]
+    except sqlite3.Error:
+        db.close()
+        raise
+
+    return db, errors
+
+def plan(db, sql):
+    '''
+    Get the query plan of a statement
+
+    Returns:
+        list of (depth, detail)
+    '''
+
+    depths = {0: -1}
+    rows = []
+    for node, parent, _, detail in db.execute('EXPLAIN QUERY PLAN {0}'.format(sql)):
+        depths[node] = depths.get(parent, -1) + 1
+        rows += [(depths[node], detail)]
+    return rows
+
+def analyze(flag, steps):
+    '''
+    Count the operations in a query plan and find known anti-patterns
+
+    Args:
+        flag:  the gufi_query flag the statement was passed with
+        steps: the query plan from plan()
+
+    Returns:
+        (counts, warnings)
+    '''
+
+    counts = {
+        'scans'                  : 0,
+        'temporary sorts'        : 0,
+        'automatic indexes'      : 0,
+        'correlated subqueries'  : 0,
+    }
+
+    warnings = []
+    for _, detail in steps:
+        if detail.startswith('SCAN '):
+            counts['scans'] += 1
+
+        if 'TEMP B-TREE' in detail:
+            counts['temporary sorts'] += 1
+            if 'UNION USING' in detail:
+                warnings += ['"{0}" removes duplicate rows; use UNION ALL if there cannot be any'.format(detail)]
+            elif flag in PER_DIRECTORY:
+                warnings += ['"{0}" happens in every directory; sort once in -G instead if the results are aggregated'.format(detail)]
+
+        if 'AUTOMATIC' in detail:
+            counts['automatic indexes'] += 1
+            warnings += ['"{0}" builds a temporary index every time the statement runs'.format(detail)]
+
+        if 'CORRELATED' in detail:
+            counts['correlated subqueries'] += 1
+            warnings += ['"{0}" is run once per row of the outer query'.format(detail)]
+
+    return counts, warnings
+
+def explain(query_cmd, path, out=None):
+    '''
+    Print the query plans of the statements of a gufi_query command
+
+    Args:
+        query_cmd: gufi_query command as a list
+        path:      index directory the query starts at
+        out:       file to print to (default: stdout)
+
+    Returns:
+        0 if all statements were explained, 1 otherwise
+    '''
+
+    # pylint: disable=too-many-locals
+
+    out = out or sys.stdout
+    sql = statements(query_cmd)
+
+    dirname = representative(path)
+    if dirname is None:
+        sys.stderr.write('Could not find a database at or under {0}\n'.format(path))
+        return 1
+
+    out.write('Using {0}\n'.format(os.path.join(dirname, gufi_index.DBNAME)))
+
+    db, errors = connect(query_cmd, dirname)
+    try:
+        rc = 0
+        for error in errors:
+            sys.stderr.write('{0}\n'.format(error))
+            rc = 1
+
+        for flag in STATEMENTS:
+            if flag not in sql:
+                continue
+
+            out.write('\n{0} {1}\n'.format(flag, sql[flag]))
+
+            try:
+                steps = plan(db, sql[flag])
+            except sqlite3.Error as err:
+                out.write('    Could not explain: {0}\n'.format(err))
+                rc = 1
+                continue
+
+            for depth, detail in steps:
+                out.write('    {0}{1}\n'.format('  ' * depth, detail))
+
+            counts, warnings = analyze(flag, steps)
+            out.write('    {0}\n'.format(', '.join('{0}: {1}'.format(name, count)
+                                                    for name, count in sorted(counts.items()))))
+            for warning in warnings:
+                out.write('    Warning: {0}\n'.format(warning))
+
+        return rc
+    finally:
+        db.close()
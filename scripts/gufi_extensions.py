@@ -0,0 +1,226 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+# per-directory histograms of file extensions
+#
+# deriving extensions from names with
+#     REPLACE(name, RTRIM(name, REPLACE(name, '.', '')), '')
+# creates three strings for every entry every time a query is run.
+# this adds a database next to each database of an index that holds
+# the number and total size of the entries of each directory
+# (including rolled up entries) with each extension, grouped by uid
+# and gid, so that extension queries only need to read the histograms.
+#
+# the histograms are attached by gufi_query with -Q (see
+# gufi_index.attach), one directory at a time. directories without
+# a histogram, such as ones created or reindexed after this was run,
+# fall back to deriving the extensions of their entries.
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import gufi_common
+import gufi_index
+
+# name of the database added to each index directory
+DBNAME = 'gufi_extensions.db'
+
+EXTENSIONS = 'extensions'
+
+COLUMNS = 'pinode TEXT, ext TEXT, uid INT64, gid INT64, count INT64, size INT64'
+
+# name of the view of the histogram of the directory being processed
+VIEW = 'extensions_view'
+
+# rows of the view that belong to the directory being processed
+# (rolled up directories see the histograms of their children too)
+CURRENT = 'pinode IN (SELECT inode FROM {0})'.format(gufi_common.ESUMMARY)
+
+# characters that would make a shell pattern match more than one extension
+GLOB_SPECIAL = set('*?[].')
+
+def extension(name):
+    '''
+    The text after the last '.' of a name, or the entire name if
+    there is no '.', matching
+        REPLACE(name, RTRIM(name, REPLACE(name, '.', '')), '')
+    '''
+
+    if name is None:
+        return None
+    return name.rsplit('.', 1)[-1]
+
+CREATE = '''
+BEGIN;
+CREATE TABLE {0}.{1}({2});
+INSERT INTO {0}.{1} SELECT pinode, extension(name) AS ext, uid, gid, COUNT(*), TOTAL(size) FROM {3} GROUP BY pinode, ext, uid, gid;
+COMMIT;
+'''.format(gufi_index.ADDED_NAME, EXTENSIONS, COLUMNS, gufi_common.PENTRIES)
+
+def available(path):
+    '''
+    Check whether an index directory has an extension histogram
+
+    This is only used to decide whether to use the histograms at all.
+    Every directory is checked again while querying.
+    '''
+
+    return os.path.isfile(os.path.join(path, DBNAME))
+
+def attach():
+    '''
+    gufi_query arguments that create the view of the histogram of
+    each directory (see gufi_index.attach)
+    '''
+
+    return gufi_index.attach(DBNAME, EXTENSIONS, COLUMNS, VIEW)
+
+def have(exts):
+    '''
+    Condition that is true when the directory being processed may have
+    entries with any of the extensions: either there is no histogram
+    for the directory, or the histogram has at least one of them
+
+    The condition does not reference the entries, so it is only
+    evaluated once per directory.
+
+    Args:
+        exts: extensions as SQL values or parameters
+    '''
+
+    return '((NOT EXISTS (SELECT 1 FROM {0} WHERE {1})) OR EXISTS (SELECT 1 FROM {0} WHERE ({1}) AND (ext IN ({2}))))'.format(
+        VIEW, CURRENT, ', '.join(exts))
+
+def suffixes(patterns):
+    '''
+    Get the extensions matched by a list of shell patterns if all of
+    them are of the form "*.ext"
+
+    Returns:
+        list of extensions, or None if any pattern is not "*.ext"
+    '''
+
+    exts = []
+    for pattern in patterns:
+        if not pattern.startswith('*.'):
+            return None
+
+        ext = pattern[2:]
+        if GLOB_SPECIAL & set(ext):
+            return None
+
+        exts += [ext]
+
+    return exts
+
+def process(path, remove=False):
+    '''create (or remove) the extension histogram of one index directory'''
+    if remove:
+        gufi_index.remove_db(path, DBNAME)
+    else:
+        gufi_index.add_db(path, DBNAME, CREATE, {'extension': (1, extension)})
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_extensions',
+                                     description='Generate per-directory extension histograms in a GUFI index')
+    parser.add_argument('index',
+                        help='index directory to start at')
+    parser.add_argument('--threads', '-n',
+                        metavar='count',
+                        type=gufi_common.get_positive,
+                        default=1,
+                        help='number of directories to process at a time')
+    parser.add_argument('--remove',
+                        action='store_true',
+                        help='remove the extension histograms')
+    parser.add_argument('--skip-file',
+                        dest='skip',
+                        metavar='filename',
+                        type=str,
+                        default=None,
+                        help='Name of file containing directory basenames to skip')
+
+    args = parser.parse_args(argv[1:])
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+
+    def process_one(directory):
+        try:
+            process(directory.path, args.remove)
+        except (OSError, sqlite3.Error) as err:
+            sys.stderr.write('Could not process {0}: {1}\n'.format(directory.path, err))
+            return False
+        return True
+
+    results = gufi_index.map_threads(process_one,
+                                     list(gufi_index.walk(args.index, skip)),
+                                     args.threads)
+
+    return 0 if all(results) else 1
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,220 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# query several indexes at the same time
+#
+# a server config can name more than one index root (Indexes). each
+# selected index is queried by its own gufi_query, and all of them
+# run at the same time with the configured number of threads split
+# between them. their outputs are merged into a single stream: lines
+# are passed through as they arrive, or, when the output is sorted,
+# merged in order with each line tagged with its sort key.
+
+import heapq
+import subprocess
+import sys
+import threading
+
+import gufi_common
+
+def split_threads(threads, count):
+    '''
+    Divide a thread budget between queries
+
+    Every query gets at least one thread, so the total is only
+    exceeded when there are more queries than threads.
+    '''
+
+    base, extra = divmod(threads, count)
+    return [max(1, base + int(i < extra)) for i in range(count)]
+
+def set_threads(query_cmd, threads):
+    '''replace the thread count of a gufi_query command'''
+    cmd = list(query_cmd)
+    if '-n' in cmd[:-1]:
+        cmd[cmd.index('-n') + 1] = str(threads)
+    else:
+        cmd = cmd[:1] + ['-n', str(threads)] + cmd[1:]
+    return cmd
+
+def split_key(keys, reverse=None, integers=None):
+    '''
+    Build a function that separates the sort key from a line of output
+
+    The query must be run with '-d x' and have the key columns at the
+    end of each row. The other columns are joined with a space, which
+    is what gufi_query prints with '-d " "'.
+
+    Args:
+        keys:     number of key columns at the end of each row
+        reverse:  indices of the key columns that are integers sorted
+                  in descending order
+        integers: indices of the key columns that are integers sorted
+                  in ascending order
+
+    Returns:
+        function that converts a line into (sort key, line without the key)
+    '''
+
+    reverse = set(reverse or [])
+    integers = set(integers or [])
+    delim = gufi_common.RECORD_SEPARATOR.encode()
+
+    def split(line):
+        cols = line.rstrip(b'\n').split(delim)
+        key = []
+        for i, col in enumerate(cols[len(cols) - keys:]):
+            if i in reverse:
+                key += [-int(col or 0)]
+            elif i in integers:
+                key += [int(col or 0)]
+            else:
+                key += [col]
+        return tuple(key), b' '.join(cols[:len(cols) - keys]) + b'\n'
+
+    return split
+
+def concatenate(procs, out):
+    '''write the lines of each query as soon as they are read'''
+    lock = threading.Lock()
+
+    def pump(proc):
+        for line in iter(proc.stdout.readline, b''):
+            with lock:
+                out.write(line)
+
+    pumps = [threading.Thread(target=pump, args=(proc,)) for proc in procs]
+    for pump_thread in pumps:
+        pump_thread.start()
+    for pump_thread in pumps:
+        pump_thread.join()
+
+def merge(procs, out, key, limit=None):
+    '''
+    k-way merge of the sorted outputs of the queries
+
+    Returns:
+        True if the merge stopped before all output was read
+    '''
+
+    def rows(proc):
+        for line in iter(proc.stdout.readline, b''):
+            yield key(line)
+
+    count = 0
+    for _, line in heapq.merge(*[rows(proc) for proc in procs]):
+        if (limit is not None) and (count >= limit):
+            return True
+        out.write(line)
+        count += 1
+
+    return False
+
+def query(query_cmd, index_paths, threads, out=None, key=None, limit=None): # pylint: disable=too-many-arguments
+    '''
+    Run a gufi_query command on several indexes at the same time
+
+    Args:
+        query_cmd:   gufi_query command without the paths
+        index_paths: list of the paths to query in each index
+        threads:     total number of threads to split between the queries
+        out:         file to write the merged output to (default: stdout)
+        key:         function from split_key if the output of each query
+                     is sorted and should be merged in order
+        limit:       maximum number of lines to write when merging in order
+
+    Returns:
+        the first non-zero return code of the queries, or 0
+    '''
+
+    # write bytes even when given a text file such as sys.stdout
+    out = out or sys.stdout
+    out = getattr(out, 'buffer', out)
+
+    procs = []
+    for count, paths in zip(split_threads(threads, len(index_paths)), index_paths):
+        procs += [subprocess.Popen(set_threads(query_cmd, count) + paths, # pylint: disable=consider-using-with
+                                   stdout=subprocess.PIPE)]
+
+    stopped = False
+    killed = set()
+    try:
+        if key is None:
+            concatenate(procs, out)
+        else:
+            stopped = merge(procs, out, key, limit)
+    finally:
+        out.flush()
+        for i, proc in enumerate(procs):
+            # the rest of the output is not needed
+            if stopped and (proc.poll() is None):
+                proc.kill()
+                killed.add(i)
+            proc.stdout.close()
+            proc.wait()
+
+    for i, proc in enumerate(procs):
+        if proc.returncode and (i not in killed):
+            return proc.returncode
+
+    return 0
@@ -0,0 +1,407 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+# helpers for tools that work on GUFI index directories directly
+# instead of going through gufi_query
+
+import collections
+import os
+import sqlite3
+import stat
+import sys
+
+if sys.version_info.major < 3:
+    from urllib import quote   # pylint: disable=no-name-in-module,import-error
+else:
+    from urllib.parse import quote
+
+# name of the database file in each index directory
+DBNAME = 'db.db'
+
+# gufi_query always skips these
+SKIP = set(['.', '..'])
+
+# sidecar databases: rows whose path column (relative to the index
+# root) is :rel or under it
+UNDER = '''((:rel == '') OR (path == :rel) OR (substr(path, 1, length(:rel) + 1) == :rel || '/'))'''
+
+# scripts can add databases next to the database file of an index
+# directory. they are recorded as external databases of every
+# directory in the summary table so that gufi_query -Q <basename>
+# attaches them while processing any of the directories (rollup
+# copies the records into the parent directories).
+ADDED_NAME = 'added'
+
+REGISTER = '''
+INSERT OR REPLACE INTO external_dbs_pwd (type, pinode, filename, mode, uid, gid)
+SELECT 'user_db', inode, :filename, mode, uid, gid FROM summary;
+'''
+
+UNREGISTER = '''
+DELETE FROM external_dbs_pwd WHERE (type == 'user_db') AND (filename == :filename);
+'''
+
+# an index directory and the state of its database file
+#
+# path:  path of the index directory
+# level: number of directories below the directory the walk started at
+# inode: inode of the index directory
+# mtime: modification time of the database file in nanoseconds
+# size:  size of the database file in bytes
+Directory = collections.namedtuple('Directory', ['path', 'level', 'inode', 'mtime', 'size'])
+
+def read_skip(filename):
+    '''
+    Read a file containing directory basenames to skip, the same
+    way gufi_query -k does (only the first word of each line is used)
+
+    Args:
+        filename: path of the skip file
+
+    Returns:
+        set of basenames to skip
+    '''
+
+    skip = set()
+    with open(filename, 'r') as skip_file: # pylint: disable=unspecified-encoding
+        for line in skip_file:
+            words = line.split()
+            if words:
+                skip.add(words[0])
+    return skip
+
+def subdirectories(path):
+    '''list the names of the subdirectories of an index directory'''
+    if hasattr(os, 'scandir'):
+        return [entry.name for entry in os.scandir(path)
+                if entry.is_dir(follow_symlinks=False)]
+
+    # os.scandir was added in Python 3.5
+    return [name for name in os.listdir(path)
+            if os.path.isdir(os.path.join(path, name)) and
+            not os.path.islink(os.path.join(path, name))]
+
+def walk(root, skip=None, max_level=None):
+    '''
+    Breadth first walk of a GUFI index, with the children of each
+    directory in sorted order. gufi_query hands directories to a pool
+    of threads through work queues, so it visits them in no particular
+    order, but each directory is visited after its parent, as it is
+    here. Directories that cannot be read are not descended into. Directories without a database file are not
+    returned, but are still descended into.
+
+    Args:
+        root:      index directory to start walking from
+        skip:      directory basenames to not descend into
+        max_level: do not descend below this level (root is level 0)
+
+    Returns:
+        generator of Directory
+    '''
+
+    skip = SKIP | set(skip or [])
+
+    queue = collections.deque([(os.path.normpath(root), 0)])
+    while queue:
+        path, level = queue.popleft()
+
+        try:
+            dst = os.lstat(path)
+            dbst = os.lstat(os.path.join(path, DBNAME))
+        except OSError:
+            dbst = None
+
+        if dbst is not None:
+            yield Directory(path, level, dst.st_ino, dbst.st_mtime_ns, dbst.st_size)
+
+        if (max_level is not None) and (level >= max_level):
+            continue
+
+        try:
+            children = sorted(subdirectories(path))
+        except OSError:
+            continue
+
+        queue.extend([(os.path.join(path, child), level + 1)
+                      for child in children
+                      if child not in skip])
+
+def relpath(path, indexroot):
+    '''
+    Get the path of an index directory relative to the index root
+
+    The index root itself is the empty string.
+    '''
+
+    rel = os.path.relpath(os.path.normpath(path), os.path.normpath(indexroot))
+    if rel == os.curdir:
+        return ''
+    return rel
+
+def depth(rel):
+    '''number of directories below the index root of a relative path'''
+    if not rel:
+        return 0
+    return rel.count(os.path.sep) + 1
+
+def file_uri(filename, readonly=True):
+    '''URI of a database file'''
+    mode = 'ro' if readonly else 'rw'
+    return 'file:{0}?mode={1}'.format(quote(filename), mode)
+
+def db_uri(path, readonly=True):
+    '''URI of the database file of an index directory'''
+    return file_uri(os.path.join(path, DBNAME), readonly)
+
+def open_db(path, readonly=True):
+    '''
+    Open the database file of an index directory
+
+    Args:
+        path:     path of the index directory
+        readonly: open the database without write access
+
+    Returns:
+        sqlite3.Connection
+    '''
+
+    return sqlite3.connect(db_uri(path, readonly), uri=True)
+
+def query(path, sql, params=(), functions=None):
+    '''
+    Run a query on the database file of an index directory
+
+    Args:
+        path:      path of the index directory
+        sql:       query to run
+        params:    values bound to the query
+        functions: dictionary of name -> (argument count, function)
+                   to make available to the query
+
+    Returns:
+        list of rows
+    '''
+
+    db = open_db(path)
+    try:
+        for name, (argc, func) in (functions or {}).items():
+            db.create_function(name, argc, func)
+
+        return db.execute(sql, params).fetchall()
+    finally:
+        db.close()
+
+def uri_path(path):
+    '''
+    Escape the characters of a path that cannot be used directly in a
+    SQLite URI, the same way gufi_query does, since gufi_query attaches
+    external databases with URIs
+    '''
+
+    return path.replace('%', '%25').replace('#', '%23').replace('?', '%3f')
+
+def record(filename):
+    '''the name an added database is recorded with'''
+    return uri_path(os.path.realpath(filename))
+
+def restore_times(filename, st):
+    '''set the access and modification times of a file back to those in st'''
+    try:
+        if sys.version_info.major < 3:
+            os.utime(filename, (st.st_atime, st.st_mtime))
+        else:
+            os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+    except OSError:
+        pass
+
+def add_db(path, basename, script, functions=None):
+    '''
+    Create a database next to the database file of an index directory
+    and record it as an external database of the directory
+
+    The script is run with the database of the directory open and the
+    new database attached as ADDED_NAME. Tables that cannot be filled
+    by SQL alone can be filled by passing a function as the script. The new database is built
+    under a temporary name, gets the permissions of the database file
+    of the directory, and then replaces the previous one.
+
+    The record holds the absolute path of the new database (see
+    record()), so moving the index hides it until it is added again.
+    The times of the database file of the directory are kept, since
+    gufi_query -m uses them to tell when the index was last updated.
+    Reindexing a directory replaces its database file, which drops the
+    record, so the added database is ignored instead of being out of
+    date.
+
+    Args:
+        path:      path of the index directory
+        basename:  name of the database to create
+        script:    SQL that creates and fills the tables, or a function
+                   that is called with the open database and commits
+        functions: dictionary of name -> (argument count, function)
+                   to make available to the script
+    '''
+
+    filename = os.path.join(path, basename)
+    tmpname = '{0}.tmp'.format(filename)
+    if os.path.exists(tmpname):
+        os.remove(tmpname)
+
+    dbname = os.path.join(path, DBNAME)
+    st = os.stat(dbname)
+
+    db = open_db(path, readonly=False)
+    try:
+        for name, (argc, func) in (functions or {}).items():
+            db.create_function(name, argc, func)
+
+        db.execute('ATTACH ? AS {0};'.format(ADDED_NAME), (tmpname,))
+        if callable(script):
+            script(db)
+        else:
+            db.executescript(script)
+        db.execute('DETACH {0};'.format(ADDED_NAME))
+
+        os.chmod(tmpname, stat.S_IMODE(st.st_mode))
+        try:
+            os.chown(tmpname, st.st_uid, st.st_gid)
+        except OSError:
+            pass # only possible when running as root; keep the current owner
+        os.rename(tmpname, filename)
+
+        db.execute(REGISTER, {'filename': record(filename)})
+        db.commit()
+    finally:
+        db.close()
+        restore_times(dbname, st)
+
+        # left behind if anything failed
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+def remove_db(path, basename):
+    '''remove a database added with add_db and its record'''
+    filename = os.path.join(path, basename)
+    dbname = os.path.join(path, DBNAME)
+    st = os.stat(dbname)
+
+    db = open_db(path, readonly=False)
+    try:
+        db.execute(UNREGISTER, {'filename': record(filename)})
+        db.commit()
+    finally:
+        db.close()
+        restore_times(dbname, st)
+
+    # records copied into rolled up directories are left behind;
+    # gufi_query skips external databases it cannot attach
+    if os.path.exists(filename):
+        os.remove(filename)
+
+def attach(basename, table, columns, view):
+    '''
+    gufi_query arguments that make a table of the databases added with
+    add_db available as a view, one directory at a time
+
+    Directories without the added database see an empty view, so
+    queries have to fall back to the entries when the view has no rows
+    for the directory being processed.
+
+    With -Q, gufi_query runs -S and -E once for each directory in the
+    summary table, so queries have to use the e* views (esummary,
+    evrsummary, evrpentries, ...) that only have the rows of the
+    directory being processed.
+
+    Args:
+        basename: name of the added database
+        table:    name of the table in the added database
+        columns:  column declarations of the table
+        view:     name of the view to create
+
+    Returns:
+        SQL to run with -I to create the empty template table,
+        list of -Q arguments
+    '''
+
+    template = '{0}_template'.format(table)
+    return ('ATTACH \':memory:\' AS {0}; CREATE TABLE {0}.{1}({2});'.format(template, table, columns),
+            ['-Q', basename, table, '{0}.{1}'.format(template, table), view])
+
+def map_threads(func, items, threads):
+    '''run func on each item using a pool of threads, keeping the order of the items'''
+    if threads <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    if sys.version_info.major < 3:
+        from multiprocessing.pool import ThreadPool # pylint: disable=import-outside-toplevel
+        pool = ThreadPool(threads)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+
+    import concurrent.futures # pylint: disable=import-outside-toplevel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(func, items))
@@ -0,0 +1,249 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# sidecar database mapping each inode to the index directories and
+# names it is found under
+#
+# gufi_find -inum and -samefile compare the inode of every entry in
+# the index. this sidecar keeps the inode of every entry, and of every
+# directory, keyed on the inode so that only the directories holding
+# it have to be queried. it also lists all of the hard links of an
+# inode without querying the index:
+#
+#     gufi_inodes.py update [path ...]
+#     gufi_inodes.py links --inum n [path ...]
+#
+# the sidecar is built from the index by a user that can read all of
+# it, and lists the paths of everything in the index, so it should
+# only be readable by users that are allowed to see them.
+#
+# updates only reread the directories whose database files have
+# changed since the previous update. queries trust the sidecar, so it
+# should be updated whenever the index is.
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import gufi_config
+import gufi_index
+import gufi_sidecar
+
+# inodes are TEXT in the index. a directory is listed in its own
+# database with an empty name.
+INODES = '''
+CREATE TABLE IF NOT EXISTS inodes(inode TEXT, dir INTEGER, name TEXT, PRIMARY KEY (inode, dir, name)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS inodes_dir_idx ON inodes(dir);
+'''
+
+ENTRIES = '''
+SELECT inode, name FROM entries
+UNION
+SELECT inode, '' FROM summary WHERE isroot == 1;
+'''
+
+def read_directory(path):
+    '''return the inodes and names in an index directory and its rollup score'''
+    db = gufi_index.open_db(path)
+    try:
+        inodes = [(str(inode), name) for inode, name in db.execute(ENTRIES) if inode is not None]
+        return inodes, gufi_sidecar.rollupscore(db)
+    finally:
+        db.close()
+
+class InodeIndex(gufi_sidecar.Sidecar):
+    '''locations of the inodes in a GUFI index'''
+
+    NAME    = 'Inode index'
+    VERSION = 1
+    SCHEMA  = INODES
+    TABLES  = ['inodes']
+
+    def read(self, path):
+        return read_directory(path)
+
+    def store(self, dir_id, content):
+        self.db.executemany('INSERT OR IGNORE INTO inodes VALUES (?, ?, ?);',
+                            [(inode, dir_id, name) for inode, name in content])
+
+    def with_inode(self, path, inode):
+        '''ids of the directories under a path that hold an inode'''
+        return set(dir_id for dir_id, in self.db.execute(
+            '''SELECT dirs.id FROM inodes, dirs
+               WHERE (inodes.inode == :inode) AND (inodes.dir == dirs.id) AND {0};'''.format(gufi_index.UNDER),
+            {'rel': gufi_index.relpath(path, self.indexroot),
+             'inode': str(inode)}))
+
+    def links(self, inode, path=None):
+        '''index paths of every name of an inode (under a path)'''
+        found = []
+        for dir_path, name in self.db.execute(
+                '''SELECT dirs.path, inodes.name FROM inodes, dirs
+                   WHERE (inodes.inode == :inode) AND (inodes.dir == dirs.id) AND {0}
+                   ORDER BY dirs.path, inodes.name;'''.format(gufi_index.UNDER),
+                {'rel': gufi_index.relpath(path or self.indexroot, self.indexroot),
+                 'inode': str(inode)}):
+            found += [os.path.normpath(os.path.join(self.indexroot, dir_path, name))]
+        return found
+
+def open_index(config):
+    '''
+    Open the inode index set in a server config for reading
+
+    Returns:
+        InodeIndex, or None if it could not be opened
+    '''
+
+    try:
+        return InodeIndex(config.inodeindex, config.indexroot, readonly=True)
+    except (RuntimeError, sqlite3.Error) as err:
+        sys.stderr.write('Not using inode index {0}: {1}\n'.format(config.inodeindex, err))
+        return None
+
+def matching(index, path, inodes=None):
+    '''
+    Find the ids of the directories under a path that hold every inode
+
+    Returns:
+        set of directory ids, or None if no inode was given
+    '''
+
+    found = None
+    for inode in inodes or []:
+        ids = index.with_inode(path, inode)
+        found = ids if found is None else (found & ids)
+
+    return found
+
+def candidates(index, paths, skip=None, mindepth=None, maxdepth=None, limit=gufi_sidecar.MAX_CANDIDATES, **inodes): # pylint: disable=too-many-arguments
+    '''
+    Find the directories gufi_query has to be started at, with a
+    maximum depth of 0, to get the same results as walking the paths
+    (see gufi_sidecar.candidates)
+
+    Args:
+        inodes: inodes passed to matching
+
+    Returns:
+        list of index directories, or None if the sidecar cannot be used
+    '''
+
+    return gufi_sidecar.candidates(index, paths,
+                                   lambda path: matching(index, path, **inodes),
+                                   skip, mindepth, maxdepth, limit)
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_inodes',
+                                     description='Maintain the index of the locations of each inode')
+    parser.add_argument('action',
+                        choices=['update', 'links'],
+                        help='update: reread the directories whose databases have changed; '
+                        'links: print the index paths of every name of the --inum inodes')
+    parser.add_argument('paths',
+                        nargs='*',
+                        default=[''],
+                        help='directories under the index root (default: all of it)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets InodeIndex')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+    parser.add_argument('--inum',
+                        metavar='n',
+                        type=int,
+                        action='append',
+                        help='inode to print the links of')
+
+    args = parser.parse_args(argv[1:])
+
+    if (args.action == 'links') and (not args.inum):
+        parser.error('links needs --inum')
+
+    config = gufi_config.Server(args.config)
+    if config.inodeindex is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.INODEINDEX, args.config))
+        return 1
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+
+    index = InodeIndex(config.inodeindex, config.indexroot, readonly=(args.action == 'links'))
+    try:
+        for path in args.paths:
+            path = os.path.normpath(os.path.sep.join([config.indexroot, path]))
+            if args.action == 'update':
+                read, reused, removed = index.update(path, skip, config.threads)
+                print('{0}: {1} read, {2} unchanged, {3} removed'.format(path, read, reused, removed))
+            else:
+                for inode in args.inum:
+                    for link in index.links(inode, path):
+                        print(link)
+    finally:
+        index.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,362 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# parallel maintenance of the database files of an index
+#
+# gufi_dir2index and gufi_trace2index write databases without
+# statistics, with the default page size, and incremental updates leave
+# free pages behind. this walks an index with a pool of threads and
+#
+#     - runs ANALYZE on the databases of directories with many entries
+#       that do not have statistics yet
+#     - runs VACUUM on databases whose fraction of free pages is too high
+#     - optionally rewrites databases with a different page size
+#
+# the access and modification times of the database files are put back
+# afterwards, the same way gufi_query -m keeps them. the databases that
+# are vacuumed (or get a new page size) are read the way gufi_query
+# reads them before and after, with the database dropped from the page
+# cache, so the report includes the bytes reclaimed and how much faster
+# reading them from storage got. databases that are only analyzed are
+# not timed: the queries that read a whole directory do not get faster
+# with statistics. databases that are vacuumed change size, so the
+# sidecars reread them on their next update.
+#
+#     gufi_maintenance.py check [paths]
+#     gufi_maintenance.py run [paths] [--page-size bytes]
+
+import argparse
+import collections
+import os
+import sqlite3
+import sys
+import time
+
+import gufi_common
+import gufi_config
+import gufi_index
+import gufi_prefetch
+
+# directories with at least this many entries are analyzed
+ANALYZE_ROWS = 10000
+
+# databases with more than this fraction of free pages are vacuumed
+FREE_RATIO = 0.2
+
+# page sizes SQLite supports
+PAGE_SIZES = [1 << i for i in range(9, 17)]
+
+# what gufi_query reads of each directory, timed before and after:
+# (table or view that has to exist, query)
+MEASURE = [
+    (gufi_common.ENTRIES, 'SELECT COUNT(*), TOTAL(size) FROM {0};'.format(gufi_common.ENTRIES)),
+    (gufi_common.VRPENTRIES, 'SELECT COUNT(*) FROM {0};'.format(gufi_common.VRPENTRIES)),
+]
+
+# times the queries are run with a cold cache, keeping the fastest
+MEASURE_RUNS = 2
+
+# what was done to the database of a directory
+#
+# analyze, vacuum, resize: whether each step was (or would be) done
+# before, after:           sizes of the database file in bytes
+# slower, faster:          seconds reading the database from storage took
+#                          before and after, or None if it was not vacuumed
+# error:                   why the directory could not be maintained, or None
+Result = collections.namedtuple('Result', ['path', 'analyze', 'vacuum', 'resize',
+                                           'before', 'after', 'slower', 'faster', 'error'])
+
+def get_page_size(value):
+    '''Make sure the value is a page size SQLite supports.'''
+    size = int(value)
+    if size not in PAGE_SIZES:
+        raise argparse.ArgumentTypeError('{0} is not a power of two from {1} to {2}'.format(
+            value, PAGE_SIZES[0], PAGE_SIZES[-1]))
+    return size
+
+def pragma(db, name):
+    return db.execute('PRAGMA {0};'.format(name)).fetchone()[0]
+
+def entries(db):
+    '''number of entries of the directory of a database, from its summary'''
+    row = db.execute('SELECT totfiles + totlinks FROM {0} WHERE isroot == 1;'.format(
+        gufi_common.SUMMARY)).fetchone()
+    return (row[0] or 0) if row else 0
+
+def analyzed(db):
+    return db.execute('SELECT 1 FROM sqlite_master WHERE (type == \'table\') AND (name == \'sqlite_stat1\');').fetchone() is not None
+
+def drop_cache(dbname):
+    '''
+    write a database file out and drop it from the page cache
+
+    Returns:
+        False if the page cache cannot be dropped
+    '''
+
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+
+    fd = os.open(dbname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    gufi_prefetch.evict(dbname)
+    return True
+
+def measure(path):
+    '''
+    seconds the fastest of MEASURE_RUNS runs of the MEASURE queries took,
+    each with a new connection and with the database dropped from the
+    page cache. without posix_fadvise, the cache is warmed up instead.
+    '''
+
+    dbname = os.path.join(path, gufi_index.DBNAME)
+
+    best = None
+    for i in range(MEASURE_RUNS + 1):
+        cold = drop_cache(dbname)
+        if (i == 0) and cold:
+            continue
+
+        db = gufi_index.open_db(path)
+        try:
+            present = set(name for name, in db.execute('SELECT name FROM sqlite_master;'))
+            start = time.time()
+            for name, sql in MEASURE:
+                if name in present:
+                    db.execute(sql).fetchall()
+            elapsed = time.time() - start
+        finally:
+            db.close()
+
+        # the first run only warms up the cache
+        if i > 0:
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def maintain(path, analyze_rows=ANALYZE_ROWS, free_ratio=FREE_RATIO, page_size=None, # pylint: disable=too-many-arguments,too-many-locals
+             dry_run=False, timed=True):
+    '''
+    ANALYZE, VACUUM, and change the page size of the database of a
+    directory, as needed
+
+    Args:
+        path:         index directory
+        analyze_rows: analyze directories with at least this many entries
+        free_ratio:   vacuum databases with more than this fraction of free pages
+        page_size:    page size to rewrite databases with, or None to keep it
+        dry_run:      only find out what would be done
+        timed:        time reading a database that is vacuumed from
+                      storage before and after
+
+    Returns:
+        Result
+    '''
+
+    dbname = os.path.join(path, gufi_index.DBNAME)
+    try:
+        st = os.stat(dbname)
+    except OSError as err:
+        return Result(path, False, False, False, 0, 0, None, None, str(err))
+
+    slower = faster = None
+    after = st.st_size
+    modified = False
+    try:
+        db = gufi_index.open_db(path, readonly=dry_run)
+        try:
+            # VACUUM and PRAGMA page_size cannot run in a transaction
+            db.isolation_level = None
+
+            count = pragma(db, 'page_count')
+            do_analyze = (entries(db) >= analyze_rows) and not analyzed(db)
+            do_resize = (page_size is not None) and (page_size != pragma(db, 'page_size'))
+            do_vacuum = do_resize or ((count > 0) and (pragma(db, 'freelist_count') > free_ratio * count))
+
+            if dry_run or not (do_analyze or do_vacuum):
+                return Result(path, do_analyze, do_vacuum, do_resize, st.st_size, st.st_size, None, None, None)
+
+            # the times are also changed by measuring
+            modified = True
+            timed = timed and do_vacuum
+            if timed:
+                slower = measure(path)
+
+            if do_resize:
+                db.execute('PRAGMA page_size = {0};'.format(page_size))
+            if do_vacuum:
+                db.execute('VACUUM;')
+            if do_analyze:
+                db.execute('ANALYZE;')
+
+            if timed:
+                faster = measure(path)
+        finally:
+            db.close()
+
+        after = os.stat(dbname).st_size
+    except (OSError, sqlite3.Error) as err:
+        return Result(path, False, False, False, st.st_size, after, None, None, str(err))
+    finally:
+        # keep the times gufi_query -m relies on
+        if modified:
+            gufi_index.restore_times(dbname, st)
+
+    return Result(path, do_analyze, do_vacuum, do_resize, st.st_size, after, slower, faster, None)
+
+def report(results, out, dry_run=False):
+    '''write what was done to the databases, the bytes reclaimed, and the speedup of reading them'''
+    changed = [result for result in results
+               if (result.error is None) and (result.analyze or result.vacuum)]
+    failed = [result for result in results if result.error is not None]
+
+    if dry_run:
+        counts = 'Directories: {0} checked, {1} to analyze, {2} to vacuum, {3} to change page size, {4} failed\n'
+    else:
+        counts = 'Directories: {0} checked, {1} analyzed, {2} vacuumed, {3} page size changed, {4} failed\n'
+    out.write(counts.format(len(results),
+                            sum(result.analyze for result in changed),
+                            sum(result.vacuum for result in changed),
+                            sum(result.resize for result in changed),
+                            len(failed)))
+
+    for result in failed:
+        out.write('    {0}: {1}\n'.format(result.path, result.error))
+
+    if dry_run:
+        return
+
+    before = sum(result.before for result in changed)
+    after = sum(result.after for result in changed)
+    out.write('Bytes reclaimed: {0} ({1} -> {2})\n'.format(before - after, before, after))
+
+    timed = [result for result in changed if result.slower is not None]
+    if timed:
+        slower = sum(result.slower for result in timed)
+        faster = sum(result.faster for result in timed)
+        out.write('Scan time: {0:.3f}s -> {1:.3f}s ({2:.2f}x) reading the vacuumed databases from storage\n'.format(
+            slower, faster, slower / faster if faster > 0 else float('inf')))
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_maintenance',
+                                     description='Analyze, vacuum, and change the page size of the databases of an index')
+    parser.add_argument('action',
+                        choices=['check', 'run'],
+                        help='check: count the databases that need maintenance; '
+                        'run: maintain them and report the bytes reclaimed and the speedup')
+    parser.add_argument('paths',
+                        nargs='*',
+                        default=[''],
+                        help='directories under the index root (default: all of it)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets IndexRoot')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+    parser.add_argument('--analyze-rows',
+                        metavar='n',
+                        type=gufi_common.get_non_negative,
+                        default=ANALYZE_ROWS,
+                        help='analyze the databases of directories with at least this many entries')
+    parser.add_argument('--free-ratio',
+                        metavar='fraction',
+                        type=gufi_common.get_fraction,
+                        default=FREE_RATIO,
+                        help='vacuum databases with more than this fraction of free pages')
+    parser.add_argument('--page-size',
+                        metavar='bytes',
+                        type=get_page_size,
+                        default=None,
+                        help='rewrite databases with this page size')
+    parser.add_argument('--no-measure',
+                        dest='measure',
+                        action='store_false',
+                        help='do not time the scan of each database before and after')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+    dry_run = args.action == 'check'
+
+    dirs = []
+    for path in args.paths:
+        dirs += [directory.path for directory in
+                 gufi_index.walk(os.path.normpath(os.path.sep.join([config.indexroot, path])), skip)]
+
+    results = gufi_index.map_threads(
+        lambda path: maintain(path, args.analyze_rows, args.free_ratio, args.page_size,
+                              dry_run, args.measure),
+        dirs, config.threads)
+
+    report(results, sys.stdout, dry_run)
+
+    return 1 if any(result.error is not None for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,248 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# sidecar database holding the summary row of every index directory
+#
+# statistics that only read the summary row of each directory, such as
+# gufi_stats dirs-per-level or total-dircount, otherwise open the
+# database of every directory in the index. this sidecar keeps a copy
+# of each directory's summary row next to its path, so these
+# statistics become a single query of one database:
+#
+#     gufi_mirror.py update [path ...]
+#
+# the sidecar is built from the index by a user that can read all of
+# it, and lists the paths and summaries of the index directories, so
+# it should only be readable by users that are allowed to see them.
+#
+# updates only reread the directories whose database files have
+# changed since the previous update. queries trust the sidecar, so it
+# should be updated whenever the index is.
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import gufi_config
+import gufi_index
+import gufi_sidecar
+import gufi_stats_cache
+
+# columns of the summary table (see src/dbutils.c)
+COLUMNS = [
+    'name', 'type', 'inode', 'mode', 'nlink', 'uid', 'gid', 'size',
+    'blksize', 'blocks', 'atime', 'mtime', 'ctime', 'linkname',
+    'xattr_names', 'totfiles', 'totlinks', 'minuid', 'maxuid', 'mingid',
+    'maxgid', 'minsize', 'maxsize', 'totzero', 'totltk', 'totmtk',
+    'totltm', 'totmtm', 'totmtg', 'totmtt', 'totsize', 'minctime',
+    'maxctime', 'minmtime', 'maxmtime', 'minatime', 'maxatime',
+    'minblocks', 'maxblocks', 'totxattr', 'depth', 'mincrtime',
+    'maxcrtime', 'minossint1', 'maxossint1', 'totossint1', 'minossint2',
+    'maxossint2', 'totossint2', 'minossint3', 'maxossint3', 'totossint3',
+    'minossint4', 'maxossint4', 'totossint4', 'rectype', 'pinode',
+    'isroot', 'rollupscore',
+]
+
+# the summary rows are keyed on dirs.id
+SUMMARY = '''
+CREATE TABLE IF NOT EXISTS summary(dir INTEGER PRIMARY KEY, {0});
+CREATE INDEX IF NOT EXISTS summary_uid_idx ON summary(uid);
+'''.format(', '.join(COLUMNS))
+
+READ = 'SELECT {0} FROM summary WHERE isroot == 1;'.format(', '.join(COLUMNS))
+
+# level of a directory below the index root
+LEVEL = '''CASE dirs.path WHEN '' THEN 0 ELSE length(dirs.path) - length(replace(dirs.path, '/', '')) + 1 END'''
+
+def read_directory(path):
+    '''return the summary row of an index directory and its rollup score'''
+    db = gufi_index.open_db(path)
+    try:
+        row = db.execute(READ).fetchone()
+        return row, gufi_sidecar.rollupscore(db)
+    finally:
+        db.close()
+
+class SummaryMirror(gufi_sidecar.Sidecar):
+    '''summary rows of every directory of a GUFI index'''
+
+    NAME    = 'Summary mirror'
+    VERSION = 1
+    SCHEMA  = SUMMARY
+    TABLES  = ['summary']
+
+    def read(self, path):
+        return read_directory(path)
+
+    def store(self, dir_id, content):
+        if content is not None:
+            self.db.execute('INSERT INTO summary VALUES (?, {0});'.format(', '.join('?' * len(COLUMNS))),
+                            (dir_id,) + tuple(content))
+
+    def merge(self, path, key, value, sql, where=None, skip=None, functions=None, group_depth=None): # pylint: disable=too-many-arguments
+        '''
+        Compute a statistic from the summary rows of the directories
+        under a path
+
+        The key and value of each directory are selected into the
+        table read by the merge query, like the partial results of
+        gufi_stats_cache.StatsCache.merge.
+
+        Args:
+            path:        index directory whose subtree is merged
+            key:         expression of the summary columns
+            value:       expression of the summary columns
+            sql:         merge query
+            where:       conditions on the summary columns
+            skip:        directory basenames to not descend into
+            functions:   dictionary of name -> (argument count, function)
+                         to make available to the expressions and the merge query
+            group_depth: depth below the path of the directories to group by
+
+        Returns:
+            list of rows, or None if the sidecar does not have every
+            directory under the path
+        '''
+
+        if (not self.known(path)) or self.incomplete(path):
+            return None
+
+        rel = gufi_index.relpath(path, self.indexroot)
+        start = gufi_index.depth(rel)
+        skip = gufi_index.SKIP | set(skip or [])
+
+        for name, (argc, func) in (functions or {}).items():
+            self.db.create_function(name, argc, func)
+
+        self.db.create_function('ancestor', 1, gufi_stats_cache.grouping(rel, group_depth))
+        self.db.create_function('skipped', 1,
+                                lambda dir_path: int(bool(skip & set(dir_path.split(os.path.sep)[start:]))))
+
+        self.db.execute('DROP TABLE IF EXISTS temp.{0};'.format(gufi_stats_cache.SELECTED))
+        self.db.execute('CREATE TEMP TABLE {0}(grp TEXT, level INTEGER, key, value);'.format(gufi_stats_cache.SELECTED))
+        self.db.execute('''INSERT INTO temp.{0}
+                           SELECT ancestor(dirs.path), {1} - :start, rows.key, rows.value
+                           FROM dirs, (SELECT dir, {2} AS key, {3} AS value FROM summary WHERE {4}) AS rows
+                           WHERE (rows.dir == dirs.id) AND {5} AND (skipped(dirs.path) == 0);'''.format(
+                               gufi_stats_cache.SELECTED, LEVEL, key, value,
+                               ' AND '.join(['({0})'.format(cond) for cond in where or []]) or '1',
+                               gufi_index.UNDER),
+                        {'rel': rel, 'start': start})
+
+        return self.db.execute(sql).fetchall()
+
+def open_mirror(config):
+    '''
+    Open the summary mirror set in a server config for reading
+
+    Returns:
+        SummaryMirror, or None if it could not be opened
+    '''
+
+    try:
+        return SummaryMirror(config.summarymirror, config.indexroot, readonly=True)
+    except (RuntimeError, sqlite3.Error) as err:
+        sys.stderr.write('Not using summary mirror {0}: {1}\n'.format(config.summarymirror, err))
+        return None
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_mirror',
+                                     description='Maintain the mirror of the summary rows of the index')
+    parser.add_argument('action',
+                        choices=['update'],
+                        help='update: reread the directories whose databases have changed')
+    parser.add_argument('paths',
+                        nargs='*',
+                        default=[''],
+                        help='directories under the index root to update (default: all of it)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets SummaryMirror')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    if config.summarymirror is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.SUMMARYMIRROR, args.config))
+        return 1
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+
+    mirror = SummaryMirror(config.summarymirror, config.indexroot)
+    try:
+        for path in args.paths:
+            path = os.path.normpath(os.path.sep.join([config.indexroot, path]))
+            read, reused, removed = mirror.update(path, skip, config.threads)
+            print('{0}: {1} read, {2} unchanged, {3} removed'.format(path, read, reused, removed))
+    finally:
+        mirror.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,576 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# typed, columnar output of gufi_query results
+#
+# gufi_query prints its results as delimited text, which whatever
+# reads the results has to parse again. these functions convert the
+# rows as they are streamed from gufi_query into formats that keep
+# the type of each column:
+#
+#     arrow:  Apache Arrow IPC file written one record batch at a time
+#             (requires pyarrow)
+#     npy:    NumPy structured array that can be memory mapped
+#             (text is fixed width, so long text makes large files)
+#     sqlite: SQLite database containing a single table
+#
+# the names and types of the columns are found by creating a table
+# from the statement that prints the results (-G, otherwise -E or -S)
+# with the tables created by -I and -K and the database of a directory
+# of the index available.
+
+import io
+import itertools
+import marshal
+import os
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+
+import gufi_common
+import gufi_explain
+
+# name of the table in SQLite output
+TABLE = 'results'
+
+# name of the table used to find the columns of the output
+PROBE = 'probe'
+
+# number of rows converted at once
+BATCH_SIZE = 1 << 16
+
+NPY_MAGIC = '\x93NUMPY'.encode('latin-1')
+
+# longest text, in characters, that npy output stores. every row takes
+# 4 bytes per character of the longest value of each text column, so a
+# single long value makes every row of the array that much larger.
+# PATH_MAX is 4096 bytes, so paths always fit.
+NPY_MAX_WIDTH = 4096
+
+# the SQLite type of each Python type of a value
+NPY_KINDS = {
+    type(None) : 'null',
+    int        : 'integer',
+    float      : 'real',
+    bytes      : 'blob',
+}
+if sys.version_info.major < 3:
+    NPY_KINDS[long] = 'integer' # pylint: disable=undefined-variable
+
+# the header of a .npy file is padded to a multiple of this many bytes
+NPY_ALIGNMENT = 64
+
+def quote(name):
+    return '"{0}"'.format(name.replace('"', '""'))
+
+def printer(query_cmd):
+    '''get the statement that prints the results of a gufi_query command'''
+    sql = gufi_explain.statements(query_cmd)
+    if '-G' in sql:
+        return sql['-G']
+    for flag in ['-E', '-S']:
+        if (flag in sql) and (not sql[flag].lstrip().upper().startswith('INSERT')):
+            return sql[flag]
+    return None
+
+def schema(query_cmd, path):
+    '''
+    Get the columns a gufi_query command prints
+
+    Args:
+        query_cmd: gufi_query command as a list, including the paths
+        path:      index directory the query starts at
+
+    Returns:
+        list of (name, declared type). Columns computed by expressions
+        without an affinity have an empty declared type.
+
+    Raises:
+        ValueError if the columns could not be found
+    '''
+
+    select = printer(query_cmd)
+    if select is None:
+        raise ValueError('the query does not print anything')
+
+    dirname = gufi_explain.representative(path)
+    if (dirname is None) and ('-G' not in query_cmd[:-1]):
+        raise ValueError('could not find a database at or under {0}'.format(path))
+
+    try:
+        db, errors = gufi_explain.connect(query_cmd, dirname)
+    except sqlite3.Error as err:
+        raise ValueError(str(err))
+
+    try:
+        if errors:
+            raise ValueError(errors[0])
+
+        db.execute('CREATE TEMP TABLE {0} AS SELECT * FROM ({1}) LIMIT 0;'.format(
+            PROBE, select.strip().rstrip(';')))
+
+        return [(name, declared)
+                for _, name, declared, _, _, _ in db.execute('PRAGMA temp.table_info({0});'.format(PROBE))]
+    except sqlite3.Error as err:
+        raise ValueError(str(err))
+    finally:
+        db.close()
+
+def converters(columns):
+    '''
+    Get the functions that convert the printed columns into Python values
+
+    Columns without a declared type are converted to whichever of
+    integer, real, and text each value looks like.
+    '''
+    return [gufi_common.affinity(declared) if declared else gufi_common.to_numeric
+            for _, declared in columns]
+
+def unique(columns):
+    '''rename columns whose names have already been used'''
+    seen = set()
+    out = []
+    for name, declared in columns:
+        new_name = name
+        i = 1
+        while new_name in seen:
+            new_name = '{0}_{1}'.format(name, i)
+            i += 1
+        seen.add(new_name)
+        out += [(new_name, declared)]
+    return out
+
+def batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch += [row]
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def storable(value):
+    '''text that is not valid UTF-8 is stored as a blob'''
+    try:
+        value.encode('utf-8')
+        return value
+    except (AttributeError, UnicodeError):
+        pass
+    try:
+        return value.encode('utf-8', 'surrogateescape')
+    except (AttributeError, UnicodeError):
+        return value
+
+def stage(columns, rows, filename):
+    '''
+    Insert rows into a table of a SQLite database
+
+    Returns:
+        the number of rows inserted
+    '''
+
+    db = sqlite3.connect(filename, isolation_level=None)
+    try:
+        db.execute('PRAGMA journal_mode = MEMORY;')
+        db.execute('PRAGMA synchronous = OFF;')
+        db.execute('CREATE TABLE {0} ({1});'.format(
+            TABLE, ', '.join('{0} {1}'.format(quote(name), declared).strip() for name, declared in columns)))
+
+        insert = 'INSERT INTO {0} VALUES ({1});'.format(TABLE, ', '.join(['?'] * len(columns)))
+
+        count = 0
+        db.execute('BEGIN;')
+        for batch in batches(rows):
+            db.execute('SAVEPOINT batch;')
+            try:
+                db.executemany(insert, batch)
+            except UnicodeError:
+                db.execute('ROLLBACK TO batch;')
+                db.executemany(insert, [[storable(value) for value in row] for row in batch])
+            db.execute('RELEASE batch;')
+            count += len(batch)
+        db.execute('COMMIT;')
+
+        return count
+    finally:
+        db.close()
+
+def temporary_db():
+    fd, filename = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    return filename
+
+def empty_file(out):
+    '''get the name of the file behind out if SQLite can write to it directly'''
+    name = getattr(out, 'name', None)
+    try:
+        if (not isinstance(name, str)) or (out.tell() != 0):
+            return None
+        st = os.fstat(out.fileno())
+        if (st.st_size != 0) or (not os.path.samestat(st, os.stat(name))):
+            return None
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+    return name
+
+def write_sqlite(columns, rows, out):
+    '''
+    A SQLite database can only be built in a file that can be
+    seeked, so the rows are written directly into out when it is an
+    empty regular file and are staged in a temporary database that is
+    copied into out otherwise (e.g. when writing to a pipe).
+    '''
+
+    filename = empty_file(out)
+    if filename is not None:
+        stage(columns, rows, filename)
+        return
+
+    filename = temporary_db()
+    try:
+        stage(columns, rows, filename)
+        with open(filename, 'rb') as db:
+            shutil.copyfileobj(db, out)
+    finally:
+        os.remove(filename)
+
+def npy_field(kinds, width):
+    '''
+    Get the NumPy type of a column from the SQLite types of its values
+
+    Integer columns with NULLs are stored as reals, with NULLs as NaN.
+    Text is stored as fixed width UTF-32, with NULLs as empty strings,
+    so every value takes as much space as the longest one.
+    '''
+
+    if ('text' in kinds) or ('blob' in kinds):
+        return '<U{0}'.format(max(width, 1))
+    if ('real' in kinds) or ('null' in kinds) or (not kinds):
+        return '<f8'
+    return '<i8'
+
+def npy_header(descr, count):
+    '''
+    Build the header of a .npy file containing a one dimensional
+    structured array
+
+    https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html
+    '''
+
+    header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}".format(descr, count)
+
+    # version 1.0 headers are latin-1 and at most 65535 bytes long
+    try:
+        encoded = header.encode('latin-1')
+        versions = [(1, 0, '<H'), (2, 0, '<I')]
+    except UnicodeError:
+        encoded = header.encode('utf-8')
+        versions = [(3, 0, '<I')]
+
+    for major, minor, size_format in versions:
+        prefix = len(NPY_MAGIC) + 2 + struct.calcsize(size_format)
+        pad = -(prefix + len(encoded) + 1) % NPY_ALIGNMENT
+        padded = encoded + ' '.encode('latin-1') * pad + '\n'.encode('latin-1')
+        if len(padded) < (1 << (8 * struct.calcsize(size_format))):
+            break
+
+    return NPY_MAGIC + bytes(bytearray([major, minor])) + struct.pack(size_format, len(padded)) + padded
+
+def npy_value(field, value):
+    if field == '<i8':
+        return value
+    if field == '<f8':
+        return float('nan') if value is None else float(value)
+    if value is None:
+        return ''.encode('latin-1')
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'surrogateescape')
+    return '{0}'.format(value).encode('utf-32-le', 'surrogatepass')
+
+def npy_width(value):
+    '''number of characters a value takes in a text column'''
+    if value is None:
+        return 0
+    if isinstance(value, bytes):
+        return len(value.decode('utf-8', 'surrogateescape'))
+    return len('{0}'.format(value))
+
+def write_npy(columns, rows, out, max_width=NPY_MAX_WIDTH): # pylint: disable=too-many-locals
+    '''
+    The number of rows and the width of the text columns have to be
+    known before the array can be written, so the batches are spooled
+    into a temporary file as they arrive and packed once the types of
+    the columns are known.
+
+    Raises:
+        ValueError if a text column has a value longer than max_width
+        characters (use arrow or sqlite output instead)
+    '''
+
+    kinds = [set() for _ in columns]
+    widths = [0] * len(columns)
+    count = 0
+    spooled_batches = 0
+
+    spooled = tempfile.TemporaryFile()
+    try:
+        for batch in batches(rows):
+            for i, values in enumerate(zip(*batch)):
+                kinds[i].update(NPY_KINDS.get(type(value), 'text') for value in values)
+                widths[i] = max([widths[i]] + [npy_width(value) for value in values])
+            marshal.dump(batch, spooled)
+            count += len(batch)
+            spooled_batches += 1
+
+        fields = [npy_field(kind, width) for kind, width in zip(kinds, widths)]
+        for (name, _), field, width in zip(columns, fields, widths):
+            if field.startswith('<U') and (width > max_width):
+                raise ValueError('column {0} has text that is {1} characters long, '
+                                 'longer than the {2} characters npy output stores'.format(
+                                     name, width, max_width))
+
+        out.write(npy_header([(name, field) for (name, _), field in zip(columns, fields)], count))
+
+        row_format = struct.Struct('<' + ''.join(
+            'q' if field == '<i8' else
+            'd' if field == '<f8' else
+            '{0}s'.format(4 * int(field[2:]))
+            for field in fields))
+
+        spooled.seek(0)
+        for _ in range(spooled_batches):
+            out.write(''.encode('latin-1').join(
+                row_format.pack(*[npy_value(field, value) for field, value in zip(fields, row)])
+                for row in marshal.load(spooled)))
+    finally:
+        spooled.close()
+
+def arrow_type(pyarrow, values):
+    '''
+    Get the type of a column without a declared type from its values
+
+    Any text makes the column text. Otherwise, any real makes the
+    column real.
+    '''
+
+    kinds = set(type(value) for value in values if value is not None)
+    if not kinds.issubset(set([int, float])):
+        return pyarrow.string()
+    if float in kinds:
+        return pyarrow.float64()
+    return pyarrow.int64()
+
+def arrow_array(pyarrow, values, column_type):
+    if column_type == pyarrow.string():
+        values = [value if (value is None) or isinstance(value, str) else
+                  '{0}'.format(value)
+                  for value in values]
+
+    try:
+        return pyarrow.array(values, type=column_type)
+    except UnicodeError:
+        # Arrow strings have to be valid UTF-8
+        return pyarrow.array([value if value is None else
+                              value.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
+                              for value in values], type=column_type)
+
+def write_arrow(columns, rows, out):
+    '''
+    Columns without a declared type get their type from their values
+    in the first batch. Text that is not valid UTF-8 is written with
+    replacement characters.
+    '''
+
+    try:
+        import pyarrow # pylint: disable=import-outside-toplevel,import-error
+    except ImportError:
+        raise RuntimeError('Arrow output requires pyarrow') # pylint: disable=raise-missing-from
+
+    declared = {
+        gufi_common.to_integer : pyarrow.int64(),
+        gufi_common.to_real    : pyarrow.float64(),
+        gufi_common.to_text    : pyarrow.string(),
+        gufi_common.to_blob    : pyarrow.binary(),
+    }
+
+    column_types = [declared.get(convert) for convert in converters(columns)]
+
+    writer = None
+    try:
+        for batch in batches(rows):
+            values = list(zip(*batch))
+
+            if writer is None:
+                column_types = [column_type or arrow_type(pyarrow, column)
+                                for column, column_type in zip(values, column_types)]
+                arrow_schema = pyarrow.schema([pyarrow.field(name, column_type)
+                                               for (name, _), column_type in zip(columns, column_types)])
+                writer = pyarrow.ipc.new_file(out, arrow_schema)
+
+            try:
+                arrays = [arrow_array(pyarrow, column, column_type)
+                          for column, column_type in zip(values, column_types)]
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as err:
+                raise ValueError(str(err))
+
+            writer.write_batch(pyarrow.record_batch(arrays, schema=arrow_schema))
+
+        # no rows
+        if writer is None:
+            writer = pyarrow.ipc.new_file(out, pyarrow.schema([
+                pyarrow.field(name, column_type or pyarrow.string())
+                for (name, _), column_type in zip(columns, column_types)]))
+    finally:
+        if writer is not None:
+            writer.close()
+
+WRITERS = {
+    'arrow'  : write_arrow,
+    'npy'    : write_npy,
+    'sqlite' : write_sqlite,
+}
+
+def output_file(out):
+    '''get the binary version of a file object'''
+    return getattr(out, 'buffer', out)
+
+def write_rows(fmt, rows, out, columns=None):
+    '''
+    Write rows in one of gufi_common.OUTPUT_FORMATS
+
+    Args:
+        fmt:     one of gufi_common.OUTPUT_FORMATS
+        rows:    iterable of row tuples
+        out:     binary file to write to
+        columns: list of (name, declared type) (default: named after
+                 their positions, without declared types)
+    '''
+
+    rows = iter(rows)
+    if columns is None:
+        first = next(rows, None)
+        if first is not None:
+            rows = itertools.chain([first], rows)
+        columns = [('column{0}'.format(i + 1), '')
+                   for i in range(len(first) if first else 1)]
+
+    WRITERS[fmt](unique(columns), rows, out)
+    out.flush()
+
+def write(fmt, rows, out=None, columns=None):
+    '''
+    Write rows that did not come from gufi_query
+
+    Returns:
+        0 on success, 1 if the rows could not be written
+    '''
+
+    try:
+        write_rows(fmt, rows, output_file(out or sys.stdout), columns)
+    except (RuntimeError, ValueError, sqlite3.Error) as err:
+        sys.stderr.write('Could not write {0} output: {1}\n'.format(fmt, err))
+        return 1
+
+    return 0
+
+def query(fmt, query_cmd, paths, out=None):
+    '''
+    Run a gufi_query command and write its results in one of
+    gufi_common.OUTPUT_FORMATS
+
+    Args:
+        fmt:       one of gufi_common.OUTPUT_FORMATS
+        query_cmd: gufi_query command without the paths
+        paths:     index directories being queried
+        out:       file to write to (default: stdout)
+
+    Returns:
+        the return code of gufi_query, or 1 if the results could not
+        be written
+    '''
+
+    try:
+        columns = schema(query_cmd + paths, paths[0])
+    except ValueError as err:
+        sys.stderr.write('Could not find the columns of the output: {0}\n'.format(err))
+        return 1
+
+    # use a delimiter that does not appear in paths
+    cmd = list(query_cmd)
+    if '-d' in cmd:
+        cmd[cmd.index('-d') + 1] = 'x'
+
+    try:
+        write_rows(fmt, gufi_common.stream_rows(cmd + paths, converters(columns)),
+                   output_file(out or sys.stdout), columns)
+    except subprocess.CalledProcessError as err:
+        return err.returncode
+    except (RuntimeError, ValueError, sqlite3.Error) as err:
+        sys.stderr.write('Could not write {0} output: {1}\n'.format(fmt, err))
+        return 1
+
+    return 0
@@ -0,0 +1,277 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# sidecar database mapping each uid and gid to the index directories
+# containing entries they own
+#
+# queries restricted to one owner, such as gufi_find -user or
+# gufi_stats --uid, otherwise have to read the entries of every
+# directory. this sidecar keeps the number of entries and the total
+# size of the entries each owner has in each directory, so that only
+# the directories with entries of the owner have to be queried, and
+# the usage of an owner under a directory can be summed without
+# reading the index at all.
+#
+# the sidecar is built from the index by a user that can read all of
+# it, and lists the paths of the index directories along with who owns
+# what under them, so it should only be readable by users that are
+# allowed to see all of that:
+#
+#     gufi_owners.py update [path ...]
+#     gufi_owners.py usage --uid 1000 [path ...]
+#
+# updates only reread the directories whose database files have
+# changed since the previous update. queries trust the sidecar, so it
+# should be updated whenever the index is.
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import gufi_common
+import gufi_config
+import gufi_index
+import gufi_sidecar
+
+UID = 'u'
+GID = 'g'
+
+# the directory itself is listed under its owners with a count of 0
+OWNERS = '''
+CREATE TABLE IF NOT EXISTS owners(kind TEXT, owner INTEGER, dir INTEGER, count INTEGER, size INTEGER, PRIMARY KEY (kind, owner, dir)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS owners_dir_idx ON owners(dir);
+'''
+
+ENTRIES = '''
+SELECT '{0}', uid, COUNT(*), TOTAL(size) FROM entries GROUP BY uid
+UNION ALL
+SELECT '{1}', gid, COUNT(*), TOTAL(size) FROM entries GROUP BY gid;
+'''.format(UID, GID)
+
+SUMMARY = 'SELECT uid, gid FROM summary WHERE isroot == 1;'
+
+def read_directory(path):
+    '''
+    Return the number of entries and their total size for each owner
+    of the entries in an index directory, and its rollup score
+    '''
+
+    db = gufi_index.open_db(path)
+    try:
+        owners = {}
+        for kind, owner, count, size in db.execute(ENTRIES):
+            owners[(kind, owner)] = (count, int(size))
+
+        row = db.execute(SUMMARY).fetchone()
+        if row is not None:
+            owners.setdefault((UID, row[0]), (0, 0))
+            owners.setdefault((GID, row[1]), (0, 0))
+
+        return owners, gufi_sidecar.rollupscore(db)
+    finally:
+        db.close()
+
+class OwnerIndex(gufi_sidecar.Sidecar):
+    '''owners of the entries in each directory of a GUFI index'''
+
+    NAME    = 'Owner index'
+    VERSION = 1
+    SCHEMA  = OWNERS
+    TABLES  = ['owners']
+
+    def read(self, path):
+        return read_directory(path)
+
+    def store(self, dir_id, content):
+        self.db.executemany('INSERT INTO owners VALUES (?, ?, ?, ?, ?);',
+                            [(kind, owner, dir_id, count, size)
+                             for (kind, owner), (count, size) in content.items()])
+
+    def with_owner(self, path, kind, owner):
+        '''ids of the directories under a path that have entries of an owner, or are owned by it'''
+        return set(dir_id for dir_id, in self.db.execute(
+            '''SELECT dirs.id FROM owners, dirs
+               WHERE (owners.dir == dirs.id) AND (owners.kind == :kind) AND (owners.owner == :owner) AND {0};'''.format(
+                   gufi_index.UNDER),
+            {'rel': gufi_index.relpath(path, self.indexroot),
+             'kind': kind,
+             'owner': owner}))
+
+    def usage(self, path, kind, owner):
+        '''number of entries and total size of an owner under a path'''
+        count, size = self.db.execute(
+            '''SELECT TOTAL(owners.count), TOTAL(owners.size) FROM owners, dirs
+               WHERE (owners.dir == dirs.id) AND (owners.kind == :kind) AND (owners.owner == :owner) AND {0};'''.format(
+                   gufi_index.UNDER),
+            {'rel': gufi_index.relpath(path, self.indexroot),
+             'kind': kind,
+             'owner': owner}).fetchone()
+        return int(count), int(size)
+
+def open_index(config):
+    '''
+    Open the owner index set in a server config for reading
+
+    Returns:
+        OwnerIndex, or None if it could not be opened
+    '''
+
+    try:
+        return OwnerIndex(config.ownerindex, config.indexroot, readonly=True)
+    except (RuntimeError, sqlite3.Error) as err:
+        sys.stderr.write('Not using owner index {0}: {1}\n'.format(config.ownerindex, err))
+        return None
+
+def matching(index, path, uids=None, gids=None):
+    '''
+    Find the ids of the directories under a path that can contain
+    entries owned by every uid and gid
+
+    Returns:
+        set of directory ids, or None if no owner was given
+    '''
+
+    found = None
+    for kind, owners in [(UID, uids), (GID, gids)]:
+        for owner in owners or []:
+            ids = index.with_owner(path, kind, owner)
+            found = ids if found is None else (found & ids)
+
+    return found
+
+def candidates(index, paths, skip=None, mindepth=None, maxdepth=None, limit=gufi_sidecar.MAX_CANDIDATES, **owners): # pylint: disable=too-many-arguments
+    '''
+    Find the directories gufi_query has to be started at, with a
+    maximum depth of 0, to get the same results as walking the paths
+    (see gufi_sidecar.candidates)
+
+    Args:
+        owners: uids and gids passed to matching
+
+    Returns:
+        list of index directories, or None if the sidecar cannot be used
+    '''
+
+    return gufi_sidecar.candidates(index, paths,
+                                   lambda path: matching(index, path, **owners),
+                                   skip, mindepth, maxdepth, limit)
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_owners',
+                                     description='Maintain the index of the directories containing entries of each owner')
+    parser.add_argument('action',
+                        choices=['update', 'usage'],
+                        help='update: reread the directories whose databases have changed; '
+                        'usage: print the number of entries and bytes of an owner')
+    parser.add_argument('paths',
+                        nargs='*',
+                        default=[''],
+                        help='directories under the index root (default: all of it)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets OwnerIndex')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+    owner = parser.add_mutually_exclusive_group()
+    owner.add_argument('--uid', '--user',
+                       dest='uid',
+                       type=gufi_common.get_user,
+                       help='user name or uid to print the usage of')
+    owner.add_argument('--gid', '--group',
+                       dest='gid',
+                       type=gufi_common.get_group,
+                       help='group name or gid to print the usage of')
+
+    args = parser.parse_args(argv[1:])
+
+    if (args.action == 'usage') and (args.uid is None) and (args.gid is None):
+        parser.error('usage needs --uid or --gid')
+
+    config = gufi_config.Server(args.config)
+    if config.ownerindex is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.OWNERINDEX, args.config))
+        return 1
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+
+    index = OwnerIndex(config.ownerindex, config.indexroot, readonly=(args.action == 'usage'))
+    try:
+        for path in args.paths:
+            path = os.path.normpath(os.path.sep.join([config.indexroot, path]))
+            if args.action == 'update':
+                read, reused, removed = index.update(path, skip, config.threads)
+                print('{0}: {1} read, {2} unchanged, {3} removed'.format(path, read, reused, removed))
+            else:
+                kind, value = (UID, args.uid) if args.uid is not None else (GID, args.gid)
+                count, size = index.usage(path, kind, value)
+                print('{0}: {1} entries, {2} bytes'.format(path, count, size))
+    finally:
+        index.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,460 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# read the database files of an index subtree into the page cache
+#
+# the first query of a subtree is dominated by reading cold db.db files.
+# this walks the subtree breadth first and asks the kernel to read each
+# database ahead with posix_fadvise(POSIX_FADV_WILLNEED), using a
+# bounded number of threads and staying a bounded number of directories
+# ahead of the walk. gufi_query processes directories from work queues
+# in parallel, so it does not follow a strict breadth first order, but
+# it also reaches each directory after its parent, so the databases
+# near the top of the subtree, which it reads first, are read ahead
+# first.
+#
+# posix_fadvise returns as soon as the reads are queued, so neither the
+# threads nor the lookahead bound how far ahead of gufi_query the reads
+# get. when prefetching for a command, the bytes prefetched are paced
+# against the bytes the command has read (rchar in /proc/<pid>/io), so
+# the page cache is not filled with databases that would be evicted
+# again before gufi_query gets to them.
+#
+# gufi_find and gufi_stats --prefetch run this alongside gufi_query.
+#
+#     gufi_prefetch.py prefetch [paths]
+#     gufi_prefetch.py evict [paths]
+#     gufi_prefetch.py benchmark [paths]
+#
+# evict drops the database files from the page cache without root, so
+# benchmark can compare the cold cache latency of a gufi_query scan with
+# and without prefetching. filesystems that cache on their servers may
+# still have the data, so drop those caches too when measuring them.
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+if sys.version_info.major < 3:
+    import Queue as queue # pylint: disable=import-error
+else:
+    import queue
+
+import gufi_catalog
+import gufi_common
+import gufi_config
+import gufi_index
+
+# directories the walk may get ahead of the threads reading databases
+LOOKAHEAD = 1024
+
+# bytes prefetching may get ahead of the command reading the databases
+WINDOW = 256 << 20
+
+# seconds between checks of how much the command has read
+PACE_INTERVAL = 0.01
+
+# number of times benchmark times each scan
+REPEAT = 3
+
+# bytes read at a time when posix_fadvise is not available
+CHUNK = 1 << 20
+
+# seconds between checks for being stopped
+INTERVAL = 0.1
+
+# the queries benchmark times gufi_query with
+BENCHMARK_QUERY = ['-S', 'SELECT name FROM {0};'.format(gufi_common.SUMMARY),
+                   '-E', 'SELECT name FROM {0};'.format(gufi_common.ENTRIES)]
+
+def prefetch(dbname):
+    '''
+    start reading a database file into the page cache
+
+    Returns:
+        size of the file in bytes
+    '''
+
+    fd = os.open(dbname, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, st.st_size, os.POSIX_FADV_WILLNEED)
+            return st.st_size
+
+        # os.posix_fadvise was added in Python 3.3 and is not available on
+        # every platform, so read the file and put its access time back
+        while os.read(fd, CHUNK):
+            pass
+    finally:
+        os.close(fd)
+
+    os.utime(dbname, (st.st_atime, st.st_mtime))
+    return st.st_size
+
+def evict(dbname):
+    '''
+    drop a database file from the page cache
+
+    Returns:
+        size of the file in bytes
+    '''
+
+    if not hasattr(os, 'posix_fadvise'):
+        raise RuntimeError('Evicting files from the page cache requires posix_fadvise')
+
+    fd = os.open(dbname, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        os.posix_fadvise(fd, 0, size, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return size
+
+def databases(paths, skip=None, mindepth=None, maxdepth=None):
+    '''database files under paths, breadth first (see gufi_index.walk)'''
+    for path in paths:
+        for directory in gufi_index.walk(path, skip, maxdepth):
+            if (mindepth is None) or (directory.level >= mindepth):
+                yield os.path.join(directory.path, gufi_index.DBNAME)
+
+class Consumer(object): # pylint: disable=useless-object-inheritance
+    '''
+    Passed to run_command as its progress to find the process reading
+    the databases, forwarding to the progress of the caller, if any
+    '''
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.pid = None
+
+    def start(self, pid):
+        self.pid = pid
+        if self.progress is not None:
+            self.progress.start(pid)
+
+    def stop(self):
+        if self.progress is not None:
+            self.progress.stop()
+
+class Prefetcher(object): # pylint: disable=useless-object-inheritance,too-many-instance-attributes
+    '''
+    Prefetch the databases of a subtree with a pool of threads while
+    something else runs
+
+    run can be used in place of gufi_common.run_command to prefetch the
+    databases a gufi_query command is about to read. While the command
+    runs, prefetching stays at most window bytes ahead of what the
+    command has read.
+    '''
+
+    def __init__(self, paths, threads, skip=None, mindepth=None, maxdepth=None, # pylint: disable=too-many-arguments
+                 run_command=gufi_common.run_command, lookahead=LOOKAHEAD, window=WINDOW):
+        self.paths = paths
+        self.threads = max(threads, 1)
+        self.skip = skip
+        self.mindepth = mindepth
+        self.maxdepth = maxdepth
+        self.run_command = run_command
+        self.queue = queue.Queue(lookahead)
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.window = window
+        self.consumer = None
+        self.walker = None
+        self.workers = []
+        self.files = 0
+        self.bytes = 0
+
+    def put(self, dbname):
+        while not self.done.is_set():
+            try:
+                self.queue.put(dbname, timeout=INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def walk(self):
+        try:
+            for dbname in databases(self.paths, self.skip, self.mindepth, self.maxdepth):
+                if self.done.is_set():
+                    break
+                self.put(dbname)
+        finally:
+            for _ in self.workers:
+                self.put(None)
+
+    def consumed(self):
+        '''
+        bytes the command reading the databases has read so far, 0 if it
+        has not started yet, or None if there is no such command or its
+        reads cannot be found
+        '''
+
+        if self.consumer is None:
+            return None
+        if self.consumer.pid is None:
+            return 0
+        return gufi_catalog.read_bytes(self.consumer.pid)
+
+    def reserve(self, size):
+        '''
+        wait until a database of size bytes can be prefetched without
+        getting more than window bytes ahead of the command
+
+        Returns:
+            False if prefetching was stopped while waiting
+        '''
+
+        while not self.done.is_set():
+            consumed = self.consumed()
+            with self.lock:
+                # always let one database through so a database larger
+                # than the window does not stop prefetching
+                if (consumed is None) or (self.bytes <= consumed) or \
+                   (self.bytes + size - consumed <= self.window):
+                    self.files += 1
+                    self.bytes += size
+                    return True
+            self.done.wait(PACE_INTERVAL)
+        return False
+
+    def work(self):
+        while not self.done.is_set():
+            try:
+                dbname = self.queue.get(timeout=INTERVAL)
+            except queue.Empty:
+                continue
+
+            if dbname is None:
+                break
+
+            try:
+                size = os.stat(dbname).st_size
+            except OSError:
+                continue
+
+            if not self.reserve(size):
+                break
+
+            try:
+                prefetch(dbname)
+            except OSError:
+                pass
+
+    def start(self):
+        '''start prefetching in the background'''
+        self.workers = [threading.Thread(target=self.work) for _ in range(self.threads)]
+        self.walker = threading.Thread(target=self.walk)
+        for thread in [self.walker] + self.workers:
+            thread.daemon = True
+            thread.start()
+
+    def wait(self):
+        '''wait for all of the databases to be prefetched'''
+        for thread in [self.walker] + self.workers:
+            thread.join()
+
+    def stop(self):
+        '''stop prefetching, leaving the rest of the databases alone'''
+        self.done.set()
+        self.wait()
+
+    def run(self, cmd, stdout=None, replace=False, trace=None, progress=None): # pylint: disable=too-many-arguments,unused-argument
+        '''
+        Run a command like gufi_common.run_command while prefetching
+
+        The process is never replaced, so prefetching continues while
+        the command runs.
+        '''
+
+        self.consumer = Consumer(progress)
+        self.start()
+        try:
+            return self.run_command(cmd, stdout, False, trace, self.consumer)
+        finally:
+            self.stop()
+
+def from_command(query_cmd, paths, threads, run_command=gufi_common.run_command):
+    '''
+    Prefetcher for the directories a gufi_query command will visit,
+    using its minimum and maximum levels (-y and -z) and skip file (-k)
+    '''
+
+    found = {'-y': None, '-z': None, '-k': None}
+    for flag, value in zip(query_cmd, query_cmd[1:]):
+        if flag in found:
+            found[flag] = value
+
+    return Prefetcher(paths, threads,
+                      skip=gufi_index.read_skip(found['-k']) if found['-k'] else None,
+                      mindepth=int(found['-y']) if found['-y'] else None,
+                      maxdepth=int(found['-z']) if found['-z'] is not None else None,
+                      run_command=run_command)
+
+def evict_all(paths, skip=None, maxdepth=None):
+    '''evict the databases under paths, returning the number of files and bytes'''
+    files = size = 0
+    for dbname in databases(paths, skip, None, maxdepth):
+        try:
+            size += evict(dbname)
+            files += 1
+        except OSError:
+            pass
+    return files, size
+
+def benchmark(config, paths, skip=None, maxdepth=None, out=sys.stdout, repeat=REPEAT): # pylint: disable=too-many-arguments
+    '''
+    time a gufi_query scan of paths with a cold page cache, without
+    and with prefetching
+
+    The scans alternate which one runs first, so neither always gets
+    the directory entries the other one left in the cache, and the
+    fastest of the repeated runs of each is reported.
+
+    Returns:
+        (seconds without prefetching, seconds with prefetching)
+    '''
+
+    query_cmd = [config.query, '-n', str(config.threads)] + BENCHMARK_QUERY
+    if maxdepth is not None:
+        query_cmd += ['-z', str(maxdepth)]
+
+    def prefetched(cmd, stdout):
+        return Prefetcher(paths, config.threads, skip, None, maxdepth).run(cmd, stdout)
+
+    elapsed = [[], []]
+    with open(os.devnull, 'wb') as devnull:
+        for i in range(max(repeat, 1)):
+            order = [(0, gufi_common.run_command), (1, prefetched)]
+            if i % 2:
+                order.reverse()
+
+            for which, run_command in order:
+                evict_all(paths, skip, maxdepth)
+                start = time.time()
+                rc = run_command(query_cmd + paths, devnull)
+                elapsed[which] += [time.time() - start]
+                if rc:
+                    raise subprocess.CalledProcessError(rc, query_cmd)
+
+    without, with_prefetch = min(elapsed[0]), min(elapsed[1])
+    out.write('Cold cache: {0:.3f}s (fastest of {1})\n'.format(without, len(elapsed[0])))
+    out.write('Cold cache with prefetching: {0:.3f}s ({1:.2f}x)\n'.format(
+        with_prefetch, without / with_prefetch if with_prefetch > 0 else float('inf')))
+    return without, with_prefetch
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_prefetch',
+                                     description='Read the databases of an index subtree into the page cache')
+    parser.add_argument('action',
+                        choices=['prefetch', 'evict', 'benchmark'],
+                        help='prefetch: read the databases into the page cache; '
+                        'evict: drop the databases from the page cache; '
+                        'benchmark: time gufi_query with a cold cache with and without prefetching')
+    parser.add_argument('paths',
+                        nargs='*',
+                        default=[''],
+                        help='directories under the index root (default: all of it)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets IndexRoot')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+    parser.add_argument('--maxdepth',
+                        metavar='levels',
+                        type=gufi_common.get_non_negative,
+                        help='do not descend more than this many levels below the paths')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+    paths = [os.path.normpath(os.path.sep.join([config.indexroot, path])) for path in args.paths]
+
+    try:
+        if args.action == 'benchmark':
+            benchmark(config, paths, skip, args.maxdepth)
+        elif args.action == 'evict':
+            files, size = evict_all(paths, skip, args.maxdepth)
+            print('Evicted {0} databases ({1} bytes)'.format(files, size))
+        else:
+            start = time.time()
+            prefetcher = Prefetcher(paths, config.threads, skip, None, args.maxdepth)
+            prefetcher.start()
+            prefetcher.wait()
+            print('Prefetched {0} databases ({1} bytes) in {2:.3f}s'.format(
+                prefetcher.files, prefetcher.bytes, time.time() - start))
+    except (RuntimeError, OSError, subprocess.CalledProcessError) as err:
+        sys.stderr.write('{0}\n'.format(err))
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
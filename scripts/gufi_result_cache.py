@@ -0,0 +1,375 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# cache of the output of gufi_query commands run by the scripts tools
+#
+# the output of a command is stored compressed, keyed on the command
+# line and the index root. each entry also records a fingerprint of the
+# part of the index the command reads so that entries are ignored once
+# any directory under the queried paths is added, removed, or
+# reindexed. query results depend on the permissions of the user
+# running the query, so each user gets a separate cache under the
+# cache directory.
+
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+import zlib
+
+import gufi_index
+
+# bump when the layout of the cache changes
+VERSION = 1
+
+# name of the database file in each user's cache directory
+DBNAME = 'results.db'
+
+# default maximum total size of the compressed outputs in bytes
+DEFAULT_SIZE = 256 << 20
+
+# number of bytes to read from gufi_query at a time
+CHUNK_SIZE = 1 << 16
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata(name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS results(key TEXT PRIMARY KEY, fingerprint TEXT, size INTEGER, used REAL, data BLOB);
+CREATE INDEX IF NOT EXISTS results_used_idx ON results(used);
+'''
+
+def key(cmd, indexroot):
+    '''identify a command run against an index root'''
+    return hashlib.sha256(json.dumps([os.path.normpath(indexroot)] + list(cmd)).encode('utf-8')).hexdigest()
+
+def watched(cmd):
+    '''
+    Get the deepest level a gufi_query command descends to and the
+    names of the external databases it attaches with -Q
+
+    Returns:
+        (maximum level or None, list of database basenames)
+    '''
+
+    max_level = None
+    basenames = [gufi_index.DBNAME]
+    for flag, value in zip(cmd, cmd[1:]):
+        if flag == '-z':
+            max_level = int(value)
+        elif flag == '-Q':
+            basenames += [value]
+    return max_level, basenames
+
+def fingerprint(indexroot, paths, cmd=None):
+    '''
+    Get a value that changes when any part of the index that a command
+    reads changes
+
+    The index root and every directory under the directories being
+    queried (down to the -z level of the command) are checked, along
+    with their database files and the external databases the command
+    attaches. Only file metadata is read, so this is much cheaper than
+    running the query, but it still visits every directory.
+
+    Args:
+        indexroot: root of the index
+        paths:     index directories being queried
+        cmd:       gufi_query command without the paths
+
+    Returns:
+        string
+    '''
+
+    max_level, basenames = watched(cmd or [])
+
+    state = hashlib.sha256()
+
+    def add(name):
+        try:
+            st = os.stat(name)
+            entry = [name, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size]
+        except OSError:
+            entry = [name, None]
+        state.update(json.dumps(entry).encode('utf-8'))
+
+    for path in [indexroot] + list(paths):
+        add(path)
+        add(os.path.join(path, gufi_index.DBNAME))
+
+    # directories that are added, removed, or reindexed below the paths
+    for path in paths:
+        for directory in gufi_index.walk(path, max_level=max_level):
+            add(directory.path)
+            for basename in basenames:
+                add(os.path.join(directory.path, basename))
+
+    return state.hexdigest()
+
+def user_directory(directory, uid):
+    '''
+    Create the cache directory of a user if it does not exist
+
+    Raises:
+        RuntimeError if the directory can be used by other users
+    '''
+
+    path = os.path.join(directory, str(uid))
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    st = os.lstat(path)
+    if (st.st_uid != uid) or (st.st_mode & 0o077):
+        raise RuntimeError('Result cache directory {0} is not private to uid {1}'.format(path, uid))
+
+    return path
+
+class ResultCache(object): # pylint: disable=useless-object-inheritance
+    '''
+    Compressed outputs of gufi_query commands of a single user
+
+    When the compressed outputs take up more than max_size bytes, the
+    least recently used outputs are dropped. Multiple processes may use
+    the same cache at the same time.
+    '''
+
+    def __init__(self, directory, max_size=DEFAULT_SIZE, timeout=60):
+        self.max_size = max_size
+        self.filename = os.path.join(user_directory(directory, os.geteuid()), DBNAME)
+
+        # autocommit so that transactions can be started explicitly
+        self.db = sqlite3.connect(self.filename, timeout=timeout, isolation_level=None)
+        try:
+            # allow readers while another process is writing
+            self.db.execute('PRAGMA journal_mode = WAL;')
+            self.db.executescript(SCHEMA)
+
+            self.db.execute('BEGIN IMMEDIATE;')
+            metadata = dict(self.db.execute('SELECT name, value FROM metadata;').fetchall())
+
+            # drop outputs stored with older layouts
+            if metadata.get('version') != str(VERSION):
+                self.db.execute('DELETE FROM results;')
+                self.db.execute('INSERT OR REPLACE INTO metadata VALUES (\'version\', ?);', (str(VERSION),))
+            self.db.execute('COMMIT;')
+        except sqlite3.Error:
+            self.db.close()
+            raise
+
+    def close(self):
+        self.db.close()
+
+    def get(self, name, current):
+        '''
+        Get a stored output
+
+        Args:
+            name:    key of the command
+            current: fingerprint of the index now
+
+        Returns:
+            the uncompressed output, or None if it was not found or the
+            index has changed since it was stored
+        '''
+
+        row = self.db.execute('SELECT fingerprint, data FROM results WHERE key == ?;', (name,)).fetchone()
+        if row is None:
+            return None
+
+        stored, data = row
+        if stored != current:
+            self.db.execute('DELETE FROM results WHERE (key == ?) AND (fingerprint == ?);', (name, stored))
+            return None
+
+        self.db.execute('UPDATE results SET used = ? WHERE key == ?;', (time.time(), name))
+        return zlib.decompress(data)
+
+    def put(self, name, current, output, compressed=False):
+        '''
+        Store the output of a command and evict the least recently used
+        outputs until the cache fits in max_size bytes
+
+        Args:
+            name:       key of the command
+            current:    fingerprint of the index when the command was started
+            output:     output of the command
+            compressed: whether or not output has already been compressed with zlib
+
+        Returns:
+            True if the output was stored
+        '''
+
+        data = output if compressed else zlib.compress(output)
+        if len(data) > self.max_size:
+            return False
+
+        self.db.execute('BEGIN IMMEDIATE;')
+        try:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?);',
+                            (name, current, len(data), time.time(), sqlite3.Binary(data)))
+
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results;').fetchone()[0]
+            if total > self.max_size:
+                evict = []
+                for old, size in self.db.execute('SELECT key, size FROM results WHERE key != ? ORDER BY used ASC;', (name,)):
+                    if total <= self.max_size:
+                        break
+                    evict += [(old,)]
+                    total -= size
+                self.db.executemany('DELETE FROM results WHERE key == ?;', evict)
+
+            self.db.execute('COMMIT;')
+        finally:
+            if self.db.in_transaction:
+                self.db.execute('ROLLBACK;')
+
+        return True
+
+def output_file(out):
+    '''get the binary version of a file object'''
+    return getattr(out, 'buffer', out)
+
+def open_cache(config):
+    '''
+    Open the result cache set in a server config
+
+    Returns:
+        ResultCache, or None if it could not be opened
+    '''
+
+    if config.resultcache is None:
+        sys.stderr.write('Not using result cache: {0} is not set in the config\n'.format('ResultCache'))
+        return None
+
+    try:
+        return ResultCache(config.resultcache, config.resultcachesize or DEFAULT_SIZE)
+    except (OSError, RuntimeError, sqlite3.Error) as err:
+        sys.stderr.write('Not using result cache {0}: {1}\n'.format(config.resultcache, err))
+        return None
+
+def run(cache, cmd, indexroot, paths, out=None): # pylint: disable=too-many-arguments
+    '''
+    Run a gufi_query command, or replay its output if the same command
+    was run on the same index before
+
+    Args:
+        cache:     ResultCache
+        cmd:       gufi_query command without the paths
+        indexroot: root of the index
+        paths:     index directories being queried
+        out:       file to write the output to (default: stdout)
+
+    Returns:
+        the return code of gufi_query, or 0 if the output was replayed
+    '''
+
+    # pylint: disable=too-many-locals
+
+    out = output_file(out or sys.stdout)
+
+    name = key(cmd + paths, indexroot)
+    current = fingerprint(indexroot, paths, cmd)
+
+    output = cache.get(name, current)
+    if output is not None:
+        out.write(output)
+        out.flush()
+        return 0
+
+    query = subprocess.Popen(cmd + paths, stdout=subprocess.PIPE, bufsize=0) # pylint: disable=consider-using-with
+    fd = query.stdout.fileno()
+
+    # pass the output through while keeping a compressed copy of it
+    compressor = zlib.compressobj()
+    chunks = []
+    size = 0
+    while True:
+        chunk = os.read(fd, CHUNK_SIZE)
+        if not chunk:
+            break
+        out.write(chunk)
+
+        # outputs that do not fit in the cache are not kept
+        if chunks is not None:
+            chunks += [compressor.compress(chunk)]
+            size += len(chunks[-1])
+            if size > cache.max_size:
+                chunks = None
+
+    out.flush()
+    query.stdout.close()
+    query.wait()
+
+    if (query.returncode == 0) and (chunks is not None):
+        chunks += [compressor.flush()]
+        try:
+            cache.put(name, current, ''.encode('latin-1').join(chunks), True)
+        except sqlite3.Error as err:
+            sys.stderr.write('Could not store result in {0}: {1}\n'.format(cache.filename, err))
+
+    return query.returncode
@@ -0,0 +1,296 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+# estimate statistics of a GUFI index from a sample of its directories
+#
+# directories are sampled while descending, one level at a time: a
+# simple random sample is taken of the subdirectories of the
+# directories sampled at the level above, so only the sampled
+# directories are ever listed. every directory sampled at a level has
+# the same weight (the inverse of its probability of being sampled),
+# which is the weight of the level above times the number of
+# subdirectories found divided by the number sampled. the sampled
+# directories are queried and the partial results of each level are
+# scaled by the weight of the level (stratified Horvitz-Thompson
+# estimation, treating the estimated number of directories at each
+# level as its size).
+
+import collections
+import math
+import os
+import random
+
+import gufi_index
+
+# z-score of a two-sided 95% confidence interval
+Z95 = 1.959964
+
+# an estimated value and the half-width of its confidence interval
+Estimate = collections.namedtuple('Estimate', ['value', 'error'])
+
+def sample_size(population, fraction):
+    '''
+    Number of directories to sample out of a level
+
+    At least 2 directories are sampled from each level so that the
+    variance of the level can be estimated.
+    '''
+
+    return min(population, max(2, int(math.ceil(fraction * population))))
+
+def sample(root, fraction, skip=None, rng=None):
+    '''
+    Select a random sample of the directories of each level of an index
+
+    Only the subdirectories of sampled directories are listed, so the
+    cost of sampling grows with the size of the sample rather than the
+    size of the index. Directories without a database file are sampled
+    and descended into like any other directory, but are not returned.
+
+    Args:
+        root:     index directory to start walking from
+        fraction: fraction of the candidate directories of each level to sample
+        skip:     directory basenames to not descend into
+        rng:      random.Random used to select directories
+
+    Returns:
+        (dictionary of level -> estimated number of directories,
+         dictionary of level -> list of sampled gufi_index.Directory)
+    '''
+
+    rng = rng or random.Random()
+    skip = gufi_index.SKIP | set(skip or [])
+
+    population = collections.OrderedDict()
+    sampled = collections.OrderedDict()
+
+    level = 0
+    weight = 1.0
+    candidates = [os.path.normpath(root)]
+    while candidates:
+        chosen = sorted(rng.sample(candidates, sample_size(len(candidates), fraction)))
+        weight *= float(len(candidates)) / len(chosen)
+
+        directories = []
+        children = []
+        for path in chosen:
+            try:
+                dst = os.lstat(path)
+                dbst = os.lstat(os.path.join(path, gufi_index.DBNAME))
+                directories += [gufi_index.Directory(path, level, dst.st_ino, dbst.st_mtime_ns, dbst.st_size)]
+            except OSError:
+                pass
+
+            try:
+                children += [os.path.join(path, child)
+                             for child in sorted(gufi_index.subdirectories(path))
+                             if child not in skip]
+            except OSError:
+                pass
+
+        # sampled directories without a database count as having nothing
+        if directories:
+            population[level] = weight * len(directories)
+            sampled[level] = directories
+
+        level += 1
+        candidates = children
+
+    return population, sampled
+
+def query(sampled, sql, threads=1, functions=None):
+    '''
+    Run a query on each sampled directory
+
+    Returns:
+        dictionary of level -> list of the rows returned by each directory
+    '''
+
+    pairs = [(level, directory)
+             for level, directories in sampled.items()
+             for directory in directories]
+
+    results = gufi_index.map_threads(lambda pair: gufi_index.query(pair[1].path, sql, (), functions),
+                                     pairs, threads)
+
+    partials = collections.OrderedDict((level, []) for level in sampled)
+    for (level, _), rows in zip(pairs, results):
+        partials[level] += [rows]
+
+    return partials
+
+def stratified(population, values):
+    '''
+    Estimate a total and the variance of the estimate
+
+    Args:
+        population: dictionary of level -> number of directories
+        values:     dictionary of level -> list of the value of each sampled directory
+
+    Returns:
+        (total, variance)
+    '''
+
+    total = 0.0
+    variance = 0.0
+    for level, ys in values.items():
+        count = population[level]
+        n = len(ys)
+        if n == 0:
+            continue
+
+        mean = float(sum(ys)) / n
+        total += count * mean
+
+        if n > 1:
+            s2 = sum((y - mean) ** 2 for y in ys) / (n - 1)
+            variance += count * count * (1 - float(n) / count) * s2 / n
+
+    return total, variance
+
+def estimate_totals(population, partials, z=Z95):
+    '''
+    Estimate the sum of the values of each key over all directories
+
+    Args:
+        population: dictionary of level -> number of directories
+        partials:   dictionary of level -> list of (key, value) rows of each sampled directory
+        z:          z-score of the confidence interval
+
+    Returns:
+        dictionary of key -> Estimate
+    '''
+
+    keys = set(key
+               for results in partials.values()
+               for rows in results
+               for key, _ in rows)
+
+    estimates = {}
+    for key in keys:
+        values = collections.OrderedDict(
+            (level, [sum(value or 0 for k, value in rows if k == key) for rows in results])
+            for level, results in partials.items())
+
+        total, variance = stratified(population, values)
+        estimates[key] = Estimate(total, z * math.sqrt(variance))
+
+    return estimates
+
+def estimate_mean(population, partials, z=Z95):
+    '''
+    Estimate the mean of the values returned by the directories that
+    returned a row, e.g. the mean of a column of the leaf directories
+
+    The mean is estimated as the ratio of the estimated sum of the
+    values to the estimated number of directories that returned a row.
+
+    Args:
+        population: dictionary of level -> number of directories
+        partials:   dictionary of level -> list of (key, value) rows of each sampled directory
+        z:          z-score of the confidence interval
+
+    Returns:
+        Estimate, or None if no sampled directory returned a row
+    '''
+
+    ys = collections.OrderedDict()
+    xs = collections.OrderedDict()
+    for level, results in partials.items():
+        ys[level] = [sum(value or 0 for _, value in rows) for rows in results]
+        xs[level] = [len(rows) for rows in results]
+
+    count, _ = stratified(population, xs)
+    if count == 0:
+        return None
+
+    total, _ = stratified(population, ys)
+    ratio = total / count
+
+    # linearized variance of a ratio estimator
+    residuals = collections.OrderedDict(
+        (level, [y - ratio * x for y, x in zip(ys[level], xs[level])])
+        for level in ys)
+    _, variance = stratified(population, residuals)
+
+    return Estimate(ratio, z * math.sqrt(variance) / count)
+
+def floor_log(base, value):
+    '''
+    Integer part of the logarithm of a value, using integer arithmetic
+    so that exact powers of the base are not rounded down
+
+    Returns -1 for values less than 1.
+    '''
+
+    if value is None or value < 1:
+        return -1
+
+    value = int(value)
+    exponent = 0
+    while value >= base:
+        value //= base
+        exponent += 1
+    return exponent
@@ -0,0 +1,342 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# sidecar databases that map something found in the databases of a
+# GUFI index back to the index directories it was found in
+#
+# each sidecar tracks the directories it was built from in a dirs
+# table, keyed on the inode of the index directory along with the
+# mtime and size of its database file, so updates only reread the
+# directories whose databases have changed. the rest of the sidecar
+# refers to directories by dirs.id.
+#
+# lookups return the directories that gufi_query has to be started at,
+# with a maximum depth of 0, to get the same results as walking the
+# whole tree.
+
+import os
+import sqlite3
+
+import gufi_index
+
+# the sidecar is not used when more directories than this have to be
+# queried, since they are passed to gufi_query on the command line
+MAX_CANDIDATES = 4096
+
+# dirs.complete is 0 when a directory could not be read. such
+# directories are always queried.
+DIRS = '''
+CREATE TABLE IF NOT EXISTS metadata(name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs(id INTEGER PRIMARY KEY, inode INTEGER UNIQUE, path TEXT, mtime INTEGER, size INTEGER, rollup INTEGER, complete INTEGER);
+CREATE INDEX IF NOT EXISTS dirs_path_idx ON dirs(path);
+'''
+
+ROLLUPSCORE = 'SELECT rollupscore FROM summary WHERE isroot == 1;'
+
+def rollupscore(db):
+    '''rollup score of an open index directory database'''
+    row = db.execute(ROLLUPSCORE).fetchone()
+    return row[0] if row and row[0] else 0
+
+class Sidecar(object): # pylint: disable=useless-object-inheritance
+    '''
+    Base class of the sidecars
+
+    Subclasses set the class attributes and implement read and store.
+    '''
+
+    NAME    = 'Sidecar' # used in messages
+    VERSION = 1         # bump when the layout of the sidecar changes
+    SCHEMA  = ''        # tables other than metadata and dirs
+    TABLES  = []        # tables with a dir column referring to dirs.id
+
+    def __init__(self, filename, indexroot, readonly=False, timeout=60):
+        self.filename = filename
+        self.indexroot = os.path.normpath(indexroot)
+
+        if readonly:
+            self.db = sqlite3.connect(gufi_index.file_uri(filename), uri=True, timeout=timeout)
+        else:
+            self.db = sqlite3.connect(filename, timeout=timeout)
+            self.db.executescript(DIRS + self.SCHEMA)
+
+        metadata = dict(self.db.execute('SELECT name, value FROM metadata;').fetchall())
+
+        if readonly:
+            if metadata.get('version') != str(self.VERSION):
+                self.db.close()
+                raise RuntimeError('{0} {1} has version {2}, not {3}'.format(
+                    self.NAME, filename, metadata.get('version'), self.VERSION))
+        else:
+            with self.db:
+                # drop everything from older layouts
+                if metadata.get('version') != str(self.VERSION):
+                    for table in ['dirs'] + self.TABLES:
+                        self.db.execute('DELETE FROM {0};'.format(table))
+                    metadata.pop('indexroot', None)
+
+                self.db.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?);',
+                                    [('version', str(self.VERSION)),
+                                     ('indexroot', metadata.get('indexroot', self.indexroot))])
+                metadata.setdefault('indexroot', self.indexroot)
+
+        if metadata.get('indexroot') != self.indexroot:
+            self.db.close()
+            raise RuntimeError('{0} {1} was built from {2}, not {3}'.format(
+                self.NAME, filename, metadata.get('indexroot'), self.indexroot))
+
+    def close(self):
+        self.db.close()
+
+    def read(self, path):
+        '''
+        Read what the sidecar holds from an index directory
+
+        Returns:
+            (content passed to store, rollup score of the directory)
+
+        Raises:
+            sqlite3.Error if the directory could not be read
+        '''
+
+        raise NotImplementedError()
+
+    def store(self, dir_id, content):
+        '''add the content read from a directory to the sidecar'''
+        raise NotImplementedError()
+
+    def update(self, path, skip=None, threads=1): # pylint: disable=too-many-locals
+        '''
+        Bring the directories under a path up to date
+
+        Args:
+            path:    index directory to start walking from
+            skip:    directory basenames to not descend into
+            threads: number of directories to read at a time
+
+        Returns:
+            (number of directories read,
+             number of directories reused,
+             number of directories removed)
+        '''
+
+        rel = gufi_index.relpath(path, self.indexroot)
+
+        known = {}
+        for dir_id, inode, known_path, mtime, size in self.db.execute(
+                'SELECT id, inode, path, mtime, size FROM dirs WHERE {0};'.format(gufi_index.UNDER),
+                {'rel': rel}):
+            known[inode] = (dir_id, known_path, mtime, size)
+
+        changed = []
+        moved = []
+        seen = set()
+        for directory in gufi_index.walk(path, skip):
+            seen.add(directory.inode)
+
+            dir_rel = gufi_index.relpath(directory.path, self.indexroot)
+            old = known.get(directory.inode)
+            if (old is None) or (old[2:] != (directory.mtime, directory.size)):
+                changed += [(directory, dir_rel)]
+            elif old[1] != dir_rel:
+                moved += [(old[0], dir_rel)]
+
+        removed = [known[inode][0] for inode in known if inode not in seen]
+
+        def read(change):
+            try:
+                return self.read(change[0].path)
+            except sqlite3.Error:
+                return None
+
+        contents = gufi_index.map_threads(read, changed, threads)
+
+        with self.db:
+            for dir_id in removed:
+                self.clear(dir_id)
+                self.db.execute('DELETE FROM dirs WHERE id == ?;', (dir_id,))
+
+            for (directory, dir_rel), read_back in zip(changed, contents):
+                content, rollup = read_back if read_back is not None else (None, 0)
+                row = (directory.inode, dir_rel, directory.mtime, directory.size,
+                       rollup, int(read_back is not None))
+
+                old = known.get(directory.inode)
+                if old is None:
+                    dir_id = self.db.execute('INSERT INTO dirs VALUES (NULL, ?, ?, ?, ?, ?, ?);', row).lastrowid
+                else:
+                    dir_id = old[0]
+                    self.clear(dir_id)
+                    self.db.execute('''UPDATE dirs SET inode = ?, path = ?, mtime = ?, size = ?, rollup = ?, complete = ?
+                                       WHERE id == ?;''', row + (dir_id,))
+
+                if read_back is not None:
+                    self.store(dir_id, content)
+
+            for dir_id, dir_rel in moved:
+                self.db.execute('UPDATE dirs SET path = ? WHERE id == ?;', (dir_rel, dir_id))
+
+        return len(changed), len(seen) - len(changed), len(removed)
+
+    def clear(self, dir_id):
+        '''remove what was stored for a directory'''
+        for table in self.TABLES:
+            self.db.execute('DELETE FROM {0} WHERE dir == ?;'.format(table), (dir_id,))
+
+    def known(self, path):
+        '''whether the sidecar has the directory at a path'''
+        rel = gufi_index.relpath(path, self.indexroot)
+        return self.db.execute('SELECT 1 FROM dirs WHERE path == ?;', (rel,)).fetchone() is not None
+
+    def incomplete(self, path):
+        '''ids of the directories under a path that could not be read'''
+        return set(dir_id for dir_id, in self.db.execute(
+            'SELECT id FROM dirs WHERE (complete == 0) AND {0};'.format(gufi_index.UNDER),
+            {'rel': gufi_index.relpath(path, self.indexroot)}))
+
+    def paths(self, ids):
+        '''paths (relative to the index root) of directories'''
+        found = []
+        ids = list(ids)
+        # stay under the default limit on the number of bound values
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            found += [dir_path for dir_path, in self.db.execute(
+                'SELECT path FROM dirs WHERE id IN ({0});'.format(', '.join('?' * len(chunk))), chunk)]
+        return found
+
+    def rolled_up(self, path):
+        '''paths (relative to the index root) of the rolled up directories under a path'''
+        return set(dir_path for dir_path, in self.db.execute(
+            'SELECT path FROM dirs WHERE (rollup != 0) AND {0};'.format(gufi_index.UNDER),
+            {'rel': gufi_index.relpath(path, self.indexroot)}))
+
+def candidates(sidecar, paths, match, skip=None, mindepth=None, maxdepth=None, limit=MAX_CANDIDATES): # pylint: disable=too-many-arguments,too-many-locals
+    '''
+    Find the directories gufi_query has to be started at, with a
+    maximum depth of 0, to get the same results as walking the paths
+
+    Directories under rolled up directories are replaced by the
+    highest rolled up directory, since gufi_query does not descend
+    into rolled up directories.
+
+    Args:
+        sidecar:  Sidecar
+        paths:    index directories the walk would start at
+        match:    function returning the ids of the directories under
+                  a path that have to be queried, or None if it cannot
+                  tell
+        skip:     directory basenames to not descend into
+        mindepth: minimum level below the paths
+        maxdepth: maximum level below the paths
+        limit:    largest number of directories to return (None for no limit)
+
+    Returns:
+        list of index directories, or None if the sidecar cannot be used
+    '''
+
+    skip = gufi_index.SKIP | set(skip or [])
+
+    found = []
+    for path in paths:
+        path = os.path.normpath(path)
+        if not sidecar.known(path):
+            return None
+
+        ids = match(path)
+        if ids is None:
+            return None
+        ids |= sidecar.incomplete(path)
+
+        rel = gufi_index.relpath(path, sidecar.indexroot)
+        start = gufi_index.depth(rel)
+        rolled_up = sidecar.rolled_up(path)
+
+        selected = set()
+        for dir_rel in sidecar.paths(ids):
+            parts = dir_rel.split(os.path.sep) if dir_rel else []
+            below = parts[start:]
+
+            # the highest rolled up directory at or above this one
+            for level in range(len(below) + 1):
+                ancestor = os.path.sep.join(parts[:start + level])
+                if ancestor in rolled_up:
+                    below = below[:level]
+                    break
+
+            if skip & set(below):
+                continue
+
+            level = len(below)
+            if (mindepth is not None) and (level < mindepth):
+                continue
+            if (maxdepth is not None) and (level > maxdepth):
+                continue
+
+            selected.add(os.path.join(path, *below) if below else path)
+
+        found += sorted(selected)
+        if (limit is not None) and (len(found) > limit):
+            return None
+
+    return found
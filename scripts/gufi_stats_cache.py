@@ -0,0 +1,308 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+# sidecar database holding per-directory partial results of gufi_stats
+#
+# each statistic that can be cached is split into a query that is run
+# on a single directory's database and a query that merges the partial
+# results of all directories under the starting path. partial results
+# are keyed on the inode of the index directory along with the mtime
+# and size of its database file, so reruns only query directories whose
+# databases have changed since the previous run.
+#
+# partial results depend on the permissions of the user that computed
+# them, so each cache belongs to a single user. the StatsCache setting
+# of the server config is a directory holding a private cache for each
+# user (see user_cache).
+
+import os
+import sqlite3
+
+import gufi_index
+import gufi_result_cache
+
+DBNAME = 'stats.db'
+
+# bump when the layout of the cache changes
+VERSION = 1
+
+# table of partial results selected for merging
+SELECTED = 'selected'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata(name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs(variant TEXT, inode INTEGER, path TEXT, level INTEGER, mtime INTEGER, size INTEGER, PRIMARY KEY (variant, inode));
+CREATE TABLE IF NOT EXISTS partials(variant TEXT, inode INTEGER, key, value);
+CREATE INDEX IF NOT EXISTS partials_idx ON partials(variant, inode);
+'''
+
+def grouping(rel, group_depth, name=None):
+    '''
+    Function returning the group of a directory under the directory at
+    rel (see StatsCache.merge)
+
+    Args:
+        rel:         path of the starting directory relative to the index root
+        group_depth: depth below the path of the directories to group by
+        name:        name of the index to prefix the groups with
+
+    Returns:
+        function taking the path of a directory relative to the index root
+    '''
+
+    start = gufi_index.depth(rel)
+
+    def ancestor(dir_path):
+        if group_depth is None:
+            return None
+
+        parts = dir_path.split(os.path.sep) if dir_path else []
+        if len(parts) < start + group_depth:
+            grp = rel or os.curdir
+        else:
+            grp = os.path.sep.join(parts[:start + group_depth]) or os.curdir
+
+        if name is not None:
+            grp = os.path.normpath(os.path.join(name, grp))
+        return grp
+
+    return ancestor
+
+def user_cache(directory):
+    '''path of the cache of the current user'''
+    return os.path.join(gufi_result_cache.user_directory(directory, os.geteuid()), DBNAME)
+
+class StatsCache(object): # pylint: disable=useless-object-inheritance
+    '''
+    Partial results of gufi_stats statistics
+
+    Partial results depend on the permissions of the user that
+    computed them, so a cache may only be used by the user that
+    created it.
+    '''
+
+    def __init__(self, filename, indexroot, timeout=60):
+        self.indexroot = os.path.normpath(indexroot)
+        self.db = sqlite3.connect(filename, timeout=timeout)
+        self.db.executescript(SCHEMA)
+
+        metadata = dict(self.db.execute('SELECT name, value FROM metadata;').fetchall())
+
+        owner = metadata.get('uid')
+        if (owner is not None) and (int(owner) != os.geteuid()):
+            self.db.close()
+            raise RuntimeError('Statistics cache {0} belongs to uid {1}'.format(filename, owner))
+
+        with self.db:
+            # drop partial results from older layouts
+            if metadata.get('version') != str(VERSION):
+                self.db.execute('DELETE FROM dirs;')
+                self.db.execute('DELETE FROM partials;')
+
+            self.db.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?);',
+                                [('uid', str(os.geteuid())),
+                                 ('version', str(VERSION)),
+                                 ('indexroot', self.indexroot)])
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self, variant, sql, path, skip=None, threads=1, functions=None, indexroot=None): # pylint: disable=too-many-arguments,too-many-locals
+        '''
+        Bring the partial results of the directories under a path up to date
+
+        Args:
+            variant: name identifying the statistic and its options
+            sql:     query run on a directory's database to get its partial results
+            path:    index directory to start walking from
+            skip:    directory basenames to not descend into
+            threads: number of directories to query at a time
+            functions: dictionary of name -> (argument count, function)
+                       to make available to the query
+            indexroot: root of the index containing the path, if it
+                       is not the index root of the cache
+
+        Returns:
+            (number of directories queried,
+             number of directories reused,
+             number of directories removed)
+        '''
+
+        indexroot = self.indexroot if indexroot is None else os.path.normpath(indexroot)
+
+        rel = gufi_index.relpath(path, indexroot)
+        start = gufi_index.depth(rel)
+
+        cached = {}
+        for inode, cached_path, mtime, size in self.db.execute(
+                'SELECT inode, path, mtime, size FROM dirs WHERE (variant == :variant) AND {0};'.format(gufi_index.UNDER),
+                {'variant': variant, 'rel': rel}):
+            cached[inode] = (cached_path, mtime, size)
+
+        changed = []
+        moved = []
+        seen = set()
+        for directory in gufi_index.walk(path, skip):
+            seen.add(directory.inode)
+
+            dir_rel = gufi_index.relpath(directory.path, indexroot)
+            old = cached.get(directory.inode)
+            if (old is None) or (old[1:] != (directory.mtime, directory.size)):
+                changed += [(directory, dir_rel)]
+            elif old[0] != dir_rel:
+                moved += [(directory, dir_rel)]
+
+        removed = [inode for inode in cached if inode not in seen]
+
+        partials = gufi_index.map_threads(lambda change: gufi_index.query(change[0].path, sql, (), functions),
+                                          changed, threads)
+
+        with self.db:
+            for inode in removed:
+                self.db.execute('DELETE FROM dirs WHERE (variant == ?) AND (inode == ?);', (variant, inode))
+                self.db.execute('DELETE FROM partials WHERE (variant == ?) AND (inode == ?);', (variant, inode))
+
+            for (directory, dir_rel), rows in zip(changed, partials):
+                self.db.execute('DELETE FROM partials WHERE (variant == ?) AND (inode == ?);', (variant, directory.inode))
+                self.db.executemany('INSERT INTO partials VALUES (?, ?, ?, ?);',
+                                    [(variant, directory.inode, key, value) for key, value in rows])
+                self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?);',
+                                (variant, directory.inode, dir_rel, start + directory.level,
+                                 directory.mtime, directory.size))
+
+            for directory, dir_rel in moved:
+                self.db.execute('UPDATE dirs SET path = ?, level = ? WHERE (variant == ?) AND (inode == ?);',
+                                (dir_rel, start + directory.level, variant, directory.inode))
+
+        return len(changed), len(seen) - len(changed), len(removed)
+
+    def merge(self, variant, path, sql, functions=None, group_depth=None): # pylint: disable=too-many-arguments
+        '''
+        Merge the partial results of the directories under a path
+
+        The merge query reads from a table named "selected" with
+        the columns (grp, level, key, value), where level is relative
+        to the path.
+
+        grp is the path (relative to the index root) of the ancestor
+        of the directory at group_depth levels below the path.
+        Directories above group_depth are grouped with the path. grp
+        is NULL if group_depth is not provided.
+
+        Args:
+            variant:     name identifying the statistic and its options
+            path:        index directory whose subtree is merged
+            sql:         merge query
+            functions:   dictionary of name -> (argument count, function)
+                         to make available to the merge query
+            group_depth: depth below the path of the directories to group by
+
+        Returns:
+            list of rows
+        '''
+
+        return self.merge_indexes([(None, variant, path, self.indexroot)], sql, functions, group_depth)
+
+    def merge_indexes(self, sources, sql, functions=None, group_depth=None):
+        '''
+        Merge the partial results of subtrees of several indexes
+
+        Same as merge, except the partial results of every source are
+        selected before the merge query is run. The groups of a named
+        source are prefixed with its name.
+
+        Args:
+            sources:     list of (name, variant, path, index root)
+            sql:         merge query
+            functions:   dictionary of name -> (argument count, function)
+                         to make available to the merge query
+            group_depth: depth below the path of the directories to group by
+
+        Returns:
+            list of rows
+        '''
+
+        for name, (argc, func) in (functions or {}).items():
+            self.db.create_function(name, argc, func)
+
+        self.db.execute('DROP TABLE IF EXISTS temp.{0};'.format(SELECTED))
+        self.db.execute('CREATE TEMP TABLE {0}(grp TEXT, level INTEGER, key, value);'.format(SELECTED))
+
+        for name, variant, path, indexroot in sources:
+            self._select(name, variant, path, os.path.normpath(indexroot), group_depth)
+
+        return self.db.execute(sql).fetchall()
+
+    def _select(self, name, variant, path, indexroot, group_depth): # pylint: disable=too-many-arguments
+        rel = gufi_index.relpath(path, indexroot)
+        start = gufi_index.depth(rel)
+
+        self.db.create_function('ancestor', 1, grouping(rel, group_depth, name))
+        self.db.execute('''INSERT INTO temp.{0}
+                           SELECT ancestor(dirs.path), dirs.level - :start, partials.key, partials.value
+                           FROM dirs, partials
+                           WHERE (dirs.variant == :variant) AND (partials.variant == :variant) AND
+                                 (dirs.inode == partials.inode) AND {1};'''.format(SELECTED, gufi_index.UNDER),
+                        {'variant': variant, 'rel': rel, 'start': start})
@@ -0,0 +1,296 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# timeline of a GUFI tool run in the Chrome trace event format
+#
+# the phases of the tool (python startup, reading the config, parsing
+# the arguments, building the query, starting gufi_query) are recorded
+# along with the run of each gufi_query. if gufi_query was built with
+# cumulative times, its debug prints are parsed with the extraction
+# code of the performance history framework and laid out as phases of
+# the gufi_query run. if it was built with per-thread stats, each
+# thread gets its own lane.
+#
+# the file can be opened with chrome://tracing or https://ui.perfetto.dev
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+# where the performance history framework is configured. the parser of
+# the cumulative times is also installed next to the scripts when the
+# framework is configured, so it is found there first.
+PERFORMANCE = os.path.join('@CMAKE_BINARY_DIR@', 'contrib', 'performance')
+
+# phases of gufi_query that run one after the other
+QUERY_PHASES = [
+    'set up globals',
+    'set up intermediate databases',
+    'thread pool',
+    'aggregate into final databases',
+    'print aggregated results',
+    'clean up globals',
+]
+
+# totals that are not phases
+QUERY_COUNTS = [
+    'Threads run',
+    'Queries performed',
+    'Rows printed to stdout or outfiles',
+    'Total Thread Time (not including main)',
+    'Real time (main)',
+]
+
+# <thread id> <name> <start ns> <end ns>
+THREAD_TIMESTAMP = re.compile(r'^(\d+) (.+) (\d+) (\d+)$')
+
+def process_start():
+    '''
+    Find when this process started
+
+    Returns:
+        seconds since the epoch, or None if it cannot be found
+    '''
+
+    try:
+        with open('/proc/self/stat', 'r') as stat: # pylint: disable=unspecified-encoding
+            # the command name can contain spaces
+            fields = stat.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', 'r') as uptime_file: # pylint: disable=unspecified-encoding
+            uptime = float(uptime_file.read().split()[0])
+        started = int(fields[19]) / float(os.sysconf('SC_CLK_TCK'))
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+    return time.time() - (uptime - started)
+
+def cumulative_times(lines):
+    '''
+    Parse the cumulative times printed by gufi_query
+
+    Returns:
+        dictionary of column name -> value, or None if the lines do
+        not contain cumulative times or the parser is not available
+    '''
+
+    # pylint: disable=import-outside-toplevel
+    if PERFORMANCE not in sys.path:
+        sys.path.append(PERFORMANCE)
+
+    try:
+        from performance_pkg.extraction.gufi_query import cumulative_times as extraction
+    except ImportError:
+        if any(line.lstrip().startswith('Real time') for line in lines):
+            sys.stderr.write('Warning: gufi_query printed cumulative times, but their parser '
+                             '(performance_pkg) was not found, so they are not in the trace\n')
+        return None
+
+    try:
+        return extraction.extract(lines, None, None)
+    except ValueError:
+        return None
+
+class Trace(object): # pylint: disable=useless-object-inheritance
+    '''Events of a tool run, written as a Chrome trace'''
+
+    def __init__(self, filename, name):
+        self.filename = filename
+        self.origin = process_start()
+        self.events = []
+        self.pid = os.getpid()
+        self.meta(self.pid, None, 'process_name', name)
+
+        if self.origin is None:
+            self.origin = time.time()
+
+    def meta(self, pid, tid, kind, name):
+        event = {'name': kind, 'ph': 'M', 'pid': pid, 'args': {'name': name}}
+        if tid is not None:
+            event['tid'] = tid
+        self.events += [event]
+
+    def event(self, name, ts, dur, pid=None, tid=0, args=None): # pylint: disable=too-many-arguments
+        '''record a complete event (microseconds since the process started)'''
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': ts,
+            'dur': dur,
+            'pid': self.pid if pid is None else pid,
+            'tid': tid,
+        }
+        if args:
+            event['args'] = args
+        self.events += [event]
+
+    def phase(self, name, start, end, pid=None, tid=0, args=None): # pylint: disable=too-many-arguments
+        '''record a phase that ran from start to end (seconds since the epoch)'''
+        self.event(name, (start - self.origin) * 1e6, (end - start) * 1e6, pid, tid, args)
+
+    def startup(self, started, configured, parsed):
+        '''record the phases of a tool before it builds its query'''
+        self.phase('python startup', self.origin, started)
+        self.phase('read config', started, configured)
+        self.phase('parse arguments', configured, parsed)
+
+    def run(self, cmd, stdout=None, progress=None):
+        '''
+        Run gufi_query and record its run
+
+        stderr is passed through while it is read. The progress of the
+        run is reported with progress (gufi_catalog.Progress) if given.
+
+        Returns:
+            the return code of the command
+        '''
+
+        err = getattr(sys.stderr, 'buffer', sys.stderr)
+        sys.stderr.flush()
+
+        spawn = time.time()
+        proc = subprocess.Popen(cmd, stdout=stdout, stderr=subprocess.PIPE) # pylint: disable=consider-using-with
+        spawned = time.time()
+        if progress is not None:
+            progress.start(proc.pid)
+
+        lines = []
+        for line in iter(proc.stderr.readline, b''):
+            err.write(line)
+            lines += [line.decode('utf-8', 'replace')]
+        err.flush()
+        proc.stderr.close()
+        proc.wait()
+        if progress is not None:
+            progress.stop()
+
+        self.phase('spawn {0}'.format(os.path.basename(cmd[0])), spawn, spawned)
+        self.query(os.path.basename(cmd[0]), proc.pid, spawned, time.time(), lines,
+                   {'returncode': proc.returncode})
+
+        return proc.returncode
+
+    def query(self, name, pid, start, end, lines, args=None): # pylint: disable=too-many-arguments
+        '''
+        Record a gufi_query run along with the timing information it printed
+
+        The per-thread timestamps are relative to when gufi_query set
+        up its globals, so they are placed as if that happened when the
+        process started.
+        '''
+
+        # pylint: disable=too-many-locals
+
+        args = dict(args or {})
+        self.meta(pid, None, 'process_name', name)
+        self.meta(pid, 0, 'thread_name', 'main')
+
+        # microseconds since this process started
+        base = (start - self.origin) * 1e6
+
+        times = cumulative_times(lines)
+        if times is not None:
+            args.update((col, float(times[col])) for col in QUERY_COUNTS if col in times)
+
+            offset = base
+            for phase in QUERY_PHASES:
+                if phase not in times:
+                    continue
+                duration = float(times[phase]) * 1e6
+
+                # everything else is summed over all threads
+                phase_args = None
+                if phase == 'thread pool':
+                    phase_args = dict((col, float(value)) for col, value in times.items()
+                                      if (value is not None) and (col not in QUERY_PHASES + QUERY_COUNTS + ['commit', 'branch', 'id']))
+
+                self.event(phase, offset, duration, pid, 0, phase_args)
+                offset += duration
+
+        self.phase(name, start, end, pid, 0, args)
+
+        threads = set()
+        for line in lines:
+            match = THREAD_TIMESTAMP.match(line.strip())
+            if match is None:
+                continue
+
+            tid = int(match.group(1)) + 1
+            if tid not in threads:
+                threads.add(tid)
+                self.meta(pid, tid, 'thread_name', 'thread {0}'.format(tid - 1))
+
+            thread_start = int(match.group(3))
+            self.event(match.group(2),
+                       base + thread_start / 1e3,
+                       (int(match.group(4)) - thread_start) / 1e3,
+                       pid, tid)
+
+    def write(self):
+        '''write the trace, ending with a phase covering the whole run'''
+        self.phase('total', self.origin, time.time())
+
+        with open(self.filename, 'w') as trace: # pylint: disable=unspecified-encoding
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, trace)
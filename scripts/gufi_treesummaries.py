@@ -0,0 +1,594 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# incremental maintenance of the treesummary tables of an index
+#
+# gufi_treesummary_all recomputes the treesummary table of every
+# directory of an index. once the tables exist, only the directories
+# whose databases have changed and their ancestors have to be
+# recomputed. the state of the database file of each directory as of
+# the last run is kept in a sidecar (see gufi_sidecar.py), so finding
+# what changed only needs the database files to be stat-ed.
+#
+# the tables along the ancestor chains are recomputed bottom up, one
+# level at a time with a pool of threads. each directory merges its
+# own summary with the treesummary tables of its children, the same
+# way gufi_treesummary does, and only descends into children that do
+# not have one. reading and writing can be limited to a number of
+# bytes per second so that maintenance does not starve queries.
+#
+# directories that have a treesummary table are recomputed. changed
+# directories whose parent gets a treesummary table also get one, so
+# subtrees that were reindexed are covered again. the modification and
+# access times of the database files are kept.
+#
+#     gufi_treesummaries.py update [paths] [--io-budget bytes]
+#     gufi_treesummaries.py mark [paths]    # after gufi_treesummary_all
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import gufi_common
+import gufi_config
+import gufi_index
+import gufi_sidecar
+
+LLONG_MAX = (1 << 63) - 1
+LLONG_MIN = -(1 << 63)
+
+# columns that are summed
+TOTALS = ['totfiles', 'totlinks', 'totzero', 'totltk', 'totmtk', 'totltm',
+          'totmtm', 'totmtg', 'totmtt', 'totsize', 'totxattr', 'totossint1',
+          'totossint2', 'totossint3', 'totossint4']
+
+# min<name> and max<name> columns, only taken from directories with files
+RANGES = ['uid', 'gid', 'size', 'ctime', 'mtime', 'atime', 'blocks',
+          'crtime', 'ossint1', 'ossint2', 'ossint3', 'ossint4']
+
+# largest value of a column of a single directory
+SUBDIR_MAXES = [('maxsubdirfiles', 'totfiles'),
+                ('maxsubdirlinks', 'totlinks'),
+                ('maxsubdirsize', 'totsize')]
+
+# summary columns a treesummary is computed from
+SUMMARY_COLUMNS = TOTALS + sum([['min' + name, 'max' + name] for name in RANGES], [])
+
+# treesummary columns, in the order gufi_treesummary creates them
+COLUMNS = ['inode', 'pinode', 'totsubdirs', 'maxsubdirfiles',
+           'maxsubdirlinks', 'maxsubdirsize', 'totfiles', 'totlinks', 'minuid',
+           'maxuid', 'mingid', 'maxgid', 'minsize', 'maxsize', 'totzero', 'totltk',
+           'totmtk', 'totltm', 'totmtm', 'totmtg', 'totmtt', 'totsize', 'minctime',
+           'maxctime', 'minmtime', 'maxmtime', 'minatime', 'maxatime', 'minblocks',
+           'maxblocks', 'totxattr', 'depth', 'mincrtime', 'maxcrtime', 'minossint1',
+           'maxossint1', 'totossint1', 'minossint2', 'maxossint2', 'totossint2',
+           'minossint3', 'maxossint3', 'totossint3', 'minossint4', 'maxossint4',
+           'totossint4', 'totextdbs', 'rectype', 'uid', 'gid']
+
+# same as create_treesummary_tables
+CREATE = '''
+CREATE TABLE {0}({1});
+DROP VIEW IF EXISTS vtsummarydir;
+CREATE VIEW vtsummarydir AS SELECT * FROM {0} WHERE rectype == 0;
+DROP VIEW IF EXISTS vtsummaryuser;
+CREATE VIEW vtsummaryuser AS SELECT * FROM {0} WHERE rectype == 1;
+DROP VIEW IF EXISTS vtsummarygroup;
+CREATE VIEW vtsummarygroup AS SELECT * FROM {0} WHERE rectype == 2;
+'''.format(gufi_common.TREESUMMARY,
+           ', '.join('{0} {1}'.format(col, 'TEXT' if col in ['inode', 'pinode'] else 'INT64')
+                     for col in COLUMNS))
+
+# changed directories that have not been recomputed yet
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pending(path TEXT PRIMARY KEY);
+'''
+
+def pick(func, current, value):
+    '''combine a value into a minimum or maximum, ignoring NULLs'''
+    return current if value is None else func(current, value)
+
+class Sum(object): # pylint: disable=useless-object-inheritance
+    '''treesummary values of a set of directories'''
+
+    def __init__(self):
+        self.dirs = 0
+        self.values = dict((col, 0) for col in TOTALS + ['totextdbs'])
+        for name in RANGES:
+            self.values['min' + name] = LLONG_MAX
+            self.values['max' + name] = LLONG_MIN
+        for col, _ in SUBDIR_MAXES:
+            self.values[col] = LLONG_MIN
+
+    @staticmethod
+    def directory(row, extdbs=0):
+        '''the values of a single directory from its summary row'''
+        found = Sum()
+        found.dirs = 1
+        found.values.update(row)
+        found.values['totextdbs'] = extdbs
+        for col, source in SUBDIR_MAXES:
+            found.values[col] = row[source]
+        return found
+
+    @staticmethod
+    def tree(row):
+        '''the values of a subtree from a treesummary row'''
+        found = Sum()
+        found.dirs = row['totsubdirs'] + 1
+        found.values.update((col, row[col]) for col in found.values)
+        return found
+
+    def add(self, other):
+        self.dirs += other.dirs
+        for col in TOTALS + ['totextdbs']:
+            self.values[col] += other.values[col] or 0
+        for col, _ in SUBDIR_MAXES:
+            self.values[col] = pick(max, self.values[col], other.values[col])
+
+        # minimums and maximums of directories without files are not set
+        if (other.values['totfiles'] or 0) > 0:
+            for name in RANGES:
+                self.values['min' + name] = pick(min, self.values['min' + name], other.values['min' + name])
+                self.values['max' + name] = pick(max, self.values['max' + name], other.values['max' + name])
+
+    def row(self, inode, pinode, depth):
+        '''the treesummary row of the directory at the top of the subtree'''
+        values = dict(self.values)
+        values.update({
+            'inode': inode,
+            'pinode': pinode,
+            'totsubdirs': self.dirs - 1,
+            'depth': depth,
+            'rectype': 0,
+            'uid': 0,
+            'gid': 0,
+        })
+        return tuple(values[col] for col in COLUMNS)
+
+def has_table(db, name):
+    return db.execute('SELECT 1 FROM sqlite_master WHERE (type == \'table\') AND (name == ?);',
+                      (name,)).fetchone() is not None
+
+def summaries(db):
+    '''Sum of the directory rows of the summary table of a database'''
+    extdbs = db.execute('SELECT COUNT(*) FROM external_dbs;').fetchone()[0] \
+        if has_table(db, 'external_dbs') else 0
+
+    found = Sum()
+    for row in db.execute('SELECT {0} FROM {1} WHERE rectype == 0;'.format(
+            ', '.join(SUMMARY_COLUMNS), gufi_common.SUMMARY)):
+        found.add(Sum.directory(dict(zip(SUMMARY_COLUMNS, row)), extdbs))
+        extdbs = 0
+    return found
+
+def treesummary(db):
+    '''
+    Get the treesummary row of the directory of a database
+
+    Returns:
+        dictionary of COLUMNS, or None if there is no treesummary table
+    '''
+
+    if not has_table(db, gufi_common.TREESUMMARY):
+        return None
+
+    row = db.execute('''SELECT {0} FROM {1} AS t, {2} AS s
+                        WHERE (s.isroot == 1) AND (s.inode == t.inode) AND (t.rectype == 0);'''.format(
+                            ', '.join('t.' + col for col in COLUMNS),
+                            gufi_common.TREESUMMARY, gufi_common.SUMMARY)).fetchone()
+    return None if row is None else dict(zip(COLUMNS, row))
+
+def children(path, skip):
+    try:
+        return [os.path.join(path, name) for name in sorted(gufi_index.subdirectories(path))
+                if name not in skip]
+    except OSError:
+        return []
+
+def subtree(path, skip, budget=None):
+    '''
+    Sum the directories under a path without recomputing anything
+
+    Rolled up directories and directories with treesummary tables are
+    not descended into. Directories whose databases cannot be opened
+    are skipped along with everything under them.
+    '''
+
+    total = Sum()
+    stack = [path]
+    while stack:
+        path = stack.pop()
+        if budget is not None:
+            budget.wait()
+
+        try:
+            db = gufi_index.open_db(path)
+            try:
+                if gufi_sidecar.rollupscore(db) != 0:
+                    total.add(summaries(db))
+                    continue
+
+                row = treesummary(db)
+                if row is not None:
+                    total.add(Sum.tree(row))
+                    continue
+
+                total.add(summaries(db))
+            finally:
+                db.close()
+        except sqlite3.Error:
+            continue
+
+        stack += children(path, skip)
+
+    return total
+
+def compute(path, skip, budget=None):
+    '''
+    Compute the treesummary of a directory from its own summary and
+    the treesummary tables of its children
+
+    Returns:
+        Sum, or None if the database could not be read
+    '''
+
+    if budget is not None:
+        budget.wait()
+
+    try:
+        db = gufi_index.open_db(path)
+        try:
+            found = summaries(db)
+            if gufi_sidecar.rollupscore(db) != 0:
+                return found
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+
+    for child in children(path, skip):
+        found.add(subtree(child, skip, budget))
+
+    return found
+
+def write(path, found):
+    '''
+    Replace the treesummary table of a directory, keeping the access
+    and modification times of its database file
+    '''
+
+    dbname = os.path.join(path, gufi_index.DBNAME)
+    st = os.stat(dbname)
+
+    db = gufi_index.open_db(path, readonly=False)
+    try:
+        if has_table(db, gufi_common.TREESUMMARY):
+            db.execute('DELETE FROM {0};'.format(gufi_common.TREESUMMARY))
+        else:
+            db.executescript(CREATE)
+
+        row = db.execute('SELECT inode, pinode FROM {0} WHERE isroot == 1;'.format(
+            gufi_common.SUMMARY)).fetchone()
+        if row is None:
+            raise sqlite3.DatabaseError('{0} does not have a row for the directory itself'.format(gufi_common.SUMMARY))
+
+        inode, pinode = row
+        db.execute('INSERT INTO {0} VALUES ({1});'.format(gufi_common.TREESUMMARY, ', '.join('?' * len(COLUMNS))),
+                   found.row(inode, pinode, path.count(os.path.sep)))
+        db.commit()
+    finally:
+        db.close()
+
+    if sys.version_info.major < 3:
+        os.utime(dbname, (st.st_atime, st.st_mtime))
+    else:
+        os.utime(dbname, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+def io_bytes():
+    '''bytes this process has read and written, or None if unknown'''
+    try:
+        with open('/proc/self/io', 'r') as io_file: # pylint: disable=unspecified-encoding
+            fields = dict(line.split(':', 1) for line in io_file if ':' in line)
+        return int(fields['rchar']) + int(fields['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+class Budget(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    '''Keep the bytes read and written by this process under a rate'''
+
+    def __init__(self, rate, counter=io_bytes, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.counter = counter
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.start = clock()
+        self.base = counter()
+
+        if self.base is None:
+            sys.stderr.write('Not limiting I/O: the bytes read and written by this process are not available\n')
+
+    def wait(self):
+        '''sleep until the bytes used so far fit in the budget'''
+        if self.base is None:
+            return
+
+        with self.lock:
+            ahead = (self.counter() - self.base) / float(self.rate) - (self.clock() - self.start)
+            if ahead > 0:
+                self.sleep(ahead)
+
+class TreesummaryState(gufi_sidecar.Sidecar):
+    '''
+    State of the database files of an index as of the last time the
+    treesummary tables were brought up to date
+    '''
+
+    NAME    = 'Treesummary state'
+    VERSION = 1
+    SCHEMA  = SCHEMA
+
+    def read(self, path):
+        db = gufi_index.open_db(path)
+        try:
+            return gufi_index.relpath(path, self.indexroot), gufi_sidecar.rollupscore(db)
+        finally:
+            db.close()
+
+    def store(self, dir_id, content):
+        self.db.execute('INSERT OR IGNORE INTO pending VALUES (?);', (content,))
+
+    def clear(self, dir_id):
+        # the parent of a removed directory has to be recomputed (the
+        # parent of a changed directory is recomputed anyway)
+        for rel in self.paths([dir_id]):
+            if rel:
+                self.db.execute('INSERT OR IGNORE INTO pending VALUES (?);', (os.path.dirname(rel),))
+
+    def pending(self, paths):
+        '''
+        Paths (relative to the index root) of the directories that
+        changed since they were last recomputed, including the
+        directories under the paths that could not be read
+        '''
+
+        found = set(rel for rel, in self.db.execute('SELECT path FROM pending;'))
+        for path in paths:
+            found |= set(self.paths(self.incomplete(path)))
+        return found
+
+    def done(self, written, complete=True):
+        '''
+        Record the state of the database files that were written, and
+        forget the pending directories if everything was recomputed
+        '''
+
+        with self.db:
+            if complete:
+                self.db.execute('DELETE FROM pending;')
+            for path in written:
+                try:
+                    st = os.lstat(os.path.join(path, gufi_index.DBNAME))
+                except OSError:
+                    continue
+                self.db.execute('UPDATE dirs SET mtime = ?, size = ? WHERE path == ?;',
+                                (st.st_mtime_ns, st.st_size, gufi_index.relpath(path, self.indexroot)))
+
+def plan(indexroot, pending, skip=None, threads=1):
+    '''
+    Find the directories whose treesummary tables have to be recomputed
+
+    Args:
+        indexroot: root of the index
+        pending:   paths (relative to the index root) of changed directories
+        skip:      directory basenames to not descend into
+        threads:   number of directories to check at a time
+
+    Returns:
+        list of index directories, deepest first
+    '''
+
+    skip = gufi_index.SKIP | set(skip or [])
+
+    affected = set()
+    for rel in pending:
+        if skip & set(rel.split(os.path.sep) if rel else []):
+            continue
+        while rel not in affected:
+            affected.add(rel)
+            if not rel:
+                break
+            rel = os.path.dirname(rel)
+
+    def has_treesummary(rel):
+        try:
+            db = gufi_index.open_db(os.path.join(indexroot, rel) if rel else indexroot)
+            try:
+                return has_table(db, gufi_common.TREESUMMARY)
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return None
+
+    ordered = sorted(affected, key=lambda rel: (gufi_index.depth(rel), rel))
+    existing = dict(zip(ordered, gufi_index.map_threads(has_treesummary, ordered, threads)))
+
+    # top down, so that reindexed subtrees under a directory with a
+    # treesummary table get them again
+    selected = set()
+    for rel in ordered:
+        if existing[rel] is None:
+            continue
+        if existing[rel] or ((rel in pending) and rel and (os.path.dirname(rel) in selected)):
+            selected.add(rel)
+
+    return [os.path.join(indexroot, rel) if rel else indexroot
+            for rel in sorted(selected, key=lambda rel: (-gufi_index.depth(rel), rel))]
+
+def recompute(dirs, skip=None, threads=1, budget=None):
+    '''
+    Recompute the treesummary tables of directories, a level at a time
+
+    Args:
+        dirs:    index directories, deepest first
+        skip:    directory basenames to not descend into
+        threads: number of directories to recompute at a time
+        budget:  Budget to stay under
+
+    Returns:
+        list of the directories that were written
+    '''
+
+    skip = gufi_index.SKIP | set(skip or [])
+
+    def work(path):
+        found = compute(path, skip, budget)
+        if (found is None) or (found.dirs == 0):
+            return False
+        try:
+            write(path, found)
+        except (OSError, sqlite3.Error) as err:
+            sys.stderr.write('Could not write the treesummary table of {0}: {1}\n'.format(path, err))
+            return False
+        return True
+
+    written = []
+    level = []
+    for i, path in enumerate(dirs):
+        level += [path]
+        if (i + 1 == len(dirs)) or (dirs[i + 1].count(os.path.sep) != path.count(os.path.sep)):
+            written += [done for done, ok in zip(level, gufi_index.map_threads(work, level, threads)) if ok]
+            level = []
+
+    return written
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_treesummaries',
+                                     description='Recompute the treesummary tables of the directories whose databases have changed and their ancestors')
+    parser.add_argument('action',
+                        choices=['update', 'mark', 'plan'],
+                        help='update: recompute the treesummary tables of changed directories and their ancestors; '
+                        'mark: record the current state as up to date (after gufi_treesummary_all); '
+                        'plan: print the directories update would recompute')
+    parser.add_argument('paths',
+                        nargs='*',
+                        default=[''],
+                        help='directories under the index root to look for changes in (default: all of it)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets TreesummaryState')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+    parser.add_argument('--io-budget',
+                        metavar='bytes',
+                        type=gufi_common.get_positive,
+                        default=None,
+                        help='bytes per second that can be read and written')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    if config.treesummarystate is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.TREESUMMARYSTATE, args.config))
+        return 1
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+    paths = [os.path.normpath(os.path.sep.join([config.indexroot, path])) for path in args.paths]
+
+    state = TreesummaryState(config.treesummarystate, config.indexroot)
+    try:
+        for path in paths:
+            read, reused, removed = state.update(path, skip, config.threads)
+            print('{0}: {1} changed, {2} unchanged, {3} removed'.format(path, read, reused, removed))
+
+        if args.action == 'mark':
+            state.done([])
+            return 0
+
+        dirs = plan(config.indexroot, state.pending(paths), skip, config.threads)
+        if args.action == 'plan':
+            for path in dirs:
+                print(path)
+            return 0
+
+        budget = None if args.io_budget is None else Budget(args.io_budget)
+        written = recompute(dirs, skip, config.threads, budget)
+
+        # the changes stay pending until every table has been recomputed
+        complete = len(written) == len(dirs)
+        state.done(written, complete)
+        print('{0} treesummary tables recomputed'.format(len(written)))
+        if not complete:
+            return 1
+    finally:
+        state.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,379 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# sidecar database of the trigrams of the names in each index directory
+#
+# substring searches such as gufi_find -name '*checkpoint*' have to
+# read the entries of every directory. this sidecar maps each trigram
+# (three consecutive characters, lowercased) of the names of the
+# entries and of the directory itself to the directories containing
+# them, so that only directories that have every trigram of a literal
+# in the pattern have to be queried.
+#
+# the sidecar is built from the index by a user that can read all of
+# it, and lists the paths of the index directories, so it should only
+# be readable by users that are allowed to see those paths:
+#
+#     gufi_trigram.py update [path ...]
+#
+# updates only reread the directories whose database files have
+# changed since the previous update. queries trust the sidecar, so it
+# should be updated whenever the index is.
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+
+import gufi_config
+import gufi_index
+import gufi_sidecar
+
+# shortest literal that can be looked up
+MIN_LITERAL = 3
+
+# the trigrams of the names in each directory
+POSTINGS = '''
+CREATE TABLE IF NOT EXISTS postings(trigram TEXT, dir INTEGER, PRIMARY KEY (trigram, dir)) WITHOUT ROWID;
+'''
+
+# names of the entries in a directory and of the directory itself
+NAMES = 'SELECT name FROM entries UNION SELECT name FROM summary WHERE isroot == 1;'
+
+# characters that are special in glob patterns (sqlite GLOB has no
+# escapes, and a ] right after the [ is part of the class)
+GLOB_SPECIAL = re.compile(r'[*?]|\[\]?[^]]*(?:\]|$)')
+
+# quantifiers that allow the preceding character to be absent
+OPTIONAL = '*?{'
+
+# a whole escape sequence: \Q...\E quoting, hex, unicode and octal
+# codes, backreferences, named characters and properties, control
+# characters, and single escaped characters
+ESCAPE = re.compile(r'\\(?:Q.*?(?:\\E|$)|x\{[^}]*\}?|x[0-9A-Fa-f]{0,2}|'
+                    r'u[0-9A-Fa-f]{0,4}|U[0-9A-Fa-f]{0,8}|[0-9]{1,3}|'
+                    r'[NpPgk](?:\{[^}]*\}?|<[^>]*>?)|[pPc].?|.?)', re.DOTALL)
+
+def trigrams(text):
+    '''set of the lowercased trigrams of a string'''
+    text = text.lower()
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+def glob_literals(pattern):
+    '''strings that every name matching a glob pattern contains'''
+    return [literal for literal in GLOB_SPECIAL.split(pattern) if literal]
+
+def regex_literals(pattern): # pylint: disable=too-many-branches
+    '''
+    Strings that every string matching a regular expression contains
+
+    Only the parts of the pattern outside of groups and character
+    classes are used. No literals are returned if the pattern has an
+    alternation, since the literals of one branch are not required.
+    '''
+
+    if '|' in pattern.replace('\\|', ''):
+        return []
+
+    literals = []
+    current = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        nxt = pattern[i + 1] if i + 1 < len(pattern) else ''
+
+        literal = None
+        if char == '\\':
+            # escaped punctuation is literal, everything else is a
+            # class, an anchor, or a character that is not looked up
+            escape = ESCAPE.match(pattern, i).group(0)
+            if (len(escape) == 2) and not nxt.isalnum():
+                literal = nxt
+            i += len(escape)
+        elif char in '([':
+            # skip the group or class
+            close = ')' if char == '(' else ']'
+            depth = 0
+            while i < len(pattern):
+                if pattern[i] == '\\':
+                    i += 1
+                elif pattern[i] == char:
+                    depth += 1
+                elif pattern[i] == close:
+                    depth -= 1
+                    if depth == 0:
+                        break
+                i += 1
+            i += 1
+        elif char == '{':
+            # skip the counts of the quantifier
+            close = pattern.find('}', i)
+            i = len(pattern) if close < 0 else close + 1
+        elif char in '.^$+*?})]':
+            i += 1
+        else:
+            literal = char
+            i += 1
+
+        if literal is not None:
+            # a quantifier after the character makes it optional
+            if (i < len(pattern)) and (pattern[i] in OPTIONAL):
+                literal = None
+            else:
+                current += [literal]
+                # the next character may repeat, but this one is required
+                if (i < len(pattern)) and (pattern[i] == '+'):
+                    literals += [''.join(current)]
+                    current = []
+                continue
+
+        if current:
+            literals += [''.join(current)]
+            current = []
+
+    if current:
+        literals += [''.join(current)]
+
+    return literals
+
+def read_directory(path):
+    '''return the names in an index directory and its rollup score'''
+    db = gufi_index.open_db(path)
+    try:
+        names = [name for name, in db.execute(NAMES) if name]
+        return names, gufi_sidecar.rollupscore(db)
+    finally:
+        db.close()
+
+class TrigramIndex(gufi_sidecar.Sidecar):
+    '''trigrams of the names in each directory of a GUFI index'''
+
+    NAME    = 'Trigram index'
+    VERSION = 1
+    SCHEMA  = POSTINGS
+    TABLES  = ['postings']
+
+    def __init__(self, filename, indexroot, readonly=False, timeout=60):
+        super(TrigramIndex, self).__init__(filename, indexroot, readonly, timeout)
+        self.db.create_function('casefold', 1, lambda value: value.lower())
+
+    def read(self, path):
+        return read_directory(path)
+
+    def store(self, dir_id, content):
+        grams = set()
+        for name in content:
+            grams |= trigrams(name)
+        self.db.executemany('INSERT INTO postings VALUES (?, ?);',
+                            [(gram, dir_id) for gram in grams])
+
+    def with_trigrams(self, path, literals):
+        '''ids of the directories under a path that have every trigram of the literals'''
+        grams = set()
+        for literal in literals:
+            grams |= trigrams(literal)
+
+        params = {'rel': gufi_index.relpath(path, self.indexroot), 'count': len(grams)}
+        params.update(('t{0}'.format(i), gram) for i, gram in enumerate(sorted(grams)))
+
+        found = self.db.execute('''SELECT dirs.id FROM postings, dirs
+                                   WHERE (postings.dir == dirs.id) AND (postings.trigram IN ({0})) AND {1}
+                                   GROUP BY dirs.id HAVING COUNT(*) == :count;'''.format(
+                                       ', '.join(':t{0}'.format(i) for i in range(len(grams))), gufi_index.UNDER),
+                                params)
+        return set(dir_id for dir_id, in found)
+
+    def with_path(self, path, literal):
+        '''ids of the directories under a path whose full path contains the literal'''
+        return set(dir_id for dir_id, in self.db.execute(
+            '''SELECT id FROM dirs WHERE {0} AND (instr(casefold(:indexroot || '/' || path), :literal) > 0);'''.format(
+                gufi_index.UNDER),
+            {'rel': gufi_index.relpath(path, self.indexroot),
+             'indexroot': self.indexroot,
+             'literal': literal.lower()}))
+
+def open_index(config):
+    '''
+    Open the trigram index set in a server config for reading
+
+    Returns:
+        TrigramIndex, or None if it could not be opened
+    '''
+
+    try:
+        return TrigramIndex(config.trigramindex, config.indexroot, readonly=True)
+    except (RuntimeError, sqlite3.Error) as err:
+        sys.stderr.write('Not using trigram index {0}: {1}\n'.format(config.trigramindex, err))
+        return None
+
+def usable(literals):
+    '''literals that are long enough to be looked up'''
+    return [literal for literal in literals if len(literal) >= MIN_LITERAL]
+
+def matching(index, path, names=None, inames=None, regexes=None, iregexes=None):
+    '''
+    Find the ids of the directories under a path that can contain
+    entries matching every kind of pattern (the patterns of each kind
+    are alternatives)
+
+    Returns:
+        set of directory ids, or None if no pattern has a usable literal
+    '''
+
+    found = None
+
+    for patterns, extract, whole_path in [(names,    glob_literals,  False),
+                                          (inames,   regex_literals, False),
+                                          (regexes,  regex_literals, True),
+                                          (iregexes, regex_literals, True)]:
+        if not patterns:
+            continue
+
+        ids = set()
+        for pattern in patterns:
+            literals = extract(pattern)
+
+            if whole_path:
+                # each literal may be in the path of the directory or in the
+                # name of an entry, so only use one that cannot span both
+                literals = usable([part for literal in literals for part in literal.split('/')])
+                if not literals:
+                    ids = None
+                    break
+                literal = max(literals, key=len)
+                ids |= index.with_trigrams(path, [literal]) | index.with_path(path, literal)
+            else:
+                literals = usable(literals)
+                if not literals:
+                    ids = None
+                    break
+                ids |= index.with_trigrams(path, literals)
+
+        if ids is None:
+            continue
+
+        found = ids if found is None else (found & ids)
+
+    if found is None:
+        return None
+
+    return found
+
+def candidates(index, paths, skip=None, mindepth=None, maxdepth=None, limit=gufi_sidecar.MAX_CANDIDATES, **patterns): # pylint: disable=too-many-arguments
+    '''
+    Find the directories gufi_query has to be started at, with a
+    maximum depth of 0, to get the same results as walking the paths
+    (see gufi_sidecar.candidates)
+
+    Args:
+        patterns: names, inames, regexes and iregexes passed to matching
+
+    Returns:
+        list of index directories, or None if the sidecar cannot be used
+    '''
+
+    return gufi_sidecar.candidates(index, paths,
+                                   lambda path: matching(index, path, **patterns),
+                                   skip, mindepth, maxdepth, limit)
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_trigram',
+                                     description='Maintain the trigram index used for substring name searches')
+    parser.add_argument('action',
+                        choices=['update'],
+                        help='update: reread the directories whose databases have changed')
+    parser.add_argument('paths',
+                        nargs='*',
+                        default=[''],
+                        help='directories under the index root to update (default: all of it)')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets TrigramIndex')
+    parser.add_argument('--skip',
+                        metavar='filename',
+                        help='file containing directory basenames to skip')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    if config.trigramindex is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.TRIGRAMINDEX, args.config))
+        return 1
+
+    skip = gufi_index.read_skip(args.skip) if args.skip else None
+
+    index = TrigramIndex(config.trigramindex, config.indexroot)
+    try:
+        for path in args.paths:
+            path = os.path.normpath(os.path.sep.join([config.indexroot, path]))
+            read, reused, removed = index.update(path, skip, config.threads)
+            print('{0}: {1} read, {2} unchanged, {3} removed'.format(path, read, reused, removed))
+    finally:
+        index.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
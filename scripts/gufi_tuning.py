@@ -0,0 +1,308 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# run history used to pick the thread count and output buffer size
+#
+# when History is set in the server config, each run of gufi_query
+# started by a tool records its wall time, the number of directories
+# under the starting path (from the treesummary table of the starting
+# directory, if it has one) and the -n and -B it was run with. runs are
+# keyed on the tool, the statistic or kind of query, and the depth of
+# the starting path below the index root.
+#
+# once a setting has been run enough times for a key, later runs with
+# that key use the setting with the lowest median time per directory,
+# and occasionally try a neighbouring setting so that the history
+# keeps up with the index. Threads and OutputBuffer are the largest
+# values that are used.
+#
+# the history of each user is kept separately and can be exported:
+#
+#     gufi_tuning.py export > history.csv
+
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import gufi_common
+import gufi_config
+import gufi_index
+import gufi_result_cache
+
+# bump when the layout of the history changes
+VERSION = 1
+
+# name of the database file in each user's history directory
+DBNAME = 'history.db'
+
+# runs of a setting needed before it is used instead of the config
+MIN_RUNS = 3
+
+# fraction of runs that try a setting next to the best one
+EXPLORE = 0.1
+
+# smallest output buffer size that is tried
+MIN_OUTPUTBUFFER = 4096
+
+COLUMNS = ['time', 'tool', 'variant', 'depth', 'threads', 'outputbuffer',
+           'seconds', 'directories', 'returncode']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata(name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS runs(time REAL, tool TEXT, variant TEXT, depth INTEGER, threads INTEGER, outputbuffer INTEGER, seconds REAL, directories INTEGER, returncode INTEGER);
+CREATE INDEX IF NOT EXISTS runs_idx ON runs(tool, variant, depth);
+'''
+
+def candidates(maximum, minimum=1):
+    '''powers of two from minimum up to maximum, and maximum itself'''
+    values = []
+    value = minimum
+    while value < maximum:
+        values += [value]
+        value *= 2
+    return values + [maximum]
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+def directories(path):
+    '''
+    Get the number of directories under an index directory from its
+    treesummary table
+
+    Returns:
+        the number of directories, or None if there is no treesummary table
+    '''
+
+    try:
+        rows = gufi_index.query(path, 'SELECT MAX(totsubdirs) FROM {0};'.format(gufi_common.TREESUMMARY))
+    except (OSError, sqlite3.Error):
+        return None
+
+    if (not rows) or (rows[0][0] is None):
+        return None
+
+    return rows[0][0] + 1
+
+class History(object): # pylint: disable=useless-object-inheritance
+    '''Runs of the tools by a single user'''
+
+    def __init__(self, directory, timeout=60):
+        self.filename = os.path.join(gufi_result_cache.user_directory(directory, os.geteuid()), DBNAME)
+        self.db = sqlite3.connect(self.filename, timeout=timeout)
+        self.db.executescript(SCHEMA)
+
+        metadata = dict(self.db.execute('SELECT name, value FROM metadata;').fetchall())
+
+        with self.db:
+            # drop runs recorded with older layouts
+            if metadata.get('version') != str(VERSION):
+                self.db.execute('DELETE FROM runs;')
+
+            self.db.execute('INSERT OR REPLACE INTO metadata VALUES (\'version\', ?);', (str(VERSION),))
+
+    def close(self):
+        self.db.close()
+
+    def choose(self, key, max_threads, max_outputbuffer, rng=random): # pylint: disable=too-many-locals
+        '''
+        Pick the thread count and output buffer size of a run
+
+        Args:
+            key:              (tool, variant, depth)
+            max_threads:      largest thread count to use
+            max_outputbuffer: largest output buffer size to use
+            rng:              source of random numbers
+
+        Returns:
+            (threads, output buffer size)
+        '''
+
+        thread_options = candidates(max_threads)
+        buffer_options = candidates(max_outputbuffer, min(MIN_OUTPUTBUFFER, max_outputbuffer)) \
+            if max_outputbuffer else [0]
+
+        costs = {}
+        for threads, outputbuffer, seconds, count in self.db.execute(
+                '''SELECT threads, outputbuffer, seconds, directories FROM runs
+                   WHERE (tool == ?) AND (variant == ?) AND (depth == ?) AND (returncode == 0);''', key):
+            if (threads not in thread_options) or (outputbuffer not in buffer_options):
+                continue
+            costs.setdefault((threads, outputbuffer), []).append(seconds / max(count or 1, 1))
+
+        trusted = [(median(values), setting) for setting, values in costs.items()
+                   if len(values) >= MIN_RUNS]
+        if not trusted:
+            return max_threads, max_outputbuffer
+
+        best = min(trusted)[1]
+
+        if rng.random() < EXPLORE:
+            neighbours = []
+            for options, i in [(thread_options, 0), (buffer_options, 1)]:
+                pos = options.index(best[i])
+                for other in options[max(pos - 1, 0):pos + 2]:
+                    if other != best[i]:
+                        setting = list(best)
+                        setting[i] = other
+                        neighbours += [tuple(setting)]
+            if neighbours:
+                return rng.choice(neighbours)
+
+        return best
+
+    def record(self, key, threads, outputbuffer, seconds, count, returncode): # pylint: disable=too-many-arguments
+        with self.db:
+            self.db.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);',
+                            (time.time(),) + tuple(key) + (threads, outputbuffer, seconds, count, returncode))
+
+    def export(self, out):
+        '''write all runs as CSV'''
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS)
+        for row in self.db.execute('SELECT {0} FROM runs ORDER BY time;'.format(', '.join(COLUMNS))):
+            writer.writerow(row)
+
+class Tuner(object): # pylint: disable=useless-object-inheritance
+    '''
+    Pick -n and -B for a gufi_query run from the run history and
+    record how long the run took
+
+    The values of the profile selected for the path are used if the
+    history cannot be opened.
+    '''
+
+    def __init__(self, config, key, path, rng=random):
+        profile = config.profile([path])
+        self.threads = profile.threads
+        self.outputbuffer = profile.outputbuffer
+        self.key = key
+        self.path = path
+        self.history = None
+
+        try:
+            self.history = History(config.history)
+        except (OSError, RuntimeError, sqlite3.Error) as err:
+            sys.stderr.write('Not using run history {0}: {1}\n'.format(config.history, err))
+            return
+
+        self.threads, self.outputbuffer = self.history.choose(key, profile.threads, profile.outputbuffer, rng)
+
+    def close(self):
+        if self.history is not None:
+            self.history.close()
+
+    def run(self, cmd, stdout=None, replace=False, trace=None, progress=None): # pylint: disable=unused-argument,too-many-arguments
+        '''same as gufi_common.run_command, except the process is never replaced'''
+        start = time.time()
+        rc = gufi_common.run_command(cmd, stdout, trace=trace, progress=progress)
+
+        if self.history is not None:
+            try:
+                self.history.record(self.key, self.threads, self.outputbuffer,
+                                    time.time() - start, directories(self.path), rc)
+            except sqlite3.Error as err:
+                sys.stderr.write('Could not record run in {0}: {1}\n'.format(self.history.filename, err))
+
+        return rc
+
+def key(tool, variant, path, indexroot):
+    '''identify runs that are expected to behave alike'''
+    return (tool, variant, gufi_index.depth(gufi_index.relpath(path, indexroot)))
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_tuning',
+                                     description='Work with the run history used to pick the thread count and output buffer size')
+    parser.add_argument('action',
+                        choices=['export'],
+                        help='export: write the runs of the current user as CSV')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets History')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    if config.history is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.HISTORY, args.config))
+        return 1
+
+    history = History(config.history)
+    try:
+        history.export(sys.stdout)
+    finally:
+        history.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
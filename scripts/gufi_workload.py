@@ -0,0 +1,453 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+# log of the gufi_query runs of the scripts tools, and an analyzer of it
+#
+# when Workload is set in the server config, each run of gufi_query
+# started by gufi_find or gufi_stats records the tool, a fingerprint of
+# the SQL that was run, the path the query started at, the wall and CPU
+# time of the run, and the number of directories in the subtree under
+# the starting path (from the treesummary table of the starting
+# directory, if it has one). this is the size of the subtree, not the
+# number of directories the query visited, which -y, -z, and -k can
+# make smaller. literals are replaced before the SQL is fingerprinted, so
+# queries that only differ in the values they look for are grouped.
+#
+# the log of each user is kept separately. the report ranks the
+# fingerprints and the starting paths that took the most time, and
+# suggests what might make them faster:
+#
+#     gufi_workload.py report [--all-users]
+#     gufi_workload.py export > workload.csv
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import gufi_common
+import gufi_config
+import gufi_explain
+import gufi_index
+import gufi_result_cache
+import gufi_sidecar
+import gufi_tuning
+
+# bump when the layout of the log changes
+VERSION = 2
+
+# name of the database file in each user's log directory
+DBNAME = 'workload.db'
+
+# median seconds per run at which a fingerprint or path gets suggestions
+SLOW = 1.0
+
+# fraction of the wall time spent on the CPU below which a run is
+# considered to have been waiting on the index to be read
+IO_BOUND = 0.25
+
+# number of fingerprints and paths shown by default
+TOP = 10
+
+COLUMNS = ['time', 'tool', 'fingerprint', 'indexroot', 'path',
+           'seconds', 'cpu', 'subtree_directories', 'returncode']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata(name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS runs(time REAL, tool TEXT, fingerprint TEXT, indexroot TEXT, path TEXT, seconds REAL, cpu REAL, subtree_directories INTEGER, returncode INTEGER);
+CREATE TABLE IF NOT EXISTS queries(fingerprint TEXT PRIMARY KEY, sql TEXT);
+CREATE INDEX IF NOT EXISTS runs_time_idx ON runs(time);
+'''
+
+# string literals, quoted identifiers (kept), and numbers
+LITERAL = re.compile(r"""('(?:[^']|'')*')|("(?:[^"]|"")*")|(?<![\w.])(\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)""")
+
+REGEXP = re.compile(r'\bREGEXP\b', re.IGNORECASE)
+
+def normalize(sql):
+    '''replace the literals of a SQL statement with ? and collapse whitespace'''
+    def replace(match):
+        if match.group(2):
+            return match.group(2)
+        return '?'
+
+    return ' '.join(LITERAL.sub(replace, sql).split())
+
+def statements(query_cmd):
+    '''
+    Get the SQL passed to a gufi_query command with the literals replaced
+
+    Returns:
+        list of [flag, SQL] in the order gufi_query runs them
+    '''
+
+    sql = gufi_explain.statements(query_cmd)
+    return [[flag, normalize(sql[flag])]
+            for flag in gufi_explain.SETUP + gufi_explain.STATEMENTS
+            if flag in sql]
+
+def fingerprint(sql):
+    '''identify the statements returned by statements()'''
+    return hashlib.sha256(json.dumps(sql).encode('utf-8')).hexdigest()[:16]
+
+def uses_regexp(sql):
+    '''whether REGEXP is evaluated for the rows of each directory'''
+    return any(REGEXP.search(statement) for flag, statement in sql
+               if flag in gufi_explain.PER_DIRECTORY)
+
+def median(values):
+    return gufi_tuning.median(values) if values else 0
+
+class Log(object): # pylint: disable=useless-object-inheritance
+    '''gufi_query runs of a single user'''
+
+    def __init__(self, filename, readonly=False, timeout=60):
+        self.filename = filename
+
+        if readonly:
+            self.db = sqlite3.connect(gufi_index.file_uri(filename), uri=True, timeout=timeout)
+            return
+
+        self.db = sqlite3.connect(filename, timeout=timeout)
+        self.db.executescript(SCHEMA)
+
+        metadata = dict(self.db.execute('SELECT name, value FROM metadata;').fetchall())
+
+        # drop runs recorded with older layouts
+        if metadata.get('version') != str(VERSION):
+            self.db.executescript('DROP TABLE runs; DROP TABLE queries;' + SCHEMA)
+
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO metadata VALUES (\'version\', ?);', (str(VERSION),))
+
+    def close(self):
+        self.db.close()
+
+    def record(self, tool, sql, indexroot, path, seconds, cpu, count, returncode): # pylint: disable=too-many-arguments
+        '''
+        Add a run to the log
+
+        Args:
+            tool:       name of the tool that started the run
+            sql:        statements of the run (see statements())
+            indexroot:  root of the index that was queried
+            path:       index path the query started at
+            seconds:    wall time of the run
+            cpu:        CPU time of the run
+            count:      number of directories in the subtree under path
+                        (not the number visited by the run), or None
+            returncode: return code of the run
+        '''
+
+        key = fingerprint(sql)
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO queries VALUES (?, ?);', (key, json.dumps(sql)))
+            self.db.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);',
+                            (time.time(), tool, key, indexroot,
+                             gufi_index.relpath(path, indexroot),
+                             seconds, cpu, count, returncode))
+
+    def runs(self, since=None):
+        '''runs recorded after since (seconds since the epoch) as dictionaries of COLUMNS'''
+        return [dict(zip(COLUMNS, row)) for row in self.db.execute(
+            'SELECT {0} FROM runs WHERE time >= ? ORDER BY time;'.format(', '.join(COLUMNS)),
+            (since or 0,))]
+
+    def queries(self):
+        '''fingerprint -> statements'''
+        return dict((key, json.loads(sql)) for key, sql in
+                    self.db.execute('SELECT fingerprint, sql FROM queries;'))
+
+def user_log(directory):
+    '''path of the log of the current user'''
+    return os.path.join(gufi_result_cache.user_directory(directory, os.geteuid()), DBNAME)
+
+class Recorder(object): # pylint: disable=useless-object-inheritance
+    '''
+    Record the gufi_query runs of a tool in the log of the current user
+
+    Runs are not recorded if the log cannot be opened.
+    '''
+
+    def __init__(self, config, tool, indexroot, paths, run_command=gufi_common.run_command): # pylint: disable=too-many-arguments
+        self.tool = tool
+        self.indexroot = indexroot
+        self.paths = paths
+        self.run_command = run_command
+        self.log = None
+
+        try:
+            self.log = Log(user_log(config.workload))
+        except (OSError, RuntimeError, sqlite3.Error) as err:
+            sys.stderr.write('Not using workload log {0}: {1}\n'.format(config.workload, err))
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+
+    def run(self, cmd, stdout=None, replace=False, trace=None, progress=None): # pylint: disable=unused-argument,too-many-arguments
+        '''same as gufi_common.run_command, except the process is never replaced'''
+        start = time.time()
+        before = os.times()
+        rc = self.run_command(cmd, stdout, False, trace, progress)
+        after = os.times()
+
+        if self.log is not None:
+            cpu = (after[2] - before[2]) + (after[3] - before[3])
+            counts = [gufi_tuning.directories(path) for path in self.paths]
+            try:
+                self.log.record(self.tool, statements(cmd), self.indexroot, self.paths[0],
+                                time.time() - start, cpu,
+                                None if None in counts else sum(counts), rc)
+            except sqlite3.Error as err:
+                sys.stderr.write('Could not record run in {0}: {1}\n'.format(self.log.filename, err))
+
+        return rc
+
+class Group(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    '''runs that share a fingerprint or a starting path'''
+
+    def __init__(self):
+        self.seconds = []
+        self.cpu = 0
+        self.tools = set()
+        self.paths = {}
+
+    def add(self, row):
+        self.seconds += [row['seconds']]
+        self.cpu += row['cpu'] or 0
+        self.tools.add(row['tool'])
+        path = os.path.normpath(os.path.join(row['indexroot'], row['path']))
+        self.paths[path] = self.paths.get(path, 0) + row['seconds']
+
+    def total(self):
+        return sum(self.seconds)
+
+    def busiest(self):
+        '''the starting path the most time was spent under'''
+        return max(sorted(self.paths.items()), key=lambda item: item[1])[0]
+
+def group(runs, field):
+    '''group runs by a column (or 'full' for the full starting path)'''
+    groups = {}
+    for row in runs:
+        if field == 'full':
+            key = os.path.normpath(os.path.join(row['indexroot'], row['path']))
+        else:
+            key = row[field]
+        groups.setdefault(key, Group()).add(row)
+    return sorted(groups.items(), key=lambda item: (-item[1].total(), item[0]))
+
+def rolled_up(path):
+    '''
+    Check whether an index directory has been rolled up
+
+    Returns:
+        True or False, or None if its database could not be read
+    '''
+
+    try:
+        db = gufi_index.open_db(path)
+        try:
+            return gufi_sidecar.rollupscore(db) != 0
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+
+def suggestions(runs, queries, top=TOP):
+    '''
+    Suggest remedies for the slowest fingerprints and starting paths
+
+    Args:
+        runs:    runs returned by Log.runs()
+        queries: fingerprint -> statements
+        top:     number of fingerprints and paths to look at
+
+    Returns:
+        list of strings
+    '''
+
+    found = []
+    for path, runs_at in group(runs, 'full')[:top]:
+        if median(runs_at.seconds) < SLOW:
+            continue
+
+        label = '{0} runs under {1} took {2:.2f}s'.format(len(runs_at.seconds), path, runs_at.total())
+        if gufi_tuning.directories(path) is None:
+            found += ['build treesummary under {0}: {1} and it does not have a treesummary table (gufi_treesummary_all {0})'.format(path, label)]
+        if rolled_up(path) is False:
+            found += ['run gufi_rollup on {0}: {1} and it has not been rolled up'.format(path, label)]
+
+    for key, runs_of in group(runs, 'fingerprint')[:top]:
+        if median(runs_of.seconds) < SLOW:
+            continue
+
+        if uses_regexp(queries.get(key, [])):
+            found += ['{0} evaluates REGEXP for every row: the -iname, -regex, and -iregex patterns of gufi_find are matched with REGEXP. '
+                      'Use -name (GLOB) if the case of the name is known, or set TrigramIndex so that only directories that can match are queried'.format(key)]
+
+        if runs_of.cpu < IO_BOUND * runs_of.total():
+            found += ['{0} spent {1:.0f}% of its time on the CPU, so it was mostly waiting on the index to be read. '
+                      'Try more threads for {2} with Profiles'.format(key, 100.0 * runs_of.cpu / max(runs_of.total(), 1e-9),
+                                                                    runs_of.busiest())]
+
+    return found
+
+def report(runs, queries, out, top=TOP):
+    '''write the slowest fingerprints and starting paths, and the suggested remedies'''
+    out.write('Slowest queries\n')
+    for key, runs_of in group(runs, 'fingerprint')[:top]:
+        out.write('    {0} {1} runs total {2:.2f}s median {3:.2f}s cpu {4:.2f}s ({5}) e.g. {6}\n'.format(
+            key, len(runs_of.seconds), runs_of.total(), median(runs_of.seconds), runs_of.cpu,
+            ', '.join(sorted(runs_of.tools)), runs_of.busiest()))
+        for flag, sql in queries.get(key, []):
+            out.write('        {0} {1}\n'.format(flag, sql))
+
+    out.write('Hot subtrees\n')
+    for path, runs_at in group(runs, 'full')[:top]:
+        out.write('    {0} {1} runs total {2:.2f}s median {3:.2f}s\n'.format(
+            path, len(runs_at.seconds), runs_at.total(), median(runs_at.seconds)))
+
+    out.write('Suggestions\n')
+    for suggestion in suggestions(runs, queries, top):
+        out.write('    {0}\n'.format(suggestion))
+
+def export(runs, out):
+    '''write runs as CSV'''
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    for row in runs:
+        writer.writerow([row[col] for col in COLUMNS])
+
+def logs(directory, all_users=False):
+    '''filenames of the logs of the current user, or of every user that can be read'''
+    if all_users:
+        return sorted(glob.glob(os.path.join(directory, '*', DBNAME)))
+    return [user_log(directory)]
+
+def run(argv):
+    parser = argparse.ArgumentParser('gufi_workload',
+                                     description='Analyze the gufi_query runs of the tools')
+    parser.add_argument('action',
+                        choices=['report', 'export'],
+                        help='report: rank the slowest queries and subtrees and suggest remedies, '
+                        'export: write the runs as CSV')
+    parser.add_argument('--config',
+                        metavar='filename',
+                        default=gufi_config.PATH,
+                        help='server config that sets Workload')
+    parser.add_argument('--all-users',
+                        action='store_true',
+                        help='use the logs of every user that can be read instead of only the current user')
+    parser.add_argument('--since',
+                        metavar='days',
+                        type=float,
+                        default=None,
+                        help='only use runs from the last this many days')
+    parser.add_argument('--top',
+                        metavar='n',
+                        type=gufi_common.get_positive,
+                        default=TOP,
+                        help='number of queries and subtrees to show')
+
+    args = parser.parse_args(argv[1:])
+
+    config = gufi_config.Server(args.config)
+    if config.workload is None:
+        sys.stderr.write('{0} is not set in {1}\n'.format(gufi_config.Server.WORKLOAD, args.config))
+        return 1
+
+    since = None if args.since is None else time.time() - args.since * 24 * 60 * 60
+
+    runs = []
+    queries = {}
+    for filename in logs(config.workload, args.all_users):
+        if not os.path.isfile(filename):
+            continue
+
+        try:
+            log = Log(filename, readonly=True)
+            try:
+                runs += log.runs(since)
+                queries.update(log.queries())
+            finally:
+                log.close()
+        except sqlite3.Error as err:
+            sys.stderr.write('Could not read {0}: {1}\n'.format(filename, err))
+
+    if args.action == 'export':
+        export(runs, sys.stdout)
+    else:
+        report(runs, queries, sys.stdout, args.top)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv))
@@ -0,0 +1,137 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+# index directories and sidecars shared by the unit tests of the sidecars
+#
+# each test describes the tables of its index directories, and gets
+# make_dir and write_dir functions for them from dir_factory
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+
+def dir_factory(tables):
+    '''
+    Functions creating index directories
+
+    Args:
+        tables: function taking the name of a directory and the
+                arguments given to make_dir and write_dir, returning a
+                list of (table name, column definitions, rows)
+
+    Returns:
+        make_dir, which creates a directory and its database, and
+        write_dir, which replaces the database of a directory
+    '''
+
+    def write_dir(path, *args, **kwargs):
+        filename = os.path.join(path, gufi_index.DBNAME)
+        if os.path.exists(filename):
+            os.remove(filename)
+        db = sqlite3.connect(filename)
+        for name, columns, rows in tables(os.path.basename(path), *args, **kwargs):
+            db.execute('CREATE TABLE {0}({1});'.format(name, ', '.join(columns)))
+            db.executemany('INSERT INTO {0} VALUES ({1});'.format(name, ', '.join('?' * len(columns))),
+                           rows)
+        db.commit()
+        db.close()
+
+    def make_dir(path, *args, **kwargs):
+        os.makedirs(path)
+        write_dir(path, *args, **kwargs)
+
+    return make_dir, write_dir
+
+class IndexTestCase(unittest.TestCase):
+    '''
+    An index in a temporary directory
+
+    Subclasses build their sidecar as self.index and set CANDIDATES to
+    the function finding the candidate directories in it. Anything
+    registered with addCleanup in setUp is cleaned up before the
+    temporary directory is removed.
+    '''
+
+    CANDIDATES = None
+
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.indexroot = os.path.join(self.tmp, 'index')
+        self.index = None
+
+    def path(self, *parts):
+        return os.path.join(self.indexroot, *parts)
+
+    def find(self, paths=None, **kwargs):
+        return self.CANDIDATES(self.index, paths or [self.indexroot], **kwargs) # pylint: disable=not-callable
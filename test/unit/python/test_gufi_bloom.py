@@ -0,0 +1,226 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_bloom
+import gufi_index
+
+# minimal versions of the tables used to create the pentries view
+SCHEMA = '''
+CREATE TABLE entries(name TEXT, inode TEXT);
+CREATE TABLE summary(name TEXT, inode TEXT, pinode TEXT, isroot INT64, mode INT64, uid INT64, gid INT64);
+CREATE TABLE pentries_rollup(name TEXT, inode TEXT, pinode TEXT, ppinode TEXT);
+CREATE VIEW pentries AS SELECT entries.*, summary.inode AS pinode, summary.pinode AS ppinode FROM entries, summary WHERE isroot == 1 UNION SELECT * FROM pentries_rollup;
+CREATE TABLE external_dbs_pwd(type TEXT, pinode TEXT, filename TEXT, mode INT64, uid INT64, gid INT64, PRIMARY KEY(type, pinode, filename));
+'''
+
+NAMES = ['core.{0}'.format(i) for i in range(500)]
+
+class TestBloom(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp, 'sub'))
+
+        for path in [self.tmp, os.path.join(self.tmp, 'sub')]:
+            db = sqlite3.connect(os.path.join(path, gufi_index.DBNAME))
+            db.executescript(SCHEMA)
+            db.execute('INSERT INTO summary VALUES (\'dir\', \'1\', \'0\', 1, 16877, 0, 0);')
+            db.executemany('INSERT INTO entries VALUES (?, ?);',
+                           [(name, str(i)) for i, name in enumerate(NAMES)])
+            db.execute('INSERT INTO pentries_rollup VALUES (\'rolled.h5\', \'9999\', \'8\', \'1\');')
+            db.commit()
+            db.close()
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def contains(self, path, name, inodes=('1', '8')): # pylint: disable=no-self-use
+        # what gufi_query does with the -Q arguments from attach()
+        db = sqlite3.connect(':memory:')
+        try:
+            db.execute('ATTACH ? AS bloom;', (os.path.join(path, gufi_bloom.DBNAME),))
+            db.execute('CREATE TEMP TABLE esummary(inode TEXT);')
+            db.executemany('INSERT INTO esummary VALUES (?);', [(inode,) for inode in inodes])
+            db.execute('CREATE TEMP VIEW name_bloom_view AS SELECT * FROM bloom.name_bloom;')
+            return db.execute('SELECT {0};'.format(gufi_bloom.might_have([name]))).fetchall()[0][0] == 1
+        finally:
+            db.close()
+
+    def test_size(self):
+        self.assertEqual((gufi_bloom.MIN_BITS, 1), gufi_bloom.size(0, 0.5))
+        bits, count = gufi_bloom.size(1000, 0.01)
+        self.assertEqual((9586, 7), (bits, count))
+
+    def test_build(self):
+        bits, count, words = gufi_bloom.build(NAMES, 0.01)
+        for name in NAMES:
+            for position in gufi_bloom.positions(name, bits, count):
+                word, bit = divmod(position, gufi_bloom.WORD_BITS)
+                self.assertTrue(words[word] & (1 << bit))
+
+        # names that are not bytes are hashed as UTF-8
+        self.assertEqual(gufi_bloom.hashes(b'caf\xc3\xa9'), gufi_bloom.hashes(u'café'))
+
+    def test_exact_names(self):
+        self.assertEqual(['core.1', 'foo.h5'], gufi_bloom.exact_names(['core.1', 'foo.h5']))
+        self.assertIsNone(gufi_bloom.exact_names(['core.1', 'core.*']))
+        self.assertIsNone(gufi_bloom.exact_names(['core.?']))
+        self.assertIsNone(gufi_bloom.exact_names(['core.[12]']))
+
+    def test_run(self):
+        self.assertFalse(gufi_bloom.available(self.tmp))
+
+        self.assertEqual(gufi_bloom.run(['gufi_bloom', '-n', '2', '--false-positive-rate', '0.01', self.tmp]), 0)
+
+        for path in [self.tmp, os.path.join(self.tmp, 'sub')]:
+            self.assertTrue(gufi_bloom.available(path))
+            self.assertEqual(gufi_index.query(path, 'SELECT type, pinode, filename, mode FROM external_dbs_pwd;'),
+                             [('user_db', '1', os.path.realpath(os.path.join(path, gufi_bloom.DBNAME)), 16877)])
+
+            # no false negatives, including rolled up entries
+            for name in NAMES + ['rolled.h5']:
+                self.assertTrue(self.contains(path, name))
+
+            # rolled up entries are only in the filter of their own directory
+            self.assertFalse(self.contains(path, 'rolled.h5', ['1']))
+
+            # about as many false positives as requested
+            false_positives = sum(self.contains(path, 'missing.{0}'.format(i), ['1']) for i in range(1000))
+            self.assertLess(false_positives, 30)
+
+            # directories without a filter are always searched
+            self.assertTrue(self.contains(path, 'missing.0', ['2']))
+
+        # a higher rate uses a smaller filter
+        self.assertEqual(gufi_bloom.run(['gufi_bloom', '--false-positive-rate', '0.5', self.tmp]), 0)
+        db = sqlite3.connect(os.path.join(self.tmp, gufi_bloom.DBNAME))
+        self.assertEqual(db.execute('SELECT DISTINCT nbits, nhashes FROM name_bloom WHERE pinode == \'1\';').fetchall(),
+                         [gufi_bloom.size(len(NAMES), 0.5)])
+        db.close()
+
+        self.assertEqual(gufi_bloom.run(['gufi_bloom', '--remove', self.tmp]), 0)
+        self.assertFalse(gufi_bloom.available(self.tmp))
+        self.assertEqual(gufi_index.query(self.tmp, 'SELECT COUNT(*) FROM external_dbs_pwd;'), [(0,)])
+
+    def test_permissions(self):
+        os.chmod(os.path.join(self.tmp, gufi_index.DBNAME), 0o640)
+        gufi_bloom.process(self.tmp)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.tmp, gufi_bloom.DBNAME)).st_mode), 0o640)
+
+    def test_times(self):
+        # gufi_query -m relies on the times of the database file
+        dbname = os.path.join(self.tmp, gufi_index.DBNAME)
+        os.utime(dbname, (1000000000, 1000000000))
+
+        gufi_bloom.process(self.tmp)
+        self.assertEqual(int(os.stat(dbname).st_mtime), 1000000000)
+        self.assertEqual(int(os.stat(dbname).st_atime), 1000000000)
+
+        gufi_bloom.process(self.tmp, remove=True)
+        self.assertEqual(int(os.stat(dbname).st_mtime), 1000000000)
+
+    def test_attach(self):
+        init, external = gufi_bloom.attach()
+        self.assertEqual(['-Q', gufi_bloom.DBNAME, 'name_bloom', 'name_bloom_template.name_bloom', 'name_bloom_view'],
+                         external)
+
+        db = sqlite3.connect(':memory:')
+        db.executescript(init)
+        db.executescript('''
+        CREATE TEMP TABLE esummary(inode TEXT);
+        INSERT INTO esummary VALUES ('1');
+        CREATE TEMP VIEW name_bloom_view AS SELECT * FROM name_bloom_template.name_bloom;
+        ''')
+        might_have = 'SELECT {0};'.format(gufi_bloom.might_have(['core.1']))
+
+        # a directory without a filter matches everything
+        self.assertEqual(db.execute(might_have).fetchall(), [(1,)])
+
+        def insert(pinode, names):
+            bits, count, words = gufi_bloom.build(names)
+            db.executemany('INSERT INTO name_bloom_template.name_bloom VALUES (?, ?, ?, ?, ?);',
+                           [(pinode, bits, count, word, word_bits) for word, word_bits in words.items()])
+
+        insert('2', ['core.1'])
+        self.assertEqual(db.execute(might_have).fetchall(), [(1,)])
+
+        insert('1', ['core.2'])
+        self.assertEqual(db.execute(might_have).fetchall(), [(0,)])
+
+        # a rolled up copy of the filter of a directory with a different size
+        insert('1', NAMES)
+        self.assertEqual(db.execute(might_have).fetchall(), [(1,)])
+        db.close()
+
+if __name__ == '__main__':
+    unittest.main()
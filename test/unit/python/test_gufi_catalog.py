@@ -0,0 +1,196 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_catalog
+import gufi_config
+import gufi_index
+
+def make_dir(path, size):
+    '''create an index directory whose database file has the given size'''
+    os.makedirs(path)
+    with open(os.path.join(path, gufi_index.DBNAME), 'wb') as db:
+        db.write(b'\0' * size)
+
+def build_config(indexroot, catalog):
+    return gufi_config.Server([
+        '{0}=1\n'.format(gufi_config.Server.THREADS),
+        '{0}=/bin/true\n'.format(gufi_config.Server.QUERY),
+        '{0}=/bin/true\n'.format(gufi_config.Server.STAT),
+        '{0}={1}\n'.format(gufi_config.Server.INDEXROOT, indexroot),
+        '{0}=0\n'.format(gufi_config.Server.OUTPUTBUFFER),
+        '{0}={1}\n'.format(gufi_config.Server.CATALOG, catalog),
+    ])
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.indexroot = os.path.join(self.tmp, 'index')
+        self.filename = os.path.join(self.tmp, 'catalog.db')
+
+        make_dir(self.indexroot,                                1)
+        make_dir(os.path.join(self.indexroot, 'a'),             10)
+        make_dir(os.path.join(self.indexroot, 'a', 'aa'),       100)
+        make_dir(os.path.join(self.indexroot, 'a', 'aa', 'x'),  1000)
+        make_dir(os.path.join(self.indexroot, 'b'),             10000)
+        make_dir(os.path.join(self.indexroot, 'b', 'bb'),       100000)
+
+        self.catalog = gufi_catalog.Catalog(self.filename)
+        self.assertEqual(6, self.catalog.refresh(self.indexroot, threads=2))
+
+    def tearDown(self): # pylint: disable=invalid-name
+        self.catalog.close()
+        shutil.rmtree(self.tmp)
+
+    def path(self, *parts):
+        return os.path.join(self.indexroot, *parts)
+
+    def estimate(self, path, mindepth=None, maxdepth=None):
+        found = self.catalog.estimate(self.indexroot, path, mindepth, maxdepth)
+        return None if found is None else (found.dirs, found.bytes, found.exact)
+
+    def test_estimate(self):
+        self.assertEqual((6, 111111, True), self.estimate(self.indexroot))
+        self.assertEqual((3, 10011, True),  self.estimate(self.indexroot, maxdepth=1))
+        self.assertEqual((3, 101100, True), self.estimate(self.indexroot, mindepth=2))
+
+        self.assertEqual((3, 1110, True),   self.estimate(self.path('a')))
+        self.assertEqual((1, 100, True),    self.estimate(self.path('a'), mindepth=1, maxdepth=1))
+
+        # deeper paths only get the totals of their top level subtree
+        self.assertEqual((2, 1100, False),  self.estimate(self.path('a', 'aa')))
+
+        self.assertIsNone(self.estimate(self.path('missing')))
+        self.assertIsNone(self.catalog.estimate(self.path('a'), self.path('a')))
+
+    def test_refresh(self):
+        make_dir(self.path('a', 'ab'), 5)
+        shutil.rmtree(self.path('b'))
+
+        # only the given subtree is recounted
+        self.assertEqual(4, self.catalog.refresh(self.indexroot, ['a']))
+        self.assertEqual((7, 111116, True), self.estimate(self.indexroot))
+
+        # recounting everything drops subtrees that are gone
+        self.assertEqual(4, self.catalog.refresh(self.indexroot, skip=['x']))
+        self.assertEqual((4, 116, True), self.estimate(self.indexroot))
+        self.assertIsNone(self.estimate(self.path('b')))
+
+    def test_levels(self):
+        self.assertEqual((None, None), gufi_catalog.levels(['gufi_query', '-n', '1']))
+        self.assertEqual((1, 2), gufi_catalog.levels(['gufi_query', '-z', '5', '-y', '1', '-z', '2']))
+
+    def test_query_estimate(self):
+        config = build_config(self.indexroot, self.filename)
+
+        found = gufi_catalog.estimate(config, ['gufi_query', '-z', '1'], [(self.indexroot, [self.path('a'), self.path('b')])])
+        self.assertEqual((4, 110110, True), found[:3])
+
+        # directories queried without descending do not need the catalog
+        config = build_config(self.indexroot, os.path.join(self.tmp, 'missing.db'))
+        found = gufi_catalog.estimate(config, ['gufi_query', '-z', '0'], [(self.indexroot, [self.path('a', 'aa'), self.path('missing')])])
+        self.assertEqual((1, 100, True), found[:3])
+
+        self.assertIsNone(gufi_catalog.estimate(config, ['gufi_query'], [(self.indexroot, [self.indexroot])]))
+
+        out = io.StringIO()
+        self.assertEqual(1, gufi_catalog.print_estimate(None, out))
+        out = io.StringIO()
+        self.assertEqual(0, gufi_catalog.print_estimate(gufi_catalog.Estimate(2, 3, False, 0), out))
+        self.assertIn('Directories: at most 2\n', out.getvalue())
+
+class TestProgress(unittest.TestCase):
+    def test_line(self):
+        progress = gufi_catalog.Progress(1000)
+        self.assertEqual('25.0% of 1000 bytes read, 10s elapsed, ETA 30s', progress.line(250, 10))
+        self.assertEqual('99.9% of 1000 bytes read, 10s elapsed, ETA 0s', progress.line(5000, 10))
+        self.assertEqual('0.0% of 1000 bytes read, 1s elapsed, ETA unknown', progress.line(0, 1))
+        self.assertEqual('3s elapsed', progress.line(None, 3))
+        self.assertEqual('5 bytes read, 3s elapsed', gufi_catalog.Progress(None).line(5, 3))
+
+    def test_run(self):
+        out = io.StringIO()
+        progress = gufi_catalog.Progress(1, out, interval=0.01)
+        proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(0.2)']) # pylint: disable=consider-using-with
+        progress.start(proc.pid)
+        proc.wait()
+        progress.stop()
+        lines = out.getvalue().splitlines()
+        self.assertTrue(len(lines) > 1)
+        self.assertTrue(lines[-1].startswith('done in '))
+
+if __name__ == '__main__':
+    unittest.main()
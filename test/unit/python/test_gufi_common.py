@@ -63,7 +63,9 @@
 
 import argparse
 import os
+import subprocess
 import sys
+import tempfile
 import unittest
 
 sys.path += [
@@ -96,6 +98,17 @@ class TestGUFICommon(unittest.TestCase):
         with self.assertRaises(ValueError):
             gufi_common.get_non_negative('')
 
+    def test_get_fraction(self):
+        for fraction in [0.001, 0.5, 1]:
+            self.assertEqual(fraction, gufi_common.get_fraction(str(fraction)))
+
+        for not_fraction in [-1, 0, 1.5]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                gufi_common.get_fraction(str(not_fraction))
+
+        with self.assertRaises(ValueError):
+            gufi_common.get_fraction('')
+
     def test_get_char(self):
         for c in range(256):
             self.assertEqual(chr(c), gufi_common.get_char(chr(c)))
@@ -123,6 +136,25 @@ class TestGUFICommon(unittest.TestCase):
         with self.assertRaises(ValueError):
             gufi_common.get_group('')
 
+    def test_get_indexes(self):
+        indexes = gufi_common.get_indexes('home:/search/home/, scratch:/search//scratch')
+        self.assertEqual([('home', '/search/home'), ('scratch', '/search/scratch')], list(indexes.items()))
+
+        for invalid in ['', 'home', 'home:', ':/search', 'all:/search', 'home:/a,home:/b']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                gufi_common.get_indexes(invalid)
+
+    def test_get_profiles(self):
+        profiles = gufi_common.get_profiles('/search/scratch/:Threads=64,Compress=1; home:OutputBuffer=0,Memory=1024,Subdirs=8')
+        self.assertEqual([('/search/scratch', {'Threads': 64, 'Compress': True}),
+                          ('home', {'OutputBuffer': 0, 'Memory': 1024, 'Subdirs': 8})],
+                         list(profiles.items()))
+
+        for invalid in ['', '/search', ':Threads=1', '/search:', '/search:Threads', '/search:Threads=0',
+                        '/search:Unknown=1', '/a:Threads=1;/a/:Threads=2']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                gufi_common.get_profiles(invalid)
+
     def test_get_port(self):
         for valid_port in range(65536):
             self.assertEqual(valid_port, gufi_common.get_port(str(valid_port)))
@@ -161,6 +193,29 @@ class TestGUFICommon(unittest.TestCase):
                                         extra)
         self.assertEqual(expected, built)
 
+    def test_sql_literal(self):
+        self.assertEqual('NULL',          gufi_common.sql_literal(None))
+        self.assertEqual('1',             gufi_common.sql_literal(True))
+        self.assertEqual('1000',          gufi_common.sql_literal(1000))
+        self.assertEqual('-1.5',          gufi_common.sql_literal(-1.5))
+        self.assertEqual('9e999',         gufi_common.sql_literal(float('inf')))
+        self.assertEqual('\'it\'\'s\'',    gufi_common.sql_literal('it\'s'))
+        self.assertEqual('X\'00ff\'',      gufi_common.sql_literal(bytearray([0, 255])))
+
+    def test_bind(self):
+        params = {}
+        self.assertEqual(':p0', gufi_common.param(params, 1000))
+        self.assertEqual(':p1', gufi_common.param(params, 'a\'b'))
+        self.assertEqual({'p0': 1000, 'p1': 'a\'b'}, params)
+
+        # parameters in string literals and identifiers are not replaced
+        self.assertEqual('SELECT \':p0\', ":p1" FROM t WHERE (uid == 1000) AND (name GLOB \'a\'\'b\')',
+                         gufi_common.bind('SELECT \':p0\', ":p1" FROM t WHERE (uid == :p0) AND (name GLOB :p1)',
+                                          params))
+
+        with self.assertRaises(KeyError):
+            gufi_common.bind('SELECT :missing', params)
+
     def test_add_common_flags(self):
         parser = argparse.ArgumentParser()
         gufi_common.add_common_flags(parser)
@@ -172,6 +227,95 @@ class TestGUFICommon(unittest.TestCase):
         self.assertEqual('out',       args.inmemory_name)
         self.assertEqual('aggregate', args.aggregate_name)
         self.assertEqual(None,        args.skip)
+        self.assertEqual(None,        args.trace_out)
+
+    def test_run_command(self):
+        self.assertEqual(0, gufi_common.run_command([sys.executable, '-c', 'pass']))
+        self.assertEqual(3, gufi_common.run_command([sys.executable, '-c', 'import sys; sys.exit(3)']))
+
+        with tempfile.TemporaryFile() as out:
+            self.assertEqual(0, gufi_common.run_command([sys.executable, '-c', 'print("abc")'], out))
+            out.seek(0)
+            self.assertEqual(b'abc', out.read().strip())
+
+        # the replaced process does not print anything after the command
+        script = ('import sys; sys.path.append({0!r}); import gufi_common; '
+                  'print("before"); '
+                  'gufi_common.run_command([sys.executable, "-c", "print(123)"], replace=True); '
+                  'print("after")').format(os.path.join('@CMAKE_BINARY_DIR@', 'scripts'))
+        self.assertEqual(b'before\n123\n', subprocess.check_output([sys.executable, '-c', script]))
+
+    def test_schema_types(self):
+        self.assertEqual([gufi_common.to_integer, gufi_common.to_text,
+                          gufi_common.to_real, gufi_common.to_blob,
+                          gufi_common.to_numeric, gufi_common.to_integer],
+                         gufi_common.schema_types('CREATE TABLE t(a INT64, b VARCHAR(10) NOT NULL, '
+                                                  'c DOUBLE, d, e DECIMAL(10, 5), '
+                                                  'f INTEGER PRIMARY KEY, UNIQUE(a, b));'))
+
+        with self.assertRaises(ValueError):
+            gufi_common.schema_types('SELECT 1;')
+
+    def test_column_types(self):
+        create = 'CREATE TABLE t(a INT64);'
+        self.assertEqual([gufi_common.to_integer],
+                         gufi_common.column_types(['gufi_query', '-I', 'CREATE TABLE t(a TEXT);',
+                                                   '-K', create, 'index']))
+        self.assertEqual([gufi_common.to_integer],
+                         gufi_common.column_types(['gufi_query', '-I', create, 'index']))
+        self.assertIsNone(gufi_common.column_types(['gufi_query', '-E', 'SELECT 1;', 'index']))
+
+        # the columns printed by -G
+        create = 'CREATE TABLE t(id INT64, name TEXT, size INT64);'
+        self.assertEqual([gufi_common.to_numeric],
+                         gufi_common.column_types(['gufi_query', '-K', create,
+                                                   '-G', 'SELECT SUM(size) FROM t;', 'index']))
+        self.assertEqual([gufi_common.to_text, gufi_common.to_numeric],
+                         gufi_common.column_types(['gufi_query', '-K', create,
+                                                   '-G', 'SELECT t.name, COUNT(*) FROM t GROUP BY name;', 'index']))
+        self.assertEqual([gufi_common.to_integer, gufi_common.to_text, gufi_common.to_integer],
+                         gufi_common.column_types(['gufi_query', '-K', create,
+                                                   '-G', 'SELECT * FROM t;', 'index']))
+        self.assertEqual([gufi_common.to_text],
+                         gufi_common.column_types(['gufi_query', '-I', create,
+                                                   '-E', 'SELECT name FROM entries;', 'index']))
+
+    def test_select_columns(self):
+        self.assertEqual(['a', 'SUM(b)', "'x, from y'"],
+                         gufi_common.select_columns("SELECT a, SUM(b), 'x, from y' FROM t WHERE c;"))
+        self.assertEqual(['(SELECT 1 FROM u)', 'fromage'],
+                         gufi_common.select_columns('select distinct (SELECT 1 FROM u), fromage from t;'))
+        self.assertEqual(['1'], gufi_common.select_columns('SELECT 1;'))
+        self.assertIsNone(gufi_common.select_columns('INSERT INTO t VALUES (1);'))
+
+    def test_parse_rows(self):
+        types = [gufi_common.to_integer, gufi_common.to_text, gufi_common.to_real]
+        output = '1\x1ea\nb\x1e2.5\n\x1e\x1e\n'.encode('latin-1')
+
+        # rows split across chunks of every size
+        for size in range(1, len(output) + 1):
+            chunks = [output[i:i + size] for i in range(0, len(output), size)]
+            self.assertEqual([(1, 'a\nb', 2.5), (None, '', None)],
+                             list(gufi_common.parse_rows(chunks, types)))
+
+        self.assertEqual([('a', 'b'), ('c',)],
+                         list(gufi_common.parse_rows(['a b\nc\n'.encode('latin-1')], None, ' ')))
+
+        with self.assertRaises(ValueError):
+            list(gufi_common.parse_rows(['1\x1ea'.encode('latin-1')], types))
+
+    def test_stream_rows(self):
+        script = 'import sys; sys.stdout.write("1,a\\n2,b\\n")'
+        cmd = [sys.executable, '-c', script, '-d', ',', '-K', 'CREATE TABLE t(i INT64, s TEXT);']
+        self.assertEqual([(1, 'a'), (2, 'b')], list(gufi_common.stream_rows(cmd, chunk_size=1)))
+
+        # stopping early does not wait for the rest of the output
+        rows = gufi_common.stream_rows(cmd)
+        self.assertEqual((1, 'a'), next(rows))
+        rows.close()
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(gufi_common.stream_rows([sys.executable, '-c', 'import sys; sys.exit(1)', '-d', ',']))
 
 if __name__ == '__main__':
     unittest.main()
@@ -64,6 +64,7 @@
 import copy
 import os
 import sys
+import tempfile
 import unittest
 
 sys.path += [
@@ -136,6 +137,156 @@ class TestServerConfig(unittest.TestCase):
     def test_bad_outputbuffer(self):
         self.bad_int(gufi_config.Server.OUTPUTBUFFER, ['-1', '', 'abc'])
 
+    def test_optional(self):
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertIsNone(config.statscache)
+
+        self.pairs[gufi_config.Server.STATSCACHE] = '/statscache//cache.db'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/statscache/cache.db', config.statscache)
+
+        self.assertIsNone(config.resultcache)
+        self.assertIsNone(config.resultcachesize)
+
+        self.pairs[gufi_config.Server.RESULTCACHE] = '/resultcache/'
+        self.pairs[gufi_config.Server.RESULTCACHESIZE] = 1024
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/resultcache', config.resultcache)
+        self.assertEqual(1024, config.resultcachesize)
+
+        self.assertIsNone(config.history)
+
+        self.pairs[gufi_config.Server.HISTORY] = '/history/'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/history', config.history)
+
+        self.assertIsNone(config.trigramindex)
+
+        self.pairs[gufi_config.Server.TRIGRAMINDEX] = '/trigrams//index.db'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/trigrams/index.db', config.trigramindex)
+
+        self.assertIsNone(config.ownerindex)
+
+        self.pairs[gufi_config.Server.OWNERINDEX] = '/owners//index.db'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/owners/index.db', config.ownerindex)
+
+        self.assertIsNone(config.inodeindex)
+
+        self.pairs[gufi_config.Server.INODEINDEX] = '/inodes//index.db'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/inodes/index.db', config.inodeindex)
+
+        self.assertIsNone(config.summarymirror)
+
+        self.pairs[gufi_config.Server.SUMMARYMIRROR] = '/mirror//summary.db'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/mirror/summary.db', config.summarymirror)
+
+        self.assertIsNone(config.catalog)
+
+        self.pairs[gufi_config.Server.CATALOG] = '/catalog//sizes.db'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/catalog/sizes.db', config.catalog)
+
+        self.assertIsNone(config.workload)
+
+        self.pairs[gufi_config.Server.WORKLOAD] = '/workload//'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/workload', config.workload)
+
+        self.assertIsNone(config.treesummarystate)
+
+        self.pairs[gufi_config.Server.TREESUMMARYSTATE] = '/state//treesummary.db'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual('/state/treesummary.db', config.treesummarystate)
+
+    def test_select_indexes(self):
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual({}, config.indexes)
+        self.assertEqual([(None, config.indexroot)], config.select_indexes())
+        self.assertEqual([(None, config.indexroot)], config.select_indexes('all'))
+        with self.assertRaises(ValueError):
+            config.select_indexes('home')
+
+        self.pairs[gufi_config.Server.INDEXES] = 'scratch:/search/scratch,home:/search/home'
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual(['scratch', 'home'], list(config.indexes.keys()))
+
+        # IndexRoot is still the default
+        self.assertEqual([(None, config.indexroot)], config.select_indexes())
+        self.assertEqual([('scratch', '/search/scratch'), ('home', '/search/home')],
+                         config.select_indexes('all'))
+        self.assertEqual([('home', '/search/home'), ('scratch', '/search/scratch')],
+                         config.select_indexes('home,scratch,home'))
+        with self.assertRaises(ValueError):
+            config.select_indexes('home,projects')
+
+    def test_profile(self):
+        config = gufi_config.Server(build_config(self.pairs))
+        self.assertEqual({}, config.profiles)
+        profile = config.profile(['/search/scratch'])
+        self.assertEqual((5, 1024, None, None, False, None),
+                         (profile.threads, profile.outputbuffer, profile.memory,
+                          profile.subdirs, profile.compress, profile.prefix))
+        self.assertEqual([], profile.flags())
+
+        self.pairs[gufi_config.Server.INDEXROOT] = '/search'
+        self.pairs[gufi_config.Server.PROFILES] = ';'.join([
+            '/search/scratch:Threads=64,Memory=1073741824',
+            'scratch/many_files:OutputBuffer=1048576,Compress=1',
+            '/search/scratch/many_dirs:Subdirs=8',
+            '/search/home:Threads=2',
+        ])
+        config = gufi_config.Server(build_config(self.pairs))
+
+        # longer prefixes override shorter ones, relative prefixes are under IndexRoot
+        profile = config.profile(['/search/scratch/many_files/a'])
+        self.assertEqual('/search/scratch/many_files', profile.prefix)
+        self.assertEqual((64, 1048576), (profile.threads, profile.outputbuffer))
+        self.assertEqual(['-M', '1073741824', '-e'], profile.flags())
+
+        profile = config.profile(['/search/scratch/many_dirs'])
+        self.assertEqual(['-M', '1073741824', '-C', '8'], profile.flags())
+
+        # prefixes only match whole path components
+        profile = config.profile(['/search/homes'])
+        self.assertEqual((5, None), (profile.threads, profile.prefix))
+
+        # several paths use the profile of the directory containing all of them
+        profile = config.profile(['/search/scratch/many_files', '/search/scratch/many_dirs'])
+        self.assertEqual(('/search/scratch', 64, 1024), (profile.prefix, profile.threads, profile.outputbuffer))
+        profile = config.profile(['/search/scratch', '/search/home'])
+        self.assertIsNone(profile.prefix)
+
+    def test_common_directory(self):
+        self.assertIsNone(gufi_config.common_directory([]))
+        self.assertEqual('/a/b', gufi_config.common_directory(['/a/b/']))
+        self.assertEqual('/a', gufi_config.common_directory(['/a/b', '/a/bc', '/a//b/c']))
+        self.assertEqual('/', gufi_config.common_directory(['/a', '/b']))
+
+    def test_load_server(self):
+        with tempfile.NamedTemporaryFile(mode='w') as config_file:
+            config_file.writelines(build_config(self.pairs))
+            config_file.flush()
+
+            config = gufi_config.load_server(config_file.name)
+            self.check_values(config)
+            self.assertIs(config, gufi_config.load_server(config_file.name))
+
+            # changing the file causes it to be parsed again
+            config_file.write('{0}=/statscache\n'.format(gufi_config.Server.STATSCACHE))
+            config_file.flush()
+
+            changed = gufi_config.load_server(config_file.name)
+            self.assertIsNot(config, changed)
+            self.assertEqual('/statscache', changed.statscache)
+
+        # lines are always parsed
+        lines = build_config(self.pairs)
+        self.assertIsNot(gufi_config.load_server(lines), gufi_config.load_server(lines))
+
 class TestClientConfig(unittest.TestCase):
     default = {
         gufi_config.Client.SERVER   : 'hostname',
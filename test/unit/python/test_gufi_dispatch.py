@@ -0,0 +1,228 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+import compileall
+import glob
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+SCRIPTS = os.path.join('@CMAKE_BINARY_DIR@', 'scripts')
+
+sys.path += [
+    SCRIPTS,
+]
+
+import gufi_dispatch
+
+# modules that running a tool without any optional flags should not import
+OPTIONAL = [
+    'gufi_bloom',
+    'gufi_catalog',
+    'gufi_explain',
+    'gufi_extensions',
+    'gufi_federation',
+    'gufi_index',
+    'gufi_inodes',
+    'gufi_maintenance',
+    'gufi_mirror',
+    'gufi_output',
+    'gufi_owners',
+    'gufi_prefetch',
+    'gufi_result_cache',
+    'gufi_sample',
+    'gufi_sidecar',
+    'gufi_stats_cache',
+    'gufi_trace',
+    'gufi_treesummaries',
+    'gufi_trigram',
+    'gufi_tuning',
+    'gufi_workload',
+    'sqlite3',
+]
+
+# seconds that starting a tool may add to starting the interpreter
+STARTUP_BUDGET = 0.25
+
+def fastest(cmd, runs=5):
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call(cmd, stdout=subprocess.PIPE)
+        elapsed = time.time() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+class TestDispatch(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmp, 'config')
+        with open(self.config, 'w') as config: # pylint: disable=unspecified-encoding
+            config.write('Threads=1\n'
+                         'Query=/bin/true\n'
+                         'Stat=/bin/true\n'
+                         'IndexRoot={0}\n'
+                         'OutputBuffer=4096\n'.format(self.tmp))
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def test_split(self):
+        self.assertEqual(('find', ['gufi_find', '-name', 'a']),
+                         gufi_dispatch.split(['gufi_dispatch.py', 'find', '-name', 'a']))
+        self.assertEqual(('ls', ['gufi_ls', '-l']),
+                         gufi_dispatch.split(['gufi_dispatch.py', 'gufi_ls', '-l']))
+
+        # run through a link named after a tool
+        self.assertEqual(('stats', ['gufi_stats', 'depth']),
+                         gufi_dispatch.split([os.path.join('bin', 'gufi_stats'), 'depth']))
+
+        with self.assertRaises(ValueError):
+            gufi_dispatch.split(['gufi_dispatch.py'])
+
+        with self.assertRaises(ValueError):
+            gufi_dispatch.split(['gufi_dispatch.py', 'rm'])
+
+    def test_load(self):
+        for tool in gufi_dispatch.TOOLS:
+            module = gufi_dispatch.load(tool, SCRIPTS)
+            self.assertTrue(callable(module.run))
+            self.assertIs(module, gufi_dispatch.load(tool, SCRIPTS))
+
+    def test_dispatch(self):
+        self.assertEqual(0, gufi_dispatch.dispatch(['gufi_dispatch.py', 'find'], self.config))
+
+        # gufi_query replaces the child process, so its return code is returned
+        self.assertEqual(0, subprocess.call([sys.executable, '-c',
+                                             'import sys; sys.path.append({0!r}); import gufi_dispatch; '
+                                             'gufi_dispatch.dispatch(["gufi_dispatch.py", "stat", "."], {1!r}, True); '
+                                             'sys.exit(1)'.format(SCRIPTS, self.config)]))
+
+    def test_imports(self):
+        # load every tool and run it without optional flags in a fresh interpreter
+        script = ('import sys\n'
+                  'sys.path.append({0!r})\n'
+                  'import gufi_dispatch\n'
+                  'for argv in [["find"], ["getfattr", "."], ["ls"], ["stat", "."], ["stats", "depth"]]:\n'
+                  '    gufi_dispatch.dispatch(["gufi_dispatch.py"] + argv, {1!r})\n'
+                  'print(" ".join(sorted(sys.modules)))\n').format(SCRIPTS, self.config)
+
+        modules = subprocess.check_output([sys.executable, '-c', script]).decode().split()
+
+        for module in OPTIONAL:
+            self.assertNotIn(module, modules)
+
+    def test_bytecode(self):
+        # load a tool in a fresh interpreter, the way the launchers do
+        shutil.copy(os.path.join(SCRIPTS, 'gufi_stats.py'), self.tmp)
+        script = ('import sys\n'
+                  'sys.path.append({0!r})\n'
+                  'import gufi_dispatch\n'
+                  'gufi_dispatch.load("stats", {1!r})\n').format(SCRIPTS, self.tmp)
+        env = dict(os.environ)
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+        subprocess.check_call([sys.executable, '-c', script], env=env)
+
+        # the bytecode is cached under the name of the module
+        cached = importlib.util.cache_from_source(os.path.join(self.tmp, 'gufi_stats.py'))
+        self.assertEqual([os.path.basename(cached)], os.listdir(os.path.dirname(cached)))
+        compiled = os.stat(cached).st_mtime_ns
+
+        # and is used instead of compiling the tool again
+        subprocess.check_call([sys.executable, '-c', script], env=env)
+        self.assertEqual(compiled, os.stat(cached).st_mtime_ns)
+
+    def test_startup(self):
+        # install the scripts into a bin directory that is compiled
+        # by make install and then cannot be written by users
+        bin_dir = os.path.join(self.tmp, 'bin')
+        os.mkdir(bin_dir)
+        for script in glob.glob(os.path.join(SCRIPTS, '*.py')):
+            shutil.copy(script, bin_dir)
+        compileall.compile_dir(bin_dir, maxlevels=0, quiet=1)
+        cached = sorted(os.listdir(os.path.join(bin_dir, '__pycache__')))
+
+        interpreter = fastest([sys.executable, '-c', 'pass'])
+        os.chmod(bin_dir, 0o555)
+        try:
+            tool = fastest([sys.executable, '-c',
+                            'import sys; sys.path.insert(0, {0!r}); import gufi_dispatch; '
+                            'gufi_dispatch.dispatch(["gufi_dispatch.py", "stats", "depth"], {1!r}, True)'.format(bin_dir, self.config)])
+        finally:
+            os.chmod(bin_dir, 0o755)
+
+        self.assertLess(tool - interpreter, STARTUP_BUDGET)
+
+        # the bytecode from the install was used
+        self.assertEqual(cached, sorted(os.listdir(os.path.join(bin_dir, '__pycache__'))))
+
+if __name__ == '__main__':
+    unittest.main()
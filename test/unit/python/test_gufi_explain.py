@@ -0,0 +1,163 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_explain
+import gufi_index
+
+QUERY_CMD = [
+    'gufi_query',
+    '-n', '1',
+    '-I', 'CREATE TABLE out(name TEXT, size INT64);',
+    '-E', 'INSERT INTO out SELECT rpath(name, 0), size FROM entries WHERE uid == 0 ORDER BY size;',
+    '-K', 'CREATE TABLE aggregate(name TEXT, size INT64);',
+    '-J', 'INSERT INTO aggregate SELECT * FROM out;',
+    '-G', 'SELECT name, median(size) FROM aggregate GROUP BY name;',
+]
+
+class TestExplain(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+
+        # the starting directory does not have a database
+        self.index = os.path.join(self.tmp, 'index')
+        self.dirname = os.path.join(self.index, 'dir')
+        os.makedirs(self.dirname)
+
+        db = sqlite3.connect(os.path.join(self.dirname, gufi_index.DBNAME))
+        db.execute('CREATE TABLE entries(name TEXT, uid INT64, size INT64);')
+        db.commit()
+        db.close()
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def test_statements(self):
+        sql = gufi_explain.statements(QUERY_CMD + [self.index])
+        self.assertEqual(['-E', '-G', '-I', '-J', '-K'], sorted(sql.keys()))
+        self.assertEqual(QUERY_CMD[4], sql['-I'])
+
+    def test_analyze(self):
+        counts, warnings = gufi_explain.analyze('-E', [(0, 'SCAN entries'),
+                                                       (0, 'USE TEMP B-TREE FOR ORDER BY')])
+        self.assertEqual(1, counts['scans'])
+        self.assertEqual(1, counts['temporary sorts'])
+        self.assertEqual(1, len(warnings))
+
+        # sorting the final results is expected
+        _, warnings = gufi_explain.analyze('-G', [(0, 'USE TEMP B-TREE FOR ORDER BY')])
+        self.assertEqual([], warnings)
+
+        counts, warnings = gufi_explain.analyze('-G', [(0, 'SEARCH t USING AUTOMATIC COVERING INDEX (a=?)'),
+                                                       (0, 'CORRELATED SCALAR SUBQUERY 1')])
+        self.assertEqual(1, counts['automatic indexes'])
+        self.assertEqual(1, counts['correlated subqueries'])
+        self.assertEqual(2, len(warnings))
+
+    def test_explain(self):
+        out = io.StringIO()
+        self.assertEqual(0, gufi_explain.explain(QUERY_CMD + [self.index], self.index, out))
+
+        report = out.getvalue()
+        self.assertIn(os.path.join(self.dirname, gufi_index.DBNAME), report)
+        for flag in ['-E', '-J', '-G']:
+            self.assertIn('\n{0} '.format(flag), report)
+        self.assertIn('SCAN entries', report)
+        self.assertIn('Warning: "USE TEMP B-TREE FOR ORDER BY"', report)
+
+    def test_externals(self):
+        cmd = ['gufi_query',
+               '-I', 'ATTACH \':memory:\' AS t; CREATE TABLE t.ext(name TEXT);',
+               '-Q', gufi_index.DBNAME, 'ext', 't.ext', 'ext_view',
+               '-E', 'SELECT name FROM entries WHERE name IN (SELECT name FROM ext_view);',
+               self.index]
+        self.assertEqual([(gufi_index.DBNAME, 'ext', 't.ext', 'ext_view')], gufi_explain.externals(cmd))
+
+        out = io.StringIO()
+        self.assertEqual(0, gufi_explain.explain(cmd, self.index, out))
+        self.assertIn('SCAN entries', out.getvalue())
+
+    def test_errors(self):
+        out = io.StringIO()
+        self.assertEqual(1, gufi_explain.explain(QUERY_CMD[:-2] + ['-G', 'SELECT * FROM missing;'],
+                                                 self.index, out))
+        self.assertIn('Could not explain', out.getvalue())
+
+        shutil.rmtree(self.dirname)
+        self.assertEqual(1, gufi_explain.explain(QUERY_CMD, self.index, out))
+
+if __name__ == '__main__':
+    unittest.main()
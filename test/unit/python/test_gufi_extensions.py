@@ -0,0 +1,198 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_extensions
+import gufi_index
+
+# minimal versions of the tables used to create the pentries view
+SCHEMA = '''
+CREATE TABLE entries(name TEXT, type TEXT, inode TEXT, uid INT64, gid INT64, size INT64);
+CREATE TABLE summary(name TEXT, inode TEXT, pinode TEXT, isroot INT64, mode INT64, uid INT64, gid INT64);
+CREATE TABLE pentries_rollup(name TEXT, type TEXT, inode TEXT, uid INT64, gid INT64, size INT64, pinode TEXT, ppinode TEXT);
+CREATE VIEW pentries AS SELECT entries.*, summary.inode AS pinode, summary.pinode AS ppinode FROM entries, summary WHERE isroot == 1 UNION SELECT * FROM pentries_rollup;
+CREATE TABLE external_dbs_pwd(type TEXT, pinode TEXT, filename TEXT, mode INT64, uid INT64, gid INT64, PRIMARY KEY(type, pinode, filename));
+'''
+
+class TestExtensions(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp, 'sub'))
+
+        for path in [self.tmp, os.path.join(self.tmp, 'sub')]:
+            db = sqlite3.connect(os.path.join(path, gufi_index.DBNAME))
+            db.executescript(SCHEMA)
+            db.execute('INSERT INTO summary VALUES (\'dir\', \'1\', \'0\', 1, 16877, 0, 0);')
+            db.executemany('INSERT INTO entries VALUES (?, \'f\', ?, ?, 0, ?);',
+                           [('a.txt',     '2', 0, 1),
+                            ('b.txt',     '3', 0, 2),
+                            ('c.tar.gz',  '4', 1, 4),
+                            ('.hidden',   '5', 1, 8),
+                            ('README',    '6', 1, 16)])
+            db.execute('INSERT INTO pentries_rollup VALUES (\'d.txt\', \'f\', \'7\', 1, 0, 32, \'8\', \'1\');')
+            db.commit()
+            db.close()
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def test_extension(self):
+        # compare with the SQL expression that the histograms replace
+        db = sqlite3.connect(':memory:')
+        for name in ['a.txt', 'c.tar.gz', '.hidden', 'README', 'trailing.', 'x.y.x']:
+            expected = db.execute('SELECT REPLACE(?1, RTRIM(?1, REPLACE(?1, \'.\', \'\')), \'\');', (name,)).fetchall()
+            self.assertEqual(gufi_extensions.extension(name), expected[0][0])
+        db.close()
+
+        self.assertIsNone(gufi_extensions.extension(None))
+
+    def test_suffixes(self):
+        self.assertEqual(gufi_extensions.suffixes(['*.txt', '*.gz']), ['txt', 'gz'])
+        self.assertIsNone(gufi_extensions.suffixes(['*.txt', 'a*']))
+        self.assertIsNone(gufi_extensions.suffixes(['*.t?t']))
+        self.assertIsNone(gufi_extensions.suffixes(['*.tar.gz']))
+        self.assertIsNone(gufi_extensions.suffixes(['a.txt']))
+
+    def histogram(self, path, sql): # pylint: disable=no-self-use
+        db = sqlite3.connect(os.path.join(path, gufi_extensions.DBNAME))
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def test_run(self):
+        self.assertFalse(gufi_extensions.available(self.tmp))
+
+        self.assertEqual(gufi_extensions.run(['gufi_extensions', '-n', '2', self.tmp]), 0)
+
+        for path in [self.tmp, os.path.join(self.tmp, 'sub')]:
+            self.assertTrue(gufi_extensions.available(path))
+            self.assertEqual(self.histogram(path, 'SELECT pinode, ext, uid, count, size FROM extensions ORDER BY pinode, ext, uid;'),
+                             [('1', 'README', 1, 1, 16),
+                              ('1', 'gz',     1, 1, 4),
+                              ('1', 'hidden', 1, 1, 8),
+                              ('1', 'txt',    0, 2, 3),
+                              ('8', 'txt',    1, 1, 32)])
+            self.assertEqual(gufi_index.query(path, 'SELECT type, pinode, filename, mode FROM external_dbs_pwd;'),
+                             [('user_db', '1', os.path.realpath(os.path.join(path, gufi_extensions.DBNAME)), 16877)])
+
+        # rerunning replaces the histograms
+        self.assertEqual(gufi_extensions.run(['gufi_extensions', self.tmp]), 0)
+        self.assertEqual(self.histogram(self.tmp, 'SELECT SUM(count) FROM extensions;'), [(6,)])
+        self.assertEqual(gufi_index.query(self.tmp, 'SELECT COUNT(*) FROM external_dbs_pwd;'), [(1,)])
+
+        self.assertEqual(gufi_extensions.run(['gufi_extensions', '--remove', self.tmp]), 0)
+        self.assertFalse(gufi_extensions.available(self.tmp))
+        self.assertEqual(gufi_index.query(self.tmp, 'SELECT COUNT(*) FROM external_dbs_pwd;'), [(0,)])
+
+    def test_permissions(self):
+        os.chmod(os.path.join(self.tmp, gufi_index.DBNAME), 0o640)
+        gufi_extensions.process(self.tmp)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.tmp, gufi_extensions.DBNAME)).st_mode), 0o640)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, gufi_extensions.DBNAME + '.tmp')))
+
+    def test_uri_path(self):
+        # gufi_query attaches external databases with URIs
+        self.assertEqual(gufi_index.uri_path('/index/a#b?c%d, e'), '/index/a%23b%3fc%25d, e')
+
+    def test_attach(self):
+        init, external = gufi_extensions.attach()
+        self.assertEqual(['-Q', gufi_extensions.DBNAME, 'extensions', 'extensions_template.extensions', 'extensions_view'],
+                         external)
+
+        # a directory without a histogram matches everything
+        db = sqlite3.connect(':memory:')
+        db.executescript(init)
+        db.executescript('''
+        CREATE TEMP TABLE esummary(inode TEXT);
+        INSERT INTO esummary VALUES ('1');
+        CREATE TEMP VIEW extensions_view AS SELECT * FROM extensions_template.extensions;
+        ''')
+        have = 'SELECT {0};'.format(gufi_extensions.have(['\'txt\'']))
+        self.assertEqual(db.execute(have).fetchall(), [(1,)])
+
+        db.execute('INSERT INTO extensions_template.extensions VALUES (\'2\', \'txt\', 0, 0, 1, 1);')
+        self.assertEqual(db.execute(have).fetchall(), [(1,)])
+
+        db.execute('INSERT INTO extensions_template.extensions VALUES (\'1\', \'gz\', 0, 0, 1, 1);')
+        self.assertEqual(db.execute(have).fetchall(), [(0,)])
+
+        db.execute('INSERT INTO extensions_template.extensions VALUES (\'1\', \'txt\', 0, 0, 1, 1);')
+        self.assertEqual(db.execute(have).fetchall(), [(1,)])
+        db.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+import io
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_common
+import gufi_federation
+
+# stands in for gufi_query: prints the files it is given
+QUERY = '''#!/bin/sh
+# -n count
+shift 2
+cat "$@"
+'''
+
+class TestFederation(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.query = os.path.join(self.tmp, 'query')
+        with open(self.query, 'w') as query: # pylint: disable=unspecified-encoding
+            query.write(QUERY)
+        os.chmod(self.query, stat.S_IRWXU)
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def output(self, name, rows):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as out:
+            for row in rows:
+                out.write(gufi_common.RECORD_SEPARATOR.encode().join(row) + b'\n')
+        return path
+
+    def test_split_threads(self):
+        self.assertEqual([3, 3, 2], gufi_federation.split_threads(8, 3))
+        self.assertEqual([4], gufi_federation.split_threads(4, 1))
+        self.assertEqual([1, 1, 1], gufi_federation.split_threads(2, 3))
+
+    def test_set_threads(self):
+        self.assertEqual(['q', '-n', '2', '-a'], gufi_federation.set_threads(['q', '-n', '8', '-a'], 2))
+        self.assertEqual(['q', '-n', '2', '-a'], gufi_federation.set_threads(['q', '-a'], 2))
+
+    def test_split_key(self):
+        split = gufi_federation.split_key(2, [0])
+        self.assertEqual(((-10, b'a b'), b'x y a b\n'),
+                         split(b'x y\x1ea b\x1e10\x1ea b\n'))
+
+        split = gufi_federation.split_key(2, integers=[0])
+        self.assertEqual(((10, b'a b'), b'x y a b\n'),
+                         split(b'x y\x1ea b\x1e10\x1ea b\n'))
+
+    def test_concatenate(self):
+        first = self.output('first', [[b'a'], [b'b']])
+        second = self.output('second', [[b'c']])
+
+        out = io.BytesIO()
+        self.assertEqual(0, gufi_federation.query([self.query], [[first], [second]], 4, out))
+        self.assertEqual([b'a', b'b', b'c'], sorted(out.getvalue().split()))
+
+    def test_merge(self):
+        # sorted by size descending, then name
+        first = self.output('first', [[b'/a/big', b'30', b'/a/big'],
+                                      [b'/a/mid', b'20', b'/a/mid']])
+        second = self.output('second', [[b'/b/big', b'30', b'/b/big'],
+                                        [b'/b/small', b'10', b'/b/small']])
+        key = gufi_federation.split_key(2, [0])
+
+        out = io.BytesIO()
+        self.assertEqual(0, gufi_federation.query([self.query], [[first], [second]], 4, out, key))
+        self.assertEqual(b'/a/big\n/b/big\n/a/mid\n/b/small\n', out.getvalue())
+
+        # the limit applies to the merged output
+        out = io.BytesIO()
+        self.assertEqual(0, gufi_federation.query([self.query], [[first], [second]], 4, out, key, 3))
+        self.assertEqual(b'/a/big\n/b/big\n/a/mid\n', out.getvalue())
+
+    def test_merge_ascending(self):
+        # sorted by size ascending, with sizes of different widths
+        first = self.output('first', [[b'/a/9', b'9', b'/a/9'],
+                                      [b'/a/100', b'100', b'/a/100']])
+        second = self.output('second', [[b'/b/20', b'20', b'/b/20'],
+                                        [b'/b/1000', b'1000', b'/b/1000']])
+        key = gufi_federation.split_key(2, integers=[0])
+
+        out = io.BytesIO()
+        self.assertEqual(0, gufi_federation.query([self.query], [[first], [second]], 4, out, key))
+        self.assertEqual(b'/a/9\n/b/20\n/a/100\n/b/1000\n', out.getvalue())
+
+    def test_returncode(self):
+        first = self.output('first', [[b'a']])
+        missing = os.path.join(self.tmp, 'missing')
+
+        out = io.BytesIO()
+        self.assertNotEqual(0, gufi_federation.query([self.query], [[first], [missing]], 2, out))
+        self.assertEqual(b'a\n', out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
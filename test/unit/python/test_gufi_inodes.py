@@ -0,0 +1,146 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import os
+import sys
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_inodes
+import index_fixtures
+
+def tables(dirname, inode, entries, rollupscore=0):
+    '''an index directory with the given inode containing (name, inode) entries'''
+    return [('summary', ['name TEXT', 'inode TEXT', 'isroot INT64', 'rollupscore INT64'], [(dirname, inode, 1, rollupscore)]),
+            ('entries', ['name TEXT', 'inode TEXT'],                                      entries)]
+
+make_dir, write_dir = index_fixtures.dir_factory(tables)
+
+class TestInodeIndex(index_fixtures.IndexTestCase):
+    CANDIDATES = staticmethod(gufi_inodes.candidates)
+
+    def setUp(self): # pylint: disable=invalid-name
+        # pylint: disable=super-with-arguments
+        super(TestInodeIndex, self).setUp()
+        self.filename = os.path.join(self.tmp, 'inodes.db')
+
+        make_dir(self.indexroot,                              '1',  [('file', '10')])
+        make_dir(os.path.join(self.indexroot, 'a'),           '2',  [('link1', '20'), ('link2', '20')])
+        make_dir(os.path.join(self.indexroot, 'a', 'aa'),     '3',  [('link3', '20')])
+        make_dir(os.path.join(self.indexroot, 'r'),           '4',  [], rollupscore=1)
+        make_dir(os.path.join(self.indexroot, 'r', 'rolled'), '5',  [('link4', '20')])
+
+        self.index = gufi_inodes.InodeIndex(self.filename, self.indexroot)
+        self.addCleanup(self.index.close)
+        self.assertEqual((5, 0, 0), self.index.update(self.indexroot, threads=2))
+
+    def test_candidates(self):
+        self.assertEqual([self.indexroot], self.find(inodes=[10]))
+
+        # rolled up directories replace the directories under them
+        self.assertEqual([self.path('a'), self.path('a', 'aa'), self.path('r')], self.find(inodes=[20]))
+
+        # directories are found in their own databases
+        self.assertEqual([self.path('a', 'aa')], self.find(inodes=[3]))
+        self.assertEqual([self.path('r')], self.find(inodes=[5]))
+
+        # every inode has to match
+        self.assertEqual([], self.find(inodes=[10, 20]))
+        self.assertEqual([], self.find(inodes=[30]))
+        self.assertIsNone(self.find())
+
+        self.assertEqual([self.path('a', 'aa')], self.find([self.path('a')], inodes=[20], mindepth=1))
+
+    def test_links(self):
+        self.assertEqual([self.path('a', 'link1'),
+                          self.path('a', 'link2'),
+                          self.path('a', 'aa', 'link3'),
+                          self.path('r', 'rolled', 'link4')],
+                         self.index.links(20))
+        self.assertEqual([self.path('a', 'aa', 'link3')], self.index.links(20, self.path('a', 'aa')))
+        self.assertEqual([self.path('a')], self.index.links(2))
+        self.assertEqual([], self.index.links(30))
+
+    def test_update(self):
+        self.assertEqual((0, 5, 0), self.index.update(self.indexroot))
+
+        write_dir(self.path('a'), '2', [('link1', '20'), ('other', '21')])
+        self.assertEqual((1, 4, 0), self.index.update(self.indexroot))
+        self.assertEqual([self.path('a', 'link1'),
+                          self.path('a', 'aa', 'link3'),
+                          self.path('r', 'rolled', 'link4')],
+                         self.index.links(20))
+        self.assertEqual([self.path('a')], self.find(inodes=[21]))
+
+        # moved directories keep their inodes
+        os.rename(self.path('r'), self.path('q'))
+        self.assertEqual((0, 5, 0), self.index.update(self.indexroot))
+        self.assertEqual([self.path('q', 'rolled', 'link4')], self.index.links(20, self.path('q')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_maintenance
+import gufi_prefetch
+
+def make_dir(path, files, deleted=0):
+    '''
+    create an index directory with files entries, after which deleted
+    of them are removed, leaving free pages behind
+    '''
+
+    os.makedirs(path)
+    db = sqlite3.connect(os.path.join(path, gufi_index.DBNAME))
+    db.execute('CREATE TABLE summary(name TEXT, isroot INT64, totfiles INT64, totlinks INT64);')
+    db.execute('CREATE TABLE entries(name TEXT, size INT64);')
+    db.execute('CREATE INDEX entries_name ON entries(name);')
+    db.executemany('INSERT INTO entries VALUES (?, ?);',
+                   [('{0:0200}'.format(i), i) for i in range(files)])
+    db.execute('DELETE FROM entries WHERE rowid <= ?;', (deleted,))
+    db.execute('INSERT INTO summary VALUES (?, 1, ?, 0);', (os.path.basename(path), files - deleted))
+    db.commit()
+    db.close()
+
+    # an old timestamp that has to survive maintenance
+    os.utime(os.path.join(path, gufi_index.DBNAME), (1000, 2000))
+
+def pragma(path, name):
+    db = gufi_index.open_db(path)
+    try:
+        return gufi_maintenance.pragma(db, name)
+    finally:
+        db.close()
+
+class TestMaintenance(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.indexroot = os.path.join(self.tmp, 'index')
+
+        # index      (small, compact)
+        # index/big  (many entries)
+        # index/gaps (mostly deleted)
+        make_dir(self.indexroot, 10)
+        make_dir(self.path('big'), 2000)
+        make_dir(self.path('gaps'), 2000, 1900)
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def path(self, *names):
+        return os.path.join(self.indexroot, *names)
+
+    def assertTimes(self, name): # pylint: disable=invalid-name
+        '''the times gufi_query -m relies on were kept'''
+        st = os.stat(os.path.join(self.path(name), gufi_index.DBNAME))
+        self.assertEqual(1000, st.st_atime)
+        self.assertEqual(2000, st.st_mtime)
+
+    def test_check(self):
+        results = dict((result.path, result) for result in
+                       [gufi_maintenance.maintain(self.path(name), analyze_rows=1000, dry_run=True)
+                        for name in ['', 'big', 'gaps']])
+
+        self.assertEqual([False, False, False], list(results[self.path('')][1:4]))
+        self.assertEqual([True, False, False], list(results[self.path('big')][1:4]))
+        self.assertEqual([False, True, False], list(results[self.path('gaps')][1:4]))
+
+        # nothing changed
+        self.assertGreater(pragma(self.path('gaps'), 'freelist_count'), 0)
+        self.assertEqual(2000, os.stat(os.path.join(self.path('gaps'), gufi_index.DBNAME)).st_mtime)
+
+    def test_run(self):
+        dbname = os.path.join(self.path('gaps'), gufi_index.DBNAME)
+        before = os.stat(dbname).st_size
+
+        result = gufi_maintenance.maintain(self.path('gaps'), analyze_rows=1000)
+        self.assertTimes('gaps')
+        self.assertIsNone(result.error)
+        self.assertTrue(result.vacuum)
+        self.assertFalse(result.analyze)
+        self.assertEqual(before, result.before)
+        self.assertLess(result.after, result.before)
+        self.assertIsNotNone(result.slower)
+        self.assertIsNotNone(result.faster)
+        self.assertEqual(0, pragma(self.path('gaps'), 'freelist_count'))
+
+        result = gufi_maintenance.maintain(self.path('big'), analyze_rows=1000)
+        self.assertTimes('big')
+        self.assertTrue(result.analyze)
+        db = gufi_index.open_db(self.path('big'))
+        try:
+            self.assertTrue(gufi_maintenance.analyzed(db))
+        finally:
+            db.close()
+
+        # done already
+        result = gufi_maintenance.maintain(self.path('big'), analyze_rows=1000)
+        self.assertFalse(result.analyze or result.vacuum)
+
+    def test_measure(self):
+        evicted = []
+        evict = gufi_prefetch.evict
+        gufi_prefetch.evict = lambda dbname: evicted.append(dbname) or evict(dbname)
+        try:
+            self.assertGreaterEqual(gufi_maintenance.measure(self.path('big')), 0)
+        finally:
+            gufi_prefetch.evict = evict
+
+        # every timed run starts with a cold cache
+        if hasattr(os, 'posix_fadvise'):
+            self.assertEqual([os.path.join(self.path('big'), gufi_index.DBNAME)] * (gufi_maintenance.MEASURE_RUNS + 1),
+                             evicted)
+
+        # only analyzing is not timed
+        result = gufi_maintenance.maintain(self.path('big'), analyze_rows=1000)
+        self.assertTrue(result.analyze)
+        self.assertIsNone(result.slower)
+
+    def test_page_size(self):
+        self.assertNotEqual(8192, pragma(self.path(''), 'page_size'))
+        result = gufi_maintenance.maintain(self.path(''), page_size=8192, timed=False)
+        self.assertTrue(result.resize)
+        self.assertTrue(result.vacuum)
+        self.assertIsNone(result.slower)
+        self.assertEqual(8192, pragma(self.path(''), 'page_size'))
+
+    def test_missing(self):
+        os.remove(os.path.join(self.path('big'), gufi_index.DBNAME))
+        result = gufi_maintenance.maintain(self.path('big'))
+        self.assertIsNotNone(result.error)
+
+    def test_report(self):
+        results = gufi_index.map_threads(
+            lambda path: gufi_maintenance.maintain(path, analyze_rows=1000),
+            [self.path(name) for name in ['', 'big', 'gaps']], 2)
+
+        out = io.StringIO() if sys.version_info.major >= 3 else io.BytesIO()
+        gufi_maintenance.report(results, out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual('Directories: 3 checked, 1 analyzed, 1 vacuumed, 0 page size changed, 0 failed', lines[0])
+        self.assertTrue(lines[1].startswith('Bytes reclaimed: '))
+        self.assertGreater(int(lines[1].split()[2]), 0)
+        self.assertTrue(lines[2].startswith('Scan time: '))
+
+    def test_get_page_size(self):
+        self.assertEqual(4096, gufi_maintenance.get_page_size('4096'))
+        self.assertRaises(Exception, gufi_maintenance.get_page_size, '4000')
+        self.assertRaises(Exception, gufi_maintenance.get_page_size, '256')
+
+if __name__ == '__main__':
+    unittest.main()
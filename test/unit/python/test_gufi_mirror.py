@@ -0,0 +1,165 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import os
+import shutil
+import sys
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_mirror
+import gufi_stats_cache
+import index_fixtures
+
+def summary_row(**values):
+    '''a row of the summary table, with NULL in the columns that are not provided'''
+    return tuple(values.get(col) for col in gufi_mirror.COLUMNS)
+
+def tables(dirname, uid, totsize, rollupscore=0):
+    '''an index directory with only a summary row'''
+    return [('summary', gufi_mirror.COLUMNS,
+             [summary_row(name=dirname, uid=uid, totsize=totsize, isroot=1, rollupscore=rollupscore),
+              summary_row(name='child', uid=0, totsize=1000, isroot=0, rollupscore=0)])]
+
+make_dir, write_dir = index_fixtures.dir_factory(tables)
+
+# merge queries in the form used by gufi_stats
+TOTAL = 'SELECT SUM(value) FROM {0};'.format(gufi_stats_cache.SELECTED)
+PER_LEVEL = 'SELECT level, key, SUM(value) FROM {0} GROUP BY level, key ORDER BY level, key;'.format(gufi_stats_cache.SELECTED)
+GROUPED = 'SELECT grp, SUM(value) FROM {0} GROUP BY grp ORDER BY grp;'.format(gufi_stats_cache.SELECTED)
+
+class TestSummaryMirror(index_fixtures.IndexTestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        # pylint: disable=super-with-arguments
+        super(TestSummaryMirror, self).setUp()
+        self.filename = os.path.join(self.tmp, 'summary.db')
+
+        make_dir(self.indexroot,                              0,    1)
+        make_dir(os.path.join(self.indexroot, 'a'),           1000, 10)
+        make_dir(os.path.join(self.indexroot, 'a', 'aa'),     1001, 100)
+        make_dir(os.path.join(self.indexroot, 'b'),           1000, 1000)
+        make_dir(os.path.join(self.indexroot, 'r'),           1001, 10000, rollupscore=1)
+        make_dir(os.path.join(self.indexroot, 'r', 'rolled'), 1001, 100000)
+
+        self.mirror = gufi_mirror.SummaryMirror(self.filename, self.indexroot)
+        self.addCleanup(self.mirror.close)
+        self.assertEqual((6, 0, 0), self.mirror.update(self.indexroot, threads=2))
+
+    def test_merge(self):
+        # every directory is counted once, including rolled up ones
+        self.assertEqual([(111111,)], self.mirror.merge(self.indexroot, 'NULL', 'totsize', TOTAL))
+        self.assertEqual([(110,)], self.mirror.merge(self.path('a'), 'NULL', 'totsize', TOTAL))
+        self.assertEqual([(1010,)], self.mirror.merge(self.indexroot, 'NULL', 'totsize', TOTAL,
+                                                      where=['uid == 1000']))
+
+        # levels are relative to the path
+        self.assertEqual([(0, 0, 1), (1, 1000, 2), (1, 1001, 1), (2, 1001, 2)],
+                         self.mirror.merge(self.indexroot, 'uid', '1', PER_LEVEL))
+        self.assertEqual([(0, 1000, 1), (1, 1001, 1)],
+                         self.mirror.merge(self.path('a'), 'uid', '1', PER_LEVEL))
+
+        self.assertEqual([(10001,)], self.mirror.merge(self.indexroot, 'NULL', 'totsize', TOTAL, skip=['a', 'rolled', 'b']))
+
+        self.assertEqual([('.', 1), ('a', 110), ('b', 1000), ('r', 110000)],
+                         self.mirror.merge(self.indexroot, 'NULL', 'totsize', GROUPED, group_depth=1))
+
+        self.assertEqual([(2020,)],
+                         self.mirror.merge(self.indexroot, 'NULL', 'double(totsize)', TOTAL,
+                                           where=['uid == 1000'],
+                                           functions={'double': (1, lambda value: value * 2)}))
+
+    def test_update(self):
+        self.assertEqual((0, 6, 0), self.mirror.update(self.indexroot))
+
+        write_dir(self.path('b'), 1000, 2000)
+        self.assertEqual((1, 5, 0), self.mirror.update(self.indexroot))
+        self.assertEqual([(112111,)], self.mirror.merge(self.indexroot, 'NULL', 'totsize', TOTAL))
+
+        shutil.rmtree(self.path('a'))
+        self.assertEqual((0, 4, 2), self.mirror.update(self.indexroot))
+        self.assertEqual([(112001,)], self.mirror.merge(self.indexroot, 'NULL', 'totsize', TOTAL))
+
+        # the mirror cannot be used when a directory could not be read
+        with open(os.path.join(self.path('b'), gufi_index.DBNAME), 'w') as db: # pylint: disable=unspecified-encoding
+            db.write('not a database')
+        self.assertEqual((1, 3, 0), self.mirror.update(self.indexroot))
+        self.assertIsNone(self.mirror.merge(self.indexroot, 'NULL', 'totsize', TOTAL))
+        self.assertEqual([(110000,)], self.mirror.merge(self.path('r'), 'NULL', 'totsize', TOTAL))
+
+        self.assertIsNone(self.mirror.merge(self.path('missing'), 'NULL', 'totsize', TOTAL))
+
+    def test_readonly(self):
+        readonly = gufi_mirror.SummaryMirror(self.filename, self.indexroot, readonly=True)
+        try:
+            self.assertEqual([(111111,)], readonly.merge(self.indexroot, 'NULL', 'totsize', TOTAL))
+        finally:
+            readonly.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+import ast
+import io
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_common
+import gufi_index
+import gufi_output
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+COLUMNS = [('i', 'INT'), ('r', 'REAL'), ('s', 'TEXT')]
+
+ROWS = [
+    (1,    2.5,  'a'),
+    (None, None, 'bc'),
+    (3,    1.0,  None),
+]
+
+def read_npy(data):
+    '''parse a .npy file containing a structured array without NumPy'''
+    header_len = struct.unpack('<H', data[8:10])[0]
+    header = ast.literal_eval(data[10:10 + header_len].decode('latin-1'))
+
+    formats = []
+    for _, field in header['descr']:
+        if field == '<i8':
+            formats += ['q']
+        elif field == '<f8':
+            formats += ['d']
+        else:
+            formats += ['{0}s'.format(4 * int(field[2:]))]
+    row = struct.Struct('<' + ''.join(formats))
+
+    rows = []
+    offset = 10 + header_len
+    for _ in range(header['shape'][0]):
+        rows += [tuple(value.decode('utf-32-le').rstrip('\0') if isinstance(value, bytes) else value
+                       for value in row.unpack_from(data, offset))]
+        offset += row.size
+
+    return header, rows, (10 + header_len) % gufi_output.NPY_ALIGNMENT
+
+class TestOutput(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def test_schema(self):
+        # aggregated results only need the -K table
+        query_cmd = ['gufi_query',
+                     '-K', 'CREATE TABLE agg(name TEXT, size INT64);',
+                     '-G', 'SELECT name, size, COUNT(*) AS count, rpath(name, 0) FROM agg;',
+                     self.tmp]
+        self.assertEqual([('name', 'TEXT'), ('size', 'INT'), ('count', ''), ('rpath(name, 0)', '')],
+                         gufi_output.schema(query_cmd, self.tmp))
+
+        # results printed per directory need a database of the index
+        query_cmd = ['gufi_query', '-E', 'SELECT name, size FROM entries;', self.tmp]
+        with self.assertRaises(ValueError):
+            gufi_output.schema(query_cmd, self.tmp)
+
+        db = sqlite3.connect(os.path.join(self.tmp, gufi_index.DBNAME))
+        db.execute('CREATE TABLE entries(name TEXT, size INT64);')
+        db.commit()
+        db.close()
+
+        self.assertEqual([('name', 'TEXT'), ('size', 'INT')],
+                         gufi_output.schema(query_cmd, self.tmp))
+
+        # nothing is printed
+        with self.assertRaises(ValueError):
+            gufi_output.schema(['gufi_query', '-E', 'INSERT INTO t SELECT 1;', self.tmp], self.tmp)
+
+        with self.assertRaises(ValueError):
+            gufi_output.schema(['gufi_query', '-E', 'SELECT missing FROM entries;', self.tmp], self.tmp)
+
+    def test_converters(self):
+        self.assertEqual([gufi_common.to_integer, gufi_common.to_text, gufi_common.to_numeric],
+                         gufi_output.converters([('a', 'INT'), ('b', 'TEXT'), ('c', '')]))
+
+    def test_unique(self):
+        self.assertEqual([('a', ''), ('a_1', ''), ('a_2', ''), ('a_1_1', '')],
+                         gufi_output.unique([('a', ''), ('a', ''), ('a', ''), ('a_1', '')]))
+
+    def test_write_sqlite(self):
+        out = io.BytesIO()
+        gufi_output.write_rows('sqlite', ROWS + [(4, 0.0, 'd\udcff')], out, COLUMNS)
+
+        filename = os.path.join(self.tmp, 'out.db')
+        with open(filename, 'wb') as db_file:
+            db_file.write(out.getvalue())
+
+        db = sqlite3.connect(filename)
+        try:
+            rows = db.execute('SELECT * FROM {0} ORDER BY rowid;'.format(gufi_output.TABLE)).fetchall()
+        finally:
+            db.close()
+
+        # text that is not valid UTF-8 is stored as a blob
+        self.assertEqual(ROWS + [(4, 0.0, b'd\xff')], rows)
+
+    def test_write_sqlite_file(self):
+        # written directly into an empty file
+        filename = os.path.join(self.tmp, 'out.db')
+        with open(filename, 'wb') as out:
+            self.assertEqual(filename, gufi_output.empty_file(out))
+            gufi_output.write_rows('sqlite', ROWS, out, COLUMNS)
+
+        db = sqlite3.connect(filename)
+        try:
+            rows = db.execute('SELECT * FROM {0} ORDER BY rowid;'.format(gufi_output.TABLE)).fetchall()
+        finally:
+            db.close()
+        self.assertEqual(ROWS, rows)
+
+        self.assertIsNone(gufi_output.empty_file(io.BytesIO()))
+        with open(filename, 'ab') as out:
+            self.assertIsNone(gufi_output.empty_file(out))
+
+    def test_write_npy(self):
+        out = io.BytesIO()
+        gufi_output.write_rows('npy', ROWS, out, COLUMNS)
+
+        header, rows, alignment = read_npy(out.getvalue())
+        self.assertEqual(0, alignment)
+        self.assertEqual((3,), header['shape'])
+
+        # integers with NULLs are stored as reals
+        self.assertEqual([('i', '<f8'), ('r', '<f8'), ('s', '<U2')], header['descr'])
+        self.assertEqual(1.0, rows[0][0])
+        self.assertNotEqual(rows[1][0], rows[1][0]) # NaN
+        self.assertEqual(['a', 'bc', ''], [row[2] for row in rows])
+
+        out = io.BytesIO()
+        gufi_output.write_rows('npy', [(1, 'x'), (2, 3)], out, [('i', 'INT'), ('mixed', '')])
+        header, rows, _ = read_npy(out.getvalue())
+        self.assertEqual([('i', '<i8'), ('mixed', '<U1')], header['descr'])
+        self.assertEqual([(1, 'x'), (2, '3')], rows)
+
+    def test_npy_max_width(self):
+        # long text would make every row that much larger
+        with self.assertRaises(ValueError):
+            gufi_output.write_npy([('s', 'TEXT')], [('abc',), ('abcd',)], io.BytesIO(), 3)
+
+        out = io.BytesIO()
+        gufi_output.write_npy([('s', 'TEXT')], [('abc',), (None,)], out, 3)
+        header, rows, _ = read_npy(out.getvalue())
+        self.assertEqual([('s', '<U3')], header['descr'])
+        self.assertEqual([('abc',), ('',)], rows)
+
+        # several batches
+        out = io.BytesIO()
+        count = gufi_output.BATCH_SIZE + 1
+        gufi_output.write_npy([('i', 'INT')], [(i,) for i in range(count)], out)
+        header, rows, _ = read_npy(out.getvalue())
+        self.assertEqual((count,), header['shape'])
+        self.assertEqual(count - 1, rows[-1][0])
+
+    def test_npy_header(self):
+        header = gufi_output.npy_header([('a', '<i8')], 10)
+        self.assertEqual(0, len(header) % gufi_output.NPY_ALIGNMENT)
+        self.assertEqual(b'\x01\x00', header[6:8])
+
+        # names that are not latin-1 need version 3.0
+        header = gufi_output.npy_header([(u'é中', '<i8')], 10)
+        self.assertEqual(0, len(header) % gufi_output.NPY_ALIGNMENT)
+        self.assertEqual(b'\x03\x00', header[6:8])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_write_arrow(self):
+        out = io.BytesIO()
+        gufi_output.write_rows('arrow', ROWS, out, COLUMNS + [('n', '')])
+
+        table = pyarrow.ipc.open_file(pyarrow.BufferReader(out.getvalue())).read_all()
+        self.assertEqual(['int64', 'double', 'string'], [str(field.type) for field in table.schema][:3])
+        self.assertEqual([1, None, 3], table.column('i').to_pylist())
+        self.assertEqual(['a', 'bc', None], table.column('s').to_pylist())
+
+    def test_write(self):
+        # columns are named after their positions
+        out = io.BytesIO()
+        self.assertEqual(0, gufi_output.write('npy', [(1, 2)], out))
+        header, rows, _ = read_npy(out.getvalue())
+        self.assertEqual([('column1', '<i8'), ('column2', '<i8')], header['descr'])
+        self.assertEqual([(1, 2)], rows)
+
+    def test_query(self):
+        # prints with the record separator because the -d argument is replaced
+        script = 'import sys; sys.stdout.write("1\\x1ea b\\n2\\x1e\\n")'
+        query_cmd = [sys.executable, '-c', script,
+                     '-d', ',',
+                     '-K', 'CREATE TABLE agg(i INT64, s TEXT);',
+                     '-G', 'SELECT i, s FROM agg;']
+
+        out = io.BytesIO()
+        self.assertEqual(0, gufi_output.query('npy', query_cmd, [self.tmp], out))
+        header, rows, _ = read_npy(out.getvalue())
+        self.assertEqual([('i', '<i8'), ('s', '<U3')], header['descr'])
+        self.assertEqual([(1, 'a b'), (2, '')], rows)
+
+        query_cmd[2] = 'import sys; sys.exit(3)'
+        self.assertEqual(3, gufi_output.query('sqlite', query_cmd, [self.tmp], io.BytesIO()))
+
+        # the columns cannot be found
+        self.assertEqual(1, gufi_output.query('sqlite', query_cmd[:-2], [self.tmp], io.BytesIO()))
+
+if __name__ == '__main__':
+    unittest.main()
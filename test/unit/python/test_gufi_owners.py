@@ -0,0 +1,168 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import os
+import shutil
+import sys
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_owners
+import index_fixtures
+
+def tables(dirname, owner, entries, rollupscore=0):
+    '''an index directory owned by (uid, gid) containing (uid, gid, size) entries'''
+    return [('summary', ['name TEXT', 'isroot INT64', 'rollupscore INT64', 'uid INT64', 'gid INT64'],
+             [(dirname, 1, rollupscore) + owner]),
+            ('entries', ['name TEXT', 'uid INT64', 'gid INT64', 'size INT64'],
+             [('entry{0}'.format(i),) + entry for i, entry in enumerate(entries)])]
+
+make_dir, write_dir = index_fixtures.dir_factory(tables)
+
+class TestOwnerIndex(index_fixtures.IndexTestCase):
+    CANDIDATES = staticmethod(gufi_owners.candidates)
+
+    def setUp(self): # pylint: disable=invalid-name
+        # pylint: disable=super-with-arguments
+        super(TestOwnerIndex, self).setUp()
+        self.filename = os.path.join(self.tmp, 'owners.db')
+
+        make_dir(self.indexroot,                              (0, 0),       [])
+        make_dir(os.path.join(self.indexroot, 'a'),           (1000, 100),  [(1000, 100, 10), (1000, 200, 20)])
+        make_dir(os.path.join(self.indexroot, 'a', 'aa'),     (1000, 100),  [(1001, 100, 5)])
+        make_dir(os.path.join(self.indexroot, 'b'),           (1001, 200),  [(1000, 200, 1)])
+        make_dir(os.path.join(self.indexroot, 'r'),           (0, 0),       [], rollupscore=1)
+        make_dir(os.path.join(self.indexroot, 'r', 'rolled'), (0, 0),       [(1001, 300, 7)])
+
+        self.index = gufi_owners.OwnerIndex(self.filename, self.indexroot)
+        self.addCleanup(self.index.close)
+        self.assertEqual((6, 0, 0), self.index.update(self.indexroot, threads=2))
+
+    def test_candidates(self):
+        # directories owned by the user are candidates even without entries
+        self.assertEqual([self.path('a'), self.path('a', 'aa'), self.path('b')], self.find(uids=[1000]))
+
+        # rolled up directories replace the directories under them
+        self.assertEqual([self.path('a', 'aa'), self.path('b'), self.path('r')], self.find(uids=[1001]))
+        self.assertEqual([self.path('r')], self.find(gids=[300]))
+
+        # every owner has to match
+        self.assertEqual([self.path('a'), self.path('b')], self.find(uids=[1000], gids=[200]))
+        self.assertEqual([], self.find(uids=[1000, 1001], gids=[300]))
+
+        self.assertEqual([], self.find(uids=[1002]))
+        self.assertIsNone(self.find())
+
+    def test_restrictions(self):
+        self.assertEqual([self.path('a', 'aa')], self.find([self.path('a')], uids=[1001]))
+        self.assertEqual([self.path('b'), self.path('r')], self.find(uids=[1001], maxdepth=1))
+        self.assertEqual([self.path('b')], self.find(uids=[1000], skip=['a']))
+        self.assertIsNone(self.find(uids=[1000], limit=2))
+        self.assertIsNone(self.find([self.path('missing')], uids=[1000]))
+
+    def test_usage(self):
+        self.assertEqual((3, 31), self.index.usage(self.indexroot, gufi_owners.UID, 1000))
+        self.assertEqual((1, 1), self.index.usage(self.path('b'), gufi_owners.UID, 1000))
+        self.assertEqual((2, 12), self.index.usage(self.indexroot, gufi_owners.UID, 1001))
+        self.assertEqual((2, 15), self.index.usage(self.indexroot, gufi_owners.GID, 100))
+        self.assertEqual((0, 0), self.index.usage(self.indexroot, gufi_owners.GID, 400))
+
+    def test_update(self):
+        self.assertEqual((0, 6, 0), self.index.update(self.indexroot))
+
+        # only the changed directory is read, and its old owners are dropped
+        write_dir(self.path('b'), (1001, 200), [(1002, 200, 4)])
+        self.assertEqual((1, 5, 0), self.index.update(self.indexroot))
+        self.assertEqual([self.path('a'), self.path('a', 'aa')], self.find(uids=[1000]))
+        self.assertEqual((1, 4), self.index.usage(self.indexroot, gufi_owners.UID, 1002))
+
+        shutil.rmtree(self.path('a'))
+        self.assertEqual((0, 4, 2), self.index.update(self.indexroot))
+        self.assertEqual([], self.find(uids=[1000]))
+
+        # directories that cannot be read are always candidates
+        with open(os.path.join(self.path('b'), gufi_index.DBNAME), 'w') as db: # pylint: disable=unspecified-encoding
+            db.write('not a database')
+        self.assertEqual((1, 3, 0), self.index.update(self.indexroot))
+        self.assertEqual([self.path('b')], self.find(uids=[1000]))
+
+    def test_readonly(self):
+        readonly = gufi_owners.OwnerIndex(self.filename, self.indexroot, readonly=True)
+        try:
+            self.assertEqual([self.path('a'), self.path('b')],
+                             gufi_owners.candidates(readonly, [self.indexroot], gids=[200]))
+        finally:
+            readonly.close()
+
+        # built from a different index
+        with self.assertRaises(RuntimeError):
+            gufi_owners.OwnerIndex(self.filename, self.path('a'), readonly=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import collections
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_prefetch
+
+Config = collections.namedtuple('Config', ['query', 'threads'])
+
+def make_dir(path):
+    os.makedirs(path)
+    db = sqlite3.connect(os.path.join(path, gufi_index.DBNAME))
+    db.execute('CREATE TABLE entries(name TEXT);')
+    db.commit()
+    db.close()
+
+    # an old timestamp that has to survive prefetching
+    os.utime(os.path.join(path, gufi_index.DBNAME), (1000, 2000))
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.indexroot = os.path.join(self.tmp, 'index')
+
+        # index
+        # index/a
+        # index/a/c
+        # index/b
+        for names in [[], ['a'], ['a', 'c'], ['b']]:
+            make_dir(self.path(*names))
+
+        self.size = os.stat(self.db()).st_size
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def path(self, *names):
+        return os.path.join(self.indexroot, *names)
+
+    def db(self, *names):
+        return os.path.join(self.path(*names), gufi_index.DBNAME)
+
+    def test_databases(self):
+        # breadth first, parents before their children
+        self.assertEqual([self.db(), self.db('a'), self.db('b'), self.db('a', 'c')],
+                         list(gufi_prefetch.databases([self.indexroot])))
+        self.assertEqual([self.db('a'), self.db('b')],
+                         list(gufi_prefetch.databases([self.indexroot], mindepth=1, maxdepth=1)))
+        self.assertEqual([self.db(), self.db('b')],
+                         list(gufi_prefetch.databases([self.indexroot], skip={'a'})))
+
+    def test_prefetch(self):
+        self.assertEqual(self.size, gufi_prefetch.prefetch(self.db()))
+
+        # gufi_query -m relies on the times of the databases
+        st = os.stat(self.db())
+        self.assertEqual(1000, st.st_atime)
+        self.assertEqual(2000, st.st_mtime)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fadvise'), 'posix_fadvise is not available')
+    def test_evict(self):
+        self.assertEqual((4, 4 * self.size), gufi_prefetch.evict_all([self.indexroot]))
+        self.assertEqual((2, 2 * self.size), gufi_prefetch.evict_all([self.indexroot], maxdepth=1, skip={'b'}))
+
+    def test_prefetcher(self):
+        prefetcher = gufi_prefetch.Prefetcher([self.indexroot], 2, lookahead=1)
+        prefetcher.start()
+        prefetcher.wait()
+        self.assertEqual(4, prefetcher.files)
+        self.assertEqual(4 * self.size, prefetcher.bytes)
+
+    def test_pacing(self):
+        # a command that has read the first database, but not the rest
+        class Paced(gufi_prefetch.Prefetcher):
+            read = 0
+            def consumed(self):
+                return self.read
+
+        prefetcher = Paced([self.indexroot], 2, window=self.size)
+        prefetcher.consumer = gufi_prefetch.Consumer()
+        prefetcher.start()
+
+        # only one database is prefetched ahead of the command
+        time.sleep(0.2)
+        self.assertEqual(1, prefetcher.files)
+
+        prefetcher.read = 2 * self.size
+        time.sleep(0.2)
+        self.assertEqual(3, prefetcher.files)
+
+        prefetcher.read = 4 * self.size
+        prefetcher.wait()
+        self.assertEqual(4, prefetcher.files)
+
+        # nothing to pace against
+        prefetcher = gufi_prefetch.Prefetcher([self.indexroot], 1, window=0)
+        self.assertIsNone(prefetcher.consumed())
+        prefetcher.start()
+        prefetcher.wait()
+        self.assertEqual(4, prefetcher.files)
+
+    def test_run(self):
+        calls = []
+        def run_command(cmd, stdout=None, replace=False, trace=None, progress=None): # pylint: disable=too-many-arguments,unused-argument
+            calls.append((cmd, replace))
+            progress.start(os.getpid())
+            progress.stop()
+            return 3
+
+        prefetcher = gufi_prefetch.Prefetcher([self.path('a')], 1, run_command=run_command)
+
+        # the process is not replaced, so prefetching can go on
+        self.assertEqual(3, prefetcher.run(['gufi_query', self.path('a')], replace=True))
+        self.assertEqual([(['gufi_query', self.path('a')], False)], calls)
+        self.assertTrue(prefetcher.done.is_set())
+
+        # paced against the command
+        self.assertEqual(os.getpid(), prefetcher.consumer.pid)
+
+    def test_from_command(self):
+        skip = os.path.join(self.tmp, 'skip')
+        with open(skip, 'w') as f: # pylint: disable=unspecified-encoding
+            f.write('c\n')
+
+        prefetcher = gufi_prefetch.from_command(['gufi_query', '-n', '2', '-y', '1', '-z', '3', '-k', skip],
+                                                [self.indexroot], 2)
+        self.assertEqual(1, prefetcher.mindepth)
+        self.assertEqual(3, prefetcher.maxdepth)
+        self.assertEqual({'c'}, prefetcher.skip)
+
+        prefetcher = gufi_prefetch.from_command(['gufi_query', '-z', '0'], [self.indexroot], 2)
+        self.assertIsNone(prefetcher.mindepth)
+        self.assertEqual(0, prefetcher.maxdepth)
+        self.assertIsNone(prefetcher.skip)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fadvise') and os.path.exists('/bin/true'),
+                         'posix_fadvise or /bin/true is not available')
+    def test_benchmark(self):
+        out = io.StringIO() if sys.version_info.major >= 3 else io.BytesIO()
+        without, with_prefetch = gufi_prefetch.benchmark(Config('/bin/true', 2), [self.indexroot], out=out)
+        self.assertGreaterEqual(without, 0)
+        self.assertGreaterEqual(with_prefetch, 0)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith('Cold cache: '))
+        self.assertTrue(lines[0].endswith('(fastest of {0})'.format(gufi_prefetch.REPEAT)))
+        self.assertTrue(lines[1].startswith('Cold cache with prefetching: '))
+
+if __name__ == '__main__':
+    unittest.main()
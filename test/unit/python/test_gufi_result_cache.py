@@ -0,0 +1,198 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_result_cache
+
+def make_index(path):
+    os.makedirs(path)
+    with open(os.path.join(path, gufi_index.DBNAME), 'w'): # pylint: disable=unspecified-encoding
+        pass
+
+def command(text):
+    '''a command that prints text'''
+    return [sys.executable, '-c', 'import sys; sys.stdout.write({0!r})'.format(text)]
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp, 'cache')
+        self.indexroot = os.path.join(self.tmp, 'index')
+        make_index(self.indexroot)
+        self.cache = gufi_result_cache.ResultCache(self.directory)
+
+    def tearDown(self): # pylint: disable=invalid-name
+        self.cache.close()
+        shutil.rmtree(self.tmp)
+
+    def run_cached(self, cmd):
+        out = io.BytesIO()
+        self.assertEqual(0, gufi_result_cache.run(self.cache, cmd, self.indexroot, [self.indexroot], out))
+        return out.getvalue().decode()
+
+    def test_partitioned(self):
+        user = os.path.join(self.directory, str(os.geteuid()))
+        self.assertEqual(os.path.join(user, gufi_result_cache.DBNAME), self.cache.filename)
+        self.assertEqual(0, os.stat(user).st_mode & 0o077)
+
+        # refuse to use a directory other users can write to
+        os.chmod(user, 0o777)
+        with self.assertRaises(RuntimeError):
+            gufi_result_cache.ResultCache(self.directory)
+
+    def test_get_put(self):
+        fingerprint = gufi_result_cache.fingerprint(self.indexroot, [self.indexroot])
+        self.assertIsNone(self.cache.get('key', fingerprint))
+        self.assertTrue(self.cache.put('key', fingerprint, 'output'.encode()))
+        self.assertEqual('output'.encode(), self.cache.get('key', fingerprint))
+
+        # rebuilt index
+        self.assertIsNone(self.cache.get('key', fingerprint + 'changed'))
+        self.assertIsNone(self.cache.get('key', fingerprint))
+
+    def test_eviction(self):
+        output = os.urandom(40)
+
+        # room for two outputs
+        self.cache.close()
+        self.cache = gufi_result_cache.ResultCache(self.directory,
+                                                   max_size=len(zlib.compress(output)) * 5 // 2)
+
+        for name in ['a', 'b']:
+            self.assertTrue(self.cache.put(name, '', output))
+
+        # using a makes b the least recently used
+        self.assertEqual(output, self.cache.get('a', ''))
+        self.assertTrue(self.cache.put('c', '', output))
+        self.assertIsNotNone(self.cache.get('a', ''))
+        self.assertIsNone(self.cache.get('b', ''))
+        self.assertIsNotNone(self.cache.get('c', ''))
+
+        # too large to store
+        self.assertFalse(self.cache.put('d', '', os.urandom(400)))
+
+    def test_run(self):
+        name = gufi_result_cache.key(command('first') + [self.indexroot], self.indexroot)
+        self.assertEqual('first', self.run_cached(command('first')))
+        self.assertEqual('first'.encode(),
+                         self.cache.get(name, gufi_result_cache.fingerprint(self.indexroot, [self.indexroot])))
+
+        # same command is replayed
+        self.assertEqual('first', self.run_cached(command('first')))
+
+        # different command
+        self.assertEqual('second', self.run_cached(command('second')))
+
+        # rewriting the index invalidates results
+        os.utime(os.path.join(self.indexroot, gufi_index.DBNAME), (0, 0))
+        self.assertIsNone(self.cache.get(name, gufi_result_cache.fingerprint(self.indexroot, [self.indexroot])))
+
+    def test_fingerprint(self):
+        deep = os.path.join(self.indexroot, 'a', 'b')
+        make_index(deep)
+        before = gufi_result_cache.fingerprint(self.indexroot, [self.indexroot])
+
+        # reindexing a directory deep in the tree
+        os.utime(os.path.join(deep, gufi_index.DBNAME), (0, 0))
+        after = gufi_result_cache.fingerprint(self.indexroot, [self.indexroot])
+        self.assertNotEqual(before, after)
+
+        # unless the command does not go that deep
+        shallow = gufi_result_cache.fingerprint(self.indexroot, [self.indexroot], ['gufi_query', '-z', '1'])
+        os.utime(os.path.join(deep, gufi_index.DBNAME), (1, 1))
+        self.assertEqual(shallow, gufi_result_cache.fingerprint(self.indexroot, [self.indexroot], ['gufi_query', '-z', '1']))
+
+        # adding an external database that the command attaches
+        cmd = ['gufi_query', '-Q', 'ext.db', 't', 't_template.t', 'v']
+        self.assertEqual((None, [gufi_index.DBNAME, 'ext.db']), gufi_result_cache.watched(cmd))
+        before = gufi_result_cache.fingerprint(self.indexroot, [self.indexroot], cmd)
+        with open(os.path.join(deep, 'ext.db'), 'w'): # pylint: disable=unspecified-encoding
+            pass
+        self.assertNotEqual(before, gufi_result_cache.fingerprint(self.indexroot, [self.indexroot], cmd))
+
+    def test_failed(self):
+        cmd = [sys.executable, '-c', 'import sys; sys.stdout.write("partial"); sys.exit(1)']
+        out = io.BytesIO()
+        self.assertEqual(1, gufi_result_cache.run(self.cache, cmd, self.indexroot, [self.indexroot], out))
+        self.assertEqual('partial'.encode(), out.getvalue())
+
+        # failed commands are not stored
+        name = gufi_result_cache.key(cmd + [self.indexroot], self.indexroot)
+        self.assertIsNone(self.cache.get(name, gufi_result_cache.fingerprint(self.indexroot, [self.indexroot])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_sample
+
+class TestSample(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+
+        # 1 directory at level 0 and 10 directories at level 1
+        # directory i has i files of size 1
+        for i in range(11):
+            path = self.tmp if i == 0 else os.path.join(self.tmp, str(i))
+            if i:
+                os.mkdir(path)
+
+            db = sqlite3.connect(os.path.join(path, gufi_index.DBNAME))
+            db.execute('CREATE TABLE entries(size INT64);')
+            db.executemany('INSERT INTO entries VALUES (1);', [()] * i)
+            db.commit()
+            db.close()
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def test_sample_size(self):
+        self.assertEqual(gufi_sample.sample_size(1, 0.1), 1)
+        self.assertEqual(gufi_sample.sample_size(10, 0.1), 2)
+        self.assertEqual(gufi_sample.sample_size(100, 0.1), 10)
+        self.assertEqual(gufi_sample.sample_size(100, 1), 100)
+
+    def test_sample(self):
+        population, sampled = gufi_sample.sample(self.tmp, 0.5, rng=random.Random(0))
+        self.assertEqual(population, {0: 1, 1: 10})
+        self.assertEqual([len(directories) for directories in sampled.values()], [1, 5])
+
+    def test_descend(self):
+        # each directory at level 1 has one subdirectory
+        for i in range(1, 11):
+            path = os.path.join(self.tmp, str(i), 'sub')
+            os.mkdir(path)
+            sqlite3.connect(os.path.join(path, gufi_index.DBNAME)).close()
+
+        population, sampled = gufi_sample.sample(self.tmp, 0.5, rng=random.Random(0))
+
+        # only the subdirectories of the 5 sampled directories are candidates
+        parents = set(directory.path for directory in sampled[1])
+        self.assertEqual(len(sampled[2]), 3)
+        for directory in sampled[2]:
+            self.assertIn(os.path.dirname(directory.path), parents)
+
+        # each sampled directory at level 2 stands for 10 / 3 directories
+        self.assertEqual(population[0], 1)
+        self.assertEqual(population[1], 10)
+        self.assertAlmostEqual(population[2], 10)
+
+        # directories without a database are descended into
+        os.makedirs(os.path.join(self.tmp, '10', 'nodb', 'sub'))
+        sqlite3.connect(os.path.join(self.tmp, '10', 'nodb', 'sub', gufi_index.DBNAME)).close()
+
+        population, sampled = gufi_sample.sample(self.tmp, 1)
+        self.assertEqual(population, {0: 1, 1: 10, 2: 10, 3: 1})
+
+    def test_full_sample(self):
+        # sampling everything is exact
+        population, sampled = gufi_sample.sample(self.tmp, 1)
+        partials = gufi_sample.query(sampled, 'SELECT NULL, SUM(size) FROM entries;', 2)
+
+        self.assertEqual(gufi_sample.estimate_totals(population, partials),
+                         {None: gufi_sample.Estimate(55, 0)})
+
+        partials = gufi_sample.query(sampled, 'SELECT NULL, COUNT(*) FROM entries WHERE size > 0 HAVING COUNT(*) > 0;')
+        self.assertEqual(gufi_sample.estimate_mean(population, partials),
+                         gufi_sample.Estimate(5.5, 0))
+
+    def test_estimate(self):
+        population, sampled = gufi_sample.sample(self.tmp, 0.5, rng=random.Random(0))
+        partials = gufi_sample.query(sampled, 'SELECT NULL, SUM(size) FROM entries;')
+
+        ys = [sum(value for _, value in rows) for rows in partials[1]]
+        mean = sum(ys) / 5.0
+        variance = 10 * 10 * (1 - 0.5) * sum((y - mean) ** 2 for y in ys) / 4 / 5
+
+        estimate = gufi_sample.estimate_totals(population, partials)[None]
+        self.assertAlmostEqual(estimate.value, 10 * mean)
+        self.assertAlmostEqual(estimate.error, gufi_sample.Z95 * variance ** 0.5)
+
+    def test_floor_log(self):
+        self.assertEqual(gufi_sample.floor_log(2, 0), -1)
+        self.assertEqual(gufi_sample.floor_log(2, None), -1)
+        self.assertEqual(gufi_sample.floor_log(2, 1), 0)
+        self.assertEqual(gufi_sample.floor_log(2, 7), 2)
+        self.assertEqual(gufi_sample.floor_log(2, 8), 3)
+        self.assertEqual(gufi_sample.floor_log(1024, 1023), 0)
+        self.assertEqual(gufi_sample.floor_log(1024, 1024 ** 3), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_stats_cache
+
+def make_dir(path, uid, sizes):
+    '''create an index directory containing files with the given sizes'''
+    os.makedirs(path)
+    db = sqlite3.connect(os.path.join(path, gufi_index.DBNAME))
+    db.execute('CREATE TABLE summary(isroot INT64, uid INT64, totsize INT64);')
+    db.execute('CREATE TABLE entries(type TEXT, uid INT64, size INT64);')
+    db.execute('INSERT INTO summary VALUES (1, ?, ?);', (uid, sum(sizes)))
+    db.executemany('INSERT INTO entries VALUES (\'f\', ?, ?);', [(uid, size) for size in sizes])
+    db.commit()
+    db.close()
+
+PARTIAL = 'SELECT uid, SUM(size) FROM entries GROUP BY uid'
+TOTAL   = 'SELECT SUM(value) FROM selected'
+LEVELS  = 'SELECT level, SUM(value) FROM selected GROUP BY level ORDER BY level'
+
+class TestStatsCache(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.indexroot = os.path.join(self.tmp, 'index')
+        self.filename = os.path.join(self.tmp, 'cache.db')
+
+        make_dir(self.indexroot,                                   1, [1, 2])
+        make_dir(os.path.join(self.indexroot, 'a'),                1, [4])
+        make_dir(os.path.join(self.indexroot, 'a', 'aa'),          2, [8, 16])
+        make_dir(os.path.join(self.indexroot, 'b'),                2, [32])
+
+        self.cache = gufi_stats_cache.StatsCache(self.filename, self.indexroot)
+
+    def tearDown(self): # pylint: disable=invalid-name
+        self.cache.close()
+        shutil.rmtree(self.tmp)
+
+    def test_walk(self):
+        self.assertEqual([(gufi_index.relpath(directory.path, self.indexroot), directory.level)
+                          for directory in gufi_index.walk(self.indexroot)],
+                         [('', 0), ('a', 1), ('b', 1), (os.path.join('a', 'aa'), 2)])
+
+        self.assertEqual([directory.level
+                          for directory in gufi_index.walk(self.indexroot, skip=['a'])],
+                         [0, 1])
+
+    def test_merge(self):
+        self.assertEqual(self.cache.refresh('v', PARTIAL, self.indexroot), (4, 0, 0))
+        self.assertEqual(self.cache.merge('v', self.indexroot, TOTAL), [(63,)])
+        self.assertEqual(self.cache.merge('v', self.indexroot, LEVELS), [(0, 3), (1, 36), (2, 24)])
+
+        # merging a subtree uses levels relative to the subtree
+        subtree = os.path.join(self.indexroot, 'a')
+        self.assertEqual(self.cache.refresh('v', PARTIAL, subtree, threads=2), (0, 2, 0))
+        self.assertEqual(self.cache.merge('v', subtree, LEVELS), [(0, 4), (1, 24)])
+
+    def test_reuse(self):
+        self.cache.refresh('v', PARTIAL, self.indexroot, threads=2)
+
+        # nothing changed
+        self.assertEqual(self.cache.refresh('v', PARTIAL, self.indexroot), (0, 4, 0))
+
+        # different variants do not share partial results
+        self.assertEqual(self.cache.refresh('w', PARTIAL, self.indexroot), (4, 0, 0))
+
+        # only the changed directory is queried
+        db = sqlite3.connect(os.path.join(self.indexroot, 'b', gufi_index.DBNAME))
+        db.execute('INSERT INTO entries VALUES (\'f\', 2, 64);')
+        db.commit()
+        db.close()
+
+        self.assertEqual(self.cache.refresh('v', PARTIAL, self.indexroot), (1, 3, 0))
+        self.assertEqual(self.cache.merge('v', self.indexroot, TOTAL), [(127,)])
+
+        # removed directories are dropped
+        shutil.rmtree(os.path.join(self.indexroot, 'a'))
+        self.assertEqual(self.cache.refresh('v', PARTIAL, self.indexroot), (0, 2, 2))
+        self.assertEqual(self.cache.merge('v', self.indexroot, TOTAL), [(99,)])
+
+    def test_moved(self):
+        self.cache.refresh('v', PARTIAL, self.indexroot)
+
+        os.rename(os.path.join(self.indexroot, 'a'),
+                  os.path.join(self.indexroot, 'b', 'a'))
+
+        self.assertEqual(self.cache.refresh('v', PARTIAL, self.indexroot), (0, 4, 0))
+        self.assertEqual(self.cache.merge('v', self.indexroot, LEVELS), [(0, 3), (1, 32), (2, 4), (3, 24)])
+        self.assertEqual(self.cache.merge('v', os.path.join(self.indexroot, 'b'), TOTAL), [(60,)])
+
+    def test_functions(self):
+        self.cache.refresh('v', PARTIAL, self.indexroot)
+        self.assertEqual(self.cache.merge('v', self.indexroot,
+                                          'SELECT double(key), SUM(value) FROM selected GROUP BY key ORDER BY key',
+                                          {'double': (1, lambda value: value * 2)}),
+                         [(2, 7), (4, 56)])
+
+    def test_group_depth(self):
+        self.cache.refresh('v', PARTIAL, self.indexroot)
+
+        groups = 'SELECT grp, SUM(value) FROM selected GROUP BY grp ORDER BY grp'
+        self.assertEqual(self.cache.merge('v', self.indexroot, groups, group_depth=0),
+                         [(os.curdir, 63)])
+        self.assertEqual(self.cache.merge('v', self.indexroot, groups, group_depth=1),
+                         [(os.curdir, 3), ('a', 28), ('b', 32)])
+
+        # groups are relative to the starting path but named from the index root
+        self.assertEqual(self.cache.merge('v', os.path.join(self.indexroot, 'a'), groups, group_depth=1),
+                         [('a', 4), (os.path.join('a', 'aa'), 24)])
+
+    def test_merge_indexes(self):
+        other = os.path.join(self.tmp, 'other')
+        make_dir(other,                   1, [64])
+        make_dir(os.path.join(other, 'a'), 3, [128])
+
+        self.cache.refresh('v', PARTIAL, self.indexroot)
+        self.assertEqual(self.cache.refresh('w', PARTIAL, other, indexroot=other), (2, 0, 0))
+
+        sources = [('index', 'v', self.indexroot, self.indexroot),
+                   ('other', 'w', other, other)]
+        self.assertEqual(self.cache.merge_indexes(sources, TOTAL), [(255,)])
+        self.assertEqual(self.cache.merge_indexes(sources, LEVELS), [(0, 67), (1, 164), (2, 24)])
+
+        # groups are prefixed with the name of their index
+        groups = 'SELECT grp, SUM(value) FROM selected GROUP BY grp ORDER BY grp'
+        self.assertEqual(self.cache.merge_indexes(sources, groups, group_depth=1),
+                         [('index', 3), (os.path.join('index', 'a'), 28), (os.path.join('index', 'b'), 32),
+                          ('other', 64), (os.path.join('other', 'a'), 128)])
+
+    def test_owner(self):
+        self.cache.db.execute('UPDATE metadata SET value = ? WHERE name == \'uid\';', (str(os.geteuid() + 1),))
+        self.cache.db.commit()
+
+        with self.assertRaises(RuntimeError):
+            gufi_stats_cache.StatsCache(self.filename, self.indexroot)
+
+    def test_user_cache(self):
+        directory = os.path.join(self.tmp, 'caches')
+        filename = gufi_stats_cache.user_cache(directory)
+        self.assertEqual(os.path.join(directory, str(os.geteuid()), gufi_stats_cache.DBNAME), filename)
+        self.assertEqual(0, os.stat(os.path.dirname(filename)).st_mode & 0o077)
+
+        cache = gufi_stats_cache.StatsCache(filename, self.indexroot)
+        try:
+            self.assertEqual(cache.refresh('v', PARTIAL, self.indexroot), (4, 0, 0))
+        finally:
+            cache.close()
+
+    def test_version(self):
+        self.cache.refresh('v', PARTIAL, self.indexroot)
+        self.cache.db.execute('UPDATE metadata SET value = \'0\' WHERE name == \'version\';')
+        self.cache.db.commit()
+
+        # old partial results are dropped
+        cache = gufi_stats_cache.StatsCache(self.filename, self.indexroot)
+        try:
+            self.assertEqual(cache.refresh('v', PARTIAL, self.indexroot), (4, 0, 0))
+        finally:
+            cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_trace
+
+# column names of the cumulative times printed by gufi_query
+THREAD_POOL = [
+    'open directories', 'attach index', 'xattrprep', 'addqueryfuncs',
+    'get_rollupscore', 'descend', 'check args', 'check level',
+    'check level <= max_level branch', 'while true', 'readdir',
+    'readdir != null branch', 'strncmp', 'strncmp != . or ..', 'snprintf',
+    'isdir', 'isdir branch', 'access', 'set', 'clone', 'pushdir',
+    'check if treesummary table exists', 'sqltsum', 'sqlsum', 'sqlent',
+    'xattrdone', 'detach index', 'close directories', 'restore timestamps',
+    'free work', 'output timestamps',
+]
+
+def build_query(cumulative):
+    '''script that stands in for gufi_query and prints debug output to stderr'''
+    lines = ['thread pool: 0.50s'] + ['    {0}: 0.01s'.format(col) for col in THREAD_POOL]
+    if cumulative:
+        lines += [
+            'set up globals: 0.10s',
+            'set up intermediate databases: 0.00s',
+            'aggregate into final databases: 0.20s',
+            'print aggregated results: 0.00s',
+            'clean up globals: 0.10s',
+            'Threads run: 2',
+            'Queries performed: 4',
+            'Rows printed to stdout or outfiles: 3',
+            'Total Thread Time (not including main): 0.90s',
+            'Real time (main): 0.90s',
+        ]
+
+    # per-thread timestamps
+    lines += ['0 opendir 1000 2000',
+              '1 sqlent 1500000 2500000']
+
+    return '#!/bin/sh\necho output\ncat >&2 <<EOF\n{0}\nEOF\n'.format('\n'.join(lines))
+
+def performance_pkg_available():
+    return os.path.isdir(os.path.join(gufi_trace.PERFORMANCE, 'performance_pkg'))
+
+class TestTrace(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'trace.json')
+
+    def tearDown(self): # pylint: disable=invalid-name
+        shutil.rmtree(self.tmp)
+
+    def run_query(self, cumulative):
+        query = os.path.join(self.tmp, 'gufi_query')
+        with open(query, 'w') as script: # pylint: disable=unspecified-encoding
+            script.write(build_query(cumulative))
+        os.chmod(query, stat.S_IRWXU)
+
+        trace = gufi_trace.Trace(self.filename, 'gufi_find')
+        now = time.time()
+        trace.startup(now, now, now)
+
+        with open(os.path.join(self.tmp, 'out'), 'wb') as out, \
+             open(os.path.join(self.tmp, 'err'), 'wb') as err:
+            stderr = sys.stderr
+            sys.stderr = err
+            try:
+                self.assertEqual(0, trace.run([query], out))
+            finally:
+                sys.stderr = stderr
+        trace.write()
+
+        # output and stderr are passed through
+        with open(os.path.join(self.tmp, 'out'), 'rb') as out:
+            self.assertEqual(b'output\n', out.read())
+        with open(os.path.join(self.tmp, 'err'), 'rb') as err:
+            self.assertIn(b'thread pool: 0.50s\n', err.read())
+
+        with open(self.filename, 'r') as trace_file: # pylint: disable=unspecified-encoding
+            return json.load(trace_file)['traceEvents']
+
+    def test_process_start(self):
+        start = gufi_trace.process_start()
+        if start is not None:
+            self.assertLessEqual(start, time.time())
+
+    def test_wrapper(self):
+        events = self.run_query(False)
+        names = [event['name'] for event in events if event['ph'] == 'X']
+        for name in ['python startup', 'read config', 'parse arguments',
+                     'spawn gufi_query', 'gufi_query', 'total']:
+            self.assertIn(name, names)
+
+        # one lane per thread of gufi_query
+        lanes = dict((event['tid'], event['args']['name']) for event in events
+                     if event['name'] == 'thread_name')
+        self.assertEqual({0: 'main', 1: 'thread 0', 2: 'thread 1'}, lanes)
+
+        sqlent = [event for event in events if event['name'] == 'sqlent'][0]
+        self.assertEqual(2, sqlent['tid'])
+        self.assertEqual(1000, sqlent['dur'])
+
+        # incomplete cumulative times are not used
+        self.assertNotIn('thread pool', names)
+
+    @unittest.skipUnless(performance_pkg_available(), 'performance history framework not configured')
+    def test_cumulative_times(self):
+        events = self.run_query(True)
+        phases = dict((event['name'], event) for event in events
+                      if (event['ph'] == 'X') and (event['tid'] == 0) and (event['pid'] != os.getpid()))
+
+        # phases are laid out one after the other
+        self.assertAlmostEqual(phases['set up globals']['ts'] + 100000, phases['thread pool']['ts'], places=3)
+        self.assertAlmostEqual(500000, phases['thread pool']['dur'])
+        self.assertEqual(0.01, phases['thread pool']['args']['sqlent'])
+        self.assertEqual(4, phases['gufi_query']['args']['Queries performed'])
+        self.assertEqual(0, phases['gufi_query']['args']['returncode'])
+
+    def test_missing_parser(self):
+        # the parser cannot be imported
+        saved = sys.modules.get('performance_pkg.extraction.gufi_query')
+        sys.modules['performance_pkg.extraction.gufi_query'] = None
+        stderr = sys.stderr
+        sys.stderr = io.StringIO() if sys.version_info.major >= 3 else io.BytesIO()
+        try:
+            self.assertIsNone(gufi_trace.cumulative_times(['thread pool: 0.50s']))
+            self.assertEqual('', sys.stderr.getvalue())
+
+            # cumulative times that cannot be parsed are reported
+            self.assertIsNone(gufi_trace.cumulative_times(['Real time (main): 0.90s']))
+            self.assertIn('performance_pkg', sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+            if saved is None:
+                del sys.modules['performance_pkg.extraction.gufi_query']
+            else:
+                sys.modules['performance_pkg.extraction.gufi_query'] = saved
+
+if __name__ == '__main__':
+    unittest.main()
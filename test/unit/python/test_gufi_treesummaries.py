@@ -0,0 +1,276 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import os
+import shutil
+import sqlite3
+import sys
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_treesummaries
+import index_fixtures
+
+SUMMARY = ['name', 'inode', 'pinode', 'isroot', 'rollupscore', 'rectype'] + gufi_treesummaries.SUMMARY_COLUMNS
+
+def tables(dirname, inode, files, size, uid, rollup=None):
+    '''
+    an index directory whose summary says it has files entries
+    totalling size bytes owned by uid
+
+    rollup is a list of (files, size, uid) of rolled up subdirectories
+    '''
+
+    rows = [(files, size, uid, 1)] + [(sub_files, sub_size, sub_uid, 0)
+                                      for sub_files, sub_size, sub_uid in (rollup or [])]
+    summary = []
+    for i, (row_files, row_size, row_uid, isroot) in enumerate(rows):
+        values = dict((col, 0) for col in gufi_treesummaries.SUMMARY_COLUMNS)
+        values.update({'name': dirname, 'inode': str(inode + i), 'pinode': '0',
+                       'isroot': isroot, 'rollupscore': int(rollup is not None), 'rectype': 0,
+                       'totfiles': row_files, 'totsize': row_size,
+                       'minuid': row_uid, 'maxuid': row_uid})
+        summary += [[values[col] for col in SUMMARY]]
+
+    return [('summary',      SUMMARY,       summary),
+            ('external_dbs', ['name TEXT'], [])]
+
+make_dir, _ = index_fixtures.dir_factory(tables)
+
+def set_files(path, files, size):
+    '''change the summary of a directory the way reindexing it would'''
+    db = sqlite3.connect(os.path.join(path, gufi_index.DBNAME))
+    db.execute('UPDATE summary SET totfiles = ?, totsize = ? WHERE isroot == 1;', (files, size))
+    db.commit()
+    db.close()
+
+def read_treesummary(path):
+    db = gufi_index.open_db(path)
+    try:
+        return gufi_treesummaries.treesummary(db)
+    finally:
+        db.close()
+
+class TestTreesummaries(index_fixtures.IndexTestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        # pylint: disable=super-with-arguments
+        super(TestTreesummaries, self).setUp()
+
+        # index
+        # index/a
+        # index/a/b
+        # index/c (empty)
+        make_dir(self.indexroot, 1, 1, 10, 5)
+        make_dir(self.path('a'), 2, 2, 200, 3)
+        make_dir(self.path('a', 'b'), 3, 4, 4000, 7)
+        make_dir(self.path('c'), 4, 0, 0, 1)
+
+        self.state = gufi_treesummaries.TreesummaryState(os.path.join(self.tmp, 'state.db'), self.indexroot)
+        self.addCleanup(self.state.close)
+
+    def update(self):
+        '''find the changes and recompute what they affect'''
+        self.state.update(self.indexroot)
+        dirs = gufi_treesummaries.plan(self.indexroot, self.state.pending([self.indexroot]))
+        written = gufi_treesummaries.recompute(dirs, threads=2)
+        self.state.done(written)
+        return dirs
+
+    def build_all(self):
+        '''create the treesummary tables the way gufi_treesummary_all would, and mark them'''
+        for path in [self.path('a', 'b'), self.path('c'), self.path('a'), self.indexroot]:
+            gufi_treesummaries.write(path, gufi_treesummaries.compute(path, gufi_index.SKIP))
+        self.state.update(self.indexroot)
+        self.state.done([])
+
+    def test_compute(self):
+        found = gufi_treesummaries.compute(self.indexroot, gufi_index.SKIP)
+        self.assertEqual(4, found.dirs)
+        self.assertEqual(7, found.values['totfiles'])
+        self.assertEqual(4210, found.values['totsize'])
+        self.assertEqual(4, found.values['maxsubdirfiles'])
+        self.assertEqual(4000, found.values['maxsubdirsize'])
+
+        # c does not have files, so its uid is not used
+        self.assertEqual((3, 7), (found.values['minuid'], found.values['maxuid']))
+
+        row = dict(zip(gufi_treesummaries.COLUMNS, found.row('1', '0', 2)))
+        self.assertEqual((3, 2, 0), (row['totsubdirs'], row['depth'], row['rectype']))
+
+        # the treesummary of a child is used instead of descending
+        gufi_treesummaries.write(self.path('a'), gufi_treesummaries.compute(self.path('a'), gufi_index.SKIP))
+        set_files(self.path('a', 'b'), 100, 100)
+        self.assertEqual(7, gufi_treesummaries.compute(self.indexroot, gufi_index.SKIP).values['totfiles'])
+
+        # skipped
+        self.assertEqual(2, gufi_treesummaries.compute(self.indexroot, gufi_index.SKIP | set(['a'])).dirs)
+
+    def test_rollup(self):
+        shutil.rmtree(self.path('c'))
+        make_dir(self.path('c'), 4, 1, 1, 9, rollup=[(2, 2, 0)])
+
+        found = gufi_treesummaries.compute(self.path('c'), gufi_index.SKIP)
+        self.assertEqual((2, 3, 0, 9), (found.dirs, found.values['totfiles'],
+                                        found.values['minuid'], found.values['maxuid']))
+
+    def test_write(self):
+        dbname = os.path.join(self.path('a'), gufi_index.DBNAME)
+        found = gufi_treesummaries.compute(self.path('a'), gufi_index.SKIP)
+        os.utime(dbname, (1000, 2000))
+
+        gufi_treesummaries.write(self.path('a'), found)
+        gufi_treesummaries.write(self.path('a'), found)
+
+        st = os.stat(dbname)
+        self.assertEqual((1000, 2000), (int(st.st_atime), int(st.st_mtime)))
+
+        row = read_treesummary(self.path('a'))
+        self.assertEqual(('2', 1, 6, 4200), (row['inode'], row['totsubdirs'], row['totfiles'], row['totsize']))
+
+        db = gufi_index.open_db(self.path('a'))
+        self.assertEqual(1, db.execute('SELECT COUNT(*) FROM treesummary;').fetchone()[0])
+        self.assertEqual(1, db.execute('SELECT COUNT(*) FROM vtsummarydir;').fetchone()[0])
+        db.close()
+
+    def test_update(self):
+        # nothing has a treesummary table yet
+        self.assertEqual([], self.update())
+
+        self.build_all()
+        self.assertEqual([], self.update())
+        self.assertEqual(7, read_treesummary(self.indexroot)['totfiles'])
+
+        # only b and its ancestors are recomputed
+        set_files(self.path('a', 'b'), 5, 5000)
+        self.assertEqual([self.path('a', 'b'), self.path('a'), self.indexroot], self.update())
+        self.assertEqual(8, read_treesummary(self.indexroot)['totfiles'])
+        self.assertEqual(7, read_treesummary(self.path('a'))['totfiles'])
+
+        # the writes are not seen as changes
+        self.assertEqual([], self.update())
+
+        # removing a directory changes its parent
+        shutil.rmtree(self.path('c'))
+        self.assertEqual([self.indexroot], self.update())
+        self.assertEqual(2, read_treesummary(self.indexroot)['totsubdirs'])
+
+    def test_reindexed(self):
+        self.build_all()
+
+        # a/b was reindexed and a/b/d is new, so neither has a treesummary table
+        shutil.rmtree(self.path('a', 'b'))
+        make_dir(self.path('a', 'b'), 3, 1, 1, 7)
+        make_dir(self.path('a', 'b', 'd'), 5, 1, 1, 7)
+
+        self.assertEqual([self.path('a', 'b', 'd'), self.path('a', 'b'), self.path('a'), self.indexroot],
+                         self.update())
+        self.assertEqual(1, read_treesummary(self.path('a', 'b'))['totsubdirs'])
+        self.assertEqual((4, 5), (read_treesummary(self.indexroot)['totsubdirs'],
+                                  read_treesummary(self.indexroot)['totfiles']))
+
+    def test_pending(self):
+        self.build_all()
+        set_files(self.path('c'), 1, 1)
+
+        # changes stay pending until they are recomputed
+        self.state.update(self.indexroot)
+        self.state.done([], complete=False)
+        self.state.update(self.indexroot)
+        self.assertEqual(set(['', 'c']), self.state.pending([self.indexroot]))
+        self.assertEqual([self.path('c'), self.indexroot],
+                         gufi_treesummaries.plan(self.indexroot, self.state.pending([self.indexroot])))
+        self.assertEqual([self.indexroot],
+                         gufi_treesummaries.plan(self.indexroot, self.state.pending([self.indexroot]), ['c']))
+
+class TestBudget(unittest.TestCase):
+    def test_wait(self):
+        used = [0]
+        now = [0.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+
+        budget = gufi_treesummaries.Budget(100, lambda: used[0], lambda: now[0], sleep)
+        budget.wait()
+        self.assertEqual([], slept)
+
+        # 300 bytes at 100 bytes per second take 3 seconds
+        used[0] = 300
+        now[0] = 1.0
+        budget.wait()
+        self.assertEqual([2.0], slept)
+
+        now[0] = 10.0
+        budget.wait()
+        self.assertEqual([2.0], slept)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+import os
+import shutil
+import sqlite3
+import sys
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_index
+import gufi_trigram
+import index_fixtures
+
+def tables(dirname, names, rollupscore=0):
+    '''an index directory containing entries with the given names'''
+    return [('summary', ['name TEXT', 'isroot INT64', 'rollupscore INT64'], [(dirname, 1, rollupscore)]),
+            ('entries', ['name TEXT'],                                      [(name,) for name in names])]
+
+make_dir, write_dir = index_fixtures.dir_factory(tables)
+
+class TestLiterals(unittest.TestCase):
+    def test_trigrams(self):
+        self.assertEqual(set(['abc', 'bcd']), gufi_trigram.trigrams('ABcd'))
+        self.assertEqual(set(), gufi_trigram.trigrams('ab'))
+
+    def test_glob_literals(self):
+        self.assertEqual(['checkpoint'], gufi_trigram.glob_literals('*checkpoint*'))
+        self.assertEqual(['ab', 'cde', 'fgh'], gufi_trigram.glob_literals('ab?cde*[]x]fgh'))
+        self.assertEqual(['abc'], gufi_trigram.glob_literals('abc[def'))
+
+    def test_regex_literals(self):
+        self.assertEqual(['foo', 'bar.txt'], gufi_trigram.regex_literals(r'^foo.*bar\.txt$'))
+        self.assertEqual(['abc', 'ef'], gufi_trigram.regex_literals('abcd*ef'))
+        self.assertEqual(['ab', 'cd'], gufi_trigram.regex_literals('ab+cd'))
+        self.assertEqual(['defg'], gufi_trigram.regex_literals('(abc)?defg'))
+        self.assertEqual(['x', 'yzw'], gufi_trigram.regex_literals('x[abc]yzw'))
+        self.assertEqual(['ab', 'def'], gufi_trigram.regex_literals('abc{0,2}def'))
+        self.assertEqual(['abc.d'], gufi_trigram.regex_literals(r'\dabc\.d'))
+        self.assertEqual([], gufi_trigram.regex_literals('abc|def'))
+
+        # the whole escape sequence ends the literal
+        self.assertEqual(['foo', 'bar'], gufi_trigram.regex_literals(r'foo\x2Ebar'))
+        self.assertEqual(['foo', 'bar'], gufi_trigram.regex_literals(r'foo\x{2E}bar'))
+        self.assertEqual(['data_', 'bc'], gufi_trigram.regex_literals(r'data_\101bc'))
+        self.assertEqual(['ab', 'cd'], gufi_trigram.regex_literals(r'ab\N{FULL STOP}cd'))
+        self.assertEqual(['ab', 'cd'], gufi_trigram.regex_literals(r'ab\p{Lu}cd'))
+        self.assertEqual(['ab', 'cd'], gufi_trigram.regex_literals(r'ab\Q.*\Ecd'))
+        self.assertEqual(['ab'], gufi_trigram.regex_literals('ab\\'))
+
+class TestTrigramIndex(index_fixtures.IndexTestCase):
+    CANDIDATES = staticmethod(gufi_trigram.candidates)
+
+    def setUp(self): # pylint: disable=invalid-name
+        # pylint: disable=super-with-arguments
+        super(TestTrigramIndex, self).setUp()
+        self.filename = os.path.join(self.tmp, 'trigrams.db')
+
+        make_dir(self.indexroot,                               ['README'])
+        make_dir(os.path.join(self.indexroot, 'a'),            ['checkpoint.001', 'data'])
+        make_dir(os.path.join(self.indexroot, 'a', 'aa'),      ['output'])
+        make_dir(os.path.join(self.indexroot, 'b'),            ['CheckPoint.002'])
+        make_dir(os.path.join(self.indexroot, 'r'),            [], rollupscore=1)
+        make_dir(os.path.join(self.indexroot, 'r', 'rolled'),  ['checkpoint.003'])
+
+        self.index = gufi_trigram.TrigramIndex(self.filename, self.indexroot)
+        self.addCleanup(self.index.close)
+        self.assertEqual((6, 0, 0), self.index.update(self.indexroot, threads=2))
+
+    def test_candidates(self):
+        # case insensitive, and rolled up directories replace the directories under them
+        self.assertEqual([self.path('a'), self.path('b'), self.path('r')],
+                         self.find(names=['*checkpoint*']))
+        self.assertEqual([self.path('a'), self.path('b'), self.path('r')],
+                         self.find(inames=['checkpoint']))
+
+        # alternatives are combined, different tests all have to match
+        self.assertEqual([self.path('a'), self.path(os.path.join('a', 'aa'))],
+                         self.find(names=['*output*', 'data']))
+        self.assertEqual([self.path('a')],
+                         self.find(names=['*checkpoint*'], inames=['data']))
+
+        # directory names are matched too
+        self.assertEqual([self.indexroot, self.path('r')],
+                         self.find(names=['READ*', 'rolled']))
+
+        # no matches
+        self.assertEqual([], self.find(names=['*missing*']))
+
+        # patterns without a long enough literal cannot use the index
+        self.assertIsNone(self.find(names=['*.c']))
+        self.assertIsNone(self.find(names=['*checkpoint*', '*.c']))
+        self.assertIsNone(self.find())
+
+    def test_regex(self):
+        # the literal can also be in the path of the directory
+        self.assertEqual([self.path('a'), self.path(os.path.join('a', 'aa'))],
+                         self.find(regexes=['/a/aa/out', 'data']))
+        # literals are split at slashes
+        self.assertEqual([self.path(os.path.join('a', 'aa'))],
+                         self.find(regexes=['a/output']))
+        self.assertIsNone(self.find(regexes=['aa/o']))
+
+    def test_restrictions(self):
+        # only directories under the starting path
+        self.assertEqual([self.path('a')], self.find([self.path('a')], names=['*checkpoint*']))
+
+        # levels are relative to the starting path
+        self.assertEqual([self.path('a'), self.path('b'), self.path('r')],
+                         self.find(names=['*checkpoint*'], mindepth=1, maxdepth=1))
+        self.assertEqual([], self.find(names=['*checkpoint*'], maxdepth=0))
+        self.assertEqual([self.path(os.path.join('a', 'aa'))],
+                         self.find(names=['*output*'], mindepth=2))
+
+        self.assertEqual([self.path('b'), self.path('r')], self.find(names=['*checkpoint*'], skip=['a']))
+
+        self.assertIsNone(self.find(names=['*checkpoint*'], limit=2))
+
+        # paths that are not in the sidecar cannot use it
+        self.assertIsNone(self.find([self.path('missing')], names=['*checkpoint*']))
+
+    def test_update(self):
+        # nothing changed
+        self.assertEqual((0, 6, 0), self.index.update(self.indexroot))
+
+        # only the changed directory is read
+        write_dir(self.path('b'), ['renamed'])
+        self.assertEqual((1, 5, 0), self.index.update(self.indexroot))
+        self.assertEqual([self.path('a'), self.path('r')], self.find(names=['*checkpoint*']))
+
+        shutil.rmtree(self.path('a'))
+        self.assertEqual((0, 4, 2), self.index.update(self.indexroot))
+        self.assertEqual([self.path('r')], self.find(names=['*checkpoint*']))
+
+        # directories that cannot be read are always candidates
+        os.rename(self.path('b'), self.path('c'))
+        with open(os.path.join(self.path('c'), gufi_index.DBNAME), 'w') as db: # pylint: disable=unspecified-encoding
+            db.write('not a database')
+        self.assertEqual((1, 3, 0), self.index.update(self.indexroot))
+        self.assertEqual([self.path('c'), self.path('r')], self.find(names=['*checkpoint*']))
+
+        # moved directories are not read again
+        os.rename(self.path('r'), self.path('q'))
+        self.assertEqual((0, 4, 0), self.index.update(self.indexroot))
+        self.assertEqual([self.path('c'), self.path('q')], self.find(names=['*checkpoint*']))
+
+    def test_readonly(self):
+        readonly = gufi_trigram.TrigramIndex(self.filename, self.indexroot, readonly=True)
+        try:
+            self.assertEqual([self.path('a')], gufi_trigram.candidates(readonly, [self.indexroot], names=['data']))
+        finally:
+            readonly.close()
+
+        # built from a different index
+        with self.assertRaises(RuntimeError):
+            gufi_trigram.TrigramIndex(self.filename, self.path('a'), readonly=True)
+
+        with self.assertRaises(sqlite3.Error):
+            gufi_trigram.TrigramIndex(os.path.join(self.tmp, 'missing.db'), self.indexroot, readonly=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_config
+import gufi_index
+import gufi_tuning
+
+KEY = ('gufi_stats', 'total-filesize', 1)
+
+class FixedRandom(object): # pylint: disable=useless-object-inheritance
+    '''random numbers that always explore and pick the first choice'''
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+    @staticmethod
+    def choice(values):
+        return values[0]
+
+def build_config(history, threads=8, outputbuffer=65536, profiles=None):
+    lines = [
+        '{0}={1}\n'.format(gufi_config.Server.THREADS, threads),
+        '{0}=/bin/true\n'.format(gufi_config.Server.QUERY),
+        '{0}=/bin/true\n'.format(gufi_config.Server.STAT),
+        '{0}=/search\n'.format(gufi_config.Server.INDEXROOT),
+        '{0}={1}\n'.format(gufi_config.Server.OUTPUTBUFFER, outputbuffer),
+        '{0}={1}\n'.format(gufi_config.Server.HISTORY, history),
+    ]
+    if profiles is not None:
+        lines += ['{0}={1}\n'.format(gufi_config.Server.PROFILES, profiles)]
+    return gufi_config.Server(lines)
+
+class TestTuning(unittest.TestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        self.tmp = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp, 'history')
+        self.history = gufi_tuning.History(self.directory)
+
+    def tearDown(self): # pylint: disable=invalid-name
+        self.history.close()
+        shutil.rmtree(self.tmp)
+
+    def test_candidates(self):
+        self.assertEqual([1, 2, 4, 6], gufi_tuning.candidates(6))
+        self.assertEqual([1], gufi_tuning.candidates(1))
+        self.assertEqual([4096, 8192, 10000], gufi_tuning.candidates(10000, 4096))
+
+    def test_median(self):
+        self.assertEqual(2, gufi_tuning.median([3, 1, 2]))
+        self.assertEqual(2.5, gufi_tuning.median([4, 1, 2, 3]))
+
+    def test_choose(self):
+        never = FixedRandom(1)
+
+        # the config is used until there are enough runs
+        self.assertEqual((8, 65536), self.history.choose(KEY, 8, 65536, never))
+
+        for _ in range(gufi_tuning.MIN_RUNS):
+            self.history.record(KEY, 8, 65536, 4.0, 100, 0)
+            self.history.record(KEY, 2, 4096, 1.0, 100, 0)
+            self.history.record(KEY, 4, 4096, 0.5, None, 1)     # failed
+            self.history.record(KEY, 16, 4096, 0.1, 100, 0)     # above the bound
+
+        self.assertEqual((2, 4096), self.history.choose(KEY, 8, 65536, never))
+
+        # other keys are not affected
+        self.assertEqual((8, 65536), self.history.choose(('gufi_ls', 'list', 1), 8, 65536, never))
+
+        # settings next to the best one are tried sometimes
+        self.assertEqual((1, 4096), self.history.choose(KEY, 8, 65536, FixedRandom(0)))
+
+    def test_export(self):
+        self.history.record(KEY, 2, 4096, 1.5, 10, 0)
+
+        out = io.StringIO() if sys.version_info.major >= 3 else io.BytesIO()
+        self.history.export(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(','.join(gufi_tuning.COLUMNS), lines[0])
+        self.assertEqual(['gufi_stats', 'total-filesize', '1', '2', '4096', '1.5', '10', '0'],
+                         lines[1].split(',')[1:])
+
+    def test_directories(self):
+        index = os.path.join(self.tmp, 'index')
+        os.makedirs(index)
+        self.assertIsNone(gufi_tuning.directories(index))
+
+        db = sqlite3.connect(os.path.join(index, gufi_index.DBNAME))
+        db.execute('CREATE TABLE treesummary(totsubdirs INT64);')
+        db.execute('INSERT INTO treesummary VALUES (9);')
+        db.commit()
+        db.close()
+        self.assertEqual(10, gufi_tuning.directories(index))
+
+    def test_tuner(self):
+        config = build_config(self.directory)
+        key = gufi_tuning.key('gufi_find', 'stream', '/search/a/b', config.indexroot)
+        self.assertEqual(('gufi_find', 'stream', 2), key)
+
+        tuner = gufi_tuning.Tuner(config, key, '/search/a/b')
+        try:
+            self.assertEqual((8, 65536), (tuner.threads, tuner.outputbuffer))
+            self.assertEqual(0, tuner.run(['/bin/true']))
+        finally:
+            tuner.close()
+
+        # the profile of the path bounds the values
+        config = build_config(self.directory, profiles='/search/a:Threads=2,OutputBuffer=4096')
+        tuner = gufi_tuning.Tuner(config, key, '/search/a/b')
+        tuner.close()
+        self.assertEqual((2, 4096), (tuner.threads, tuner.outputbuffer))
+
+        runs = self.history.db.execute('SELECT tool, variant, depth, threads, outputbuffer, returncode FROM runs;').fetchall()
+        self.assertEqual([('gufi_find', 'stream', 2, 8, 65536, 0)], runs)
+
+if __name__ == '__main__':
+    unittest.main()
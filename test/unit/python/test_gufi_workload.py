@@ -0,0 +1,237 @@
+#!/usr/bin/env @PYTHON_INTERPRETER@
+# This file is part of GUFI, which is part of MarFS, which is released
+# under the BSD license.
+#
+#
+# Copyright (c) 2017, Los Alamos National Security (LANS), LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# From Los Alamos National Security, LLC:
+# LA-CC-15-039
+#
+# Copyright (c) 2017, Los Alamos National Security, LLC All rights reserved.
+# Copyright 2017. Los Alamos National Security, LLC. This software was produced
+# under U.S. Government contract DE-AC52-06NA25396 for Los Alamos National
+# Laboratory (LANL), which is operated by Los Alamos National Security, LLC for
+# the U.S. Department of Energy. The U.S. Government has rights to use,
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR LOS
+# ALAMOS NATIONAL SECURITY, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is
+# modified to produce derivative works, such modified software should be
+# clearly marked, so as not to confuse it with the version available from
+# LANL.
+#
+# THIS SOFTWARE IS PROVIDED BY LOS ALAMOS NATIONAL SECURITY, LLC AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL LOS ALAMOS NATIONAL SECURITY, LLC OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY
+# OF SUCH DAMAGE.
+
+
+
+
+
+import io
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path += [
+    os.path.join('@CMAKE_BINARY_DIR@', 'scripts'),
+]
+
+import gufi_config
+import gufi_workload
+import index_fixtures
+
+def query_cmd(name, size):
+    return ['/bin/true', '-n', '2', '-B', '4096',
+            '-I', 'CREATE TABLE out(name TEXT);',
+            '-E', 'INSERT INTO out SELECT name FROM vrpentries WHERE (name REGEXP \'{0}\') AND (size > {1});'.format(name, size),
+            '-K', 'CREATE TABLE aggregate(name TEXT);',
+            '-J', 'INSERT INTO aggregate SELECT * FROM out;',
+            '-G', 'SELECT * FROM aggregate;']
+
+def tables(_dirname, treesummary=False, rollupscore=None):
+    '''an index directory with the tables the suggestions look at'''
+    out = []
+    if treesummary:
+        out += [('treesummary', ['totsubdirs INT64'], [(0,)])]
+    if rollupscore is not None:
+        out += [('summary', ['isroot INT64', 'rollupscore INT64'], [(1, rollupscore)])]
+    return out
+
+make_dir, _ = index_fixtures.dir_factory(tables)
+
+def build_config(indexroot, workload):
+    return gufi_config.Server([
+        '{0}=1\n'.format(gufi_config.Server.THREADS),
+        '{0}=/bin/true\n'.format(gufi_config.Server.QUERY),
+        '{0}=/bin/true\n'.format(gufi_config.Server.STAT),
+        '{0}={1}\n'.format(gufi_config.Server.INDEXROOT, indexroot),
+        '{0}=4096\n'.format(gufi_config.Server.OUTPUTBUFFER),
+        '{0}={1}\n'.format(gufi_config.Server.WORKLOAD, workload),
+    ])
+
+class TestWorkload(index_fixtures.IndexTestCase):
+    def setUp(self): # pylint: disable=invalid-name
+        # pylint: disable=super-with-arguments
+        super(TestWorkload, self).setUp()
+        self.directory = os.path.join(self.tmp, 'workload')
+        self.log = gufi_workload.Log(gufi_workload.user_log(self.directory))
+        self.addCleanup(self.log.close)
+
+    def record(self, cmd, path, seconds, cpu):
+        self.log.record('gufi_find', gufi_workload.statements(cmd), self.indexroot,
+                        os.path.join(self.indexroot, path), seconds, cpu, None, 0)
+
+    def test_normalize(self):
+        self.assertEqual('SELECT "a 1" FROM t WHERE (x == ?) AND (y > ?) AND (log2_hist(z, ?) == -?);',
+                         gufi_workload.normalize('SELECT "a 1"  FROM t\nWHERE (x == \'it\'\'s\') AND (y > 1.5e3) AND (log2_hist(z, 2) == -7);'))
+
+    def test_fingerprint(self):
+        sql = gufi_workload.statements(query_cmd('a.*', 1))
+        self.assertEqual(['-I', '-K', '-E', '-J', '-G'], [flag for flag, _ in sql])
+        self.assertEqual(['-E', 'INSERT INTO out SELECT name FROM vrpentries WHERE (name REGEXP ?) AND (size > ?);'], sql[2])
+
+        # only the literals differ
+        self.assertEqual(gufi_workload.fingerprint(sql),
+                         gufi_workload.fingerprint(gufi_workload.statements(query_cmd('b', 1024))))
+        self.assertNotEqual(gufi_workload.fingerprint(sql),
+                            gufi_workload.fingerprint(gufi_workload.statements(query_cmd('b', 1)[:-2])))
+
+        self.assertTrue(gufi_workload.uses_regexp(sql))
+        self.assertFalse(gufi_workload.uses_regexp([['-I', 'CREATE TABLE regexp(x);'],
+                                                    ['-E', 'SELECT name FROM entries;']]))
+
+    def test_recorder(self):
+        config = build_config(self.indexroot, self.directory)
+        make_dir(os.path.join(self.indexroot, 'a'), treesummary=True)
+
+        calls = []
+        def run_command(cmd, stdout=None, replace=False, trace=None, progress=None): # pylint: disable=too-many-arguments
+            calls.append((cmd, stdout, replace, trace, progress))
+            return 3
+
+        recorder = gufi_workload.Recorder(config, 'gufi_stats', self.indexroot,
+                                          [os.path.join(self.indexroot, 'a')], run_command)
+        try:
+            cmd = query_cmd('x', 1) + [os.path.join(self.indexroot, 'a')]
+            self.assertEqual(3, recorder.run(cmd, replace=True))
+        finally:
+            recorder.close()
+
+        # the process is never replaced
+        self.assertEqual([(cmd, None, False, None, None)], calls)
+
+        runs = self.log.runs()
+        self.assertEqual(1, len(runs))
+        self.assertEqual(('gufi_stats', self.indexroot, 'a', 1, 3),
+                         (runs[0]['tool'], runs[0]['indexroot'], runs[0]['path'],
+                          runs[0]['subtree_directories'], runs[0]['returncode']))
+        self.assertEqual({runs[0]['fingerprint']: gufi_workload.statements(cmd)}, self.log.queries())
+
+        # the time filter
+        self.assertEqual([], self.log.runs(runs[0]['time'] + 1))
+
+    def test_suggestions(self):
+        plain = os.path.join(self.indexroot, 'plain')
+        tuned = os.path.join(self.indexroot, 'tuned')
+        make_dir(plain, rollupscore=0)
+        make_dir(tuned, treesummary=True, rollupscore=1)
+
+        regexp = query_cmd('x', 1)
+        glob = ['/bin/true', '-E', 'SELECT name FROM vrpentries WHERE name GLOB \'x*\';']
+        for _ in range(3):
+            self.record(regexp, 'plain', 2.0, 1.5)
+            self.record(glob, 'tuned', 4.0, 0.1)
+            self.record(glob, 'fast', 0.1, 0.1)
+
+        runs = self.log.runs()
+        found = gufi_workload.suggestions(runs, self.log.queries())
+        regexp_key = gufi_workload.fingerprint(gufi_workload.statements(regexp))
+        glob_key = gufi_workload.fingerprint(gufi_workload.statements(glob))
+
+        self.assertEqual(4, len(found))
+        self.assertTrue(found[0].startswith('build treesummary under {0}: 3 runs'.format(plain)))
+        self.assertTrue(found[1].startswith('run gufi_rollup on {0}'.format(plain)))
+        self.assertTrue(found[2].startswith('{0} spent 5% of its time on the CPU'.format(glob_key)))
+        self.assertIn(tuned, found[2])
+        self.assertTrue(found[3].startswith('{0} evaluates REGEXP for every row'.format(regexp_key)))
+
+        out = io.StringIO() if sys.version_info.major >= 3 else io.BytesIO()
+        gufi_workload.report(runs, self.log.queries(), out, top=1)
+        lines = out.getvalue().splitlines()
+        self.assertEqual('Slowest queries', lines[0])
+        self.assertTrue(lines[1].startswith('    {0} 6 runs total 12.30s median 2.05s cpu 0.60s (gufi_find) e.g. {1}'.format(glob_key, tuned)))
+        self.assertEqual('        -E SELECT name FROM vrpentries WHERE name GLOB ?;', lines[2])
+        self.assertEqual(['Hot subtrees', '    {0} 3 runs total 12.00s median 4.00s'.format(tuned),
+                          'Suggestions', '    ' + found[2]], lines[3:])
+
+    def test_layout(self):
+        # runs recorded with an older layout are dropped
+        filename = os.path.join(self.tmp, 'old.db')
+        db = sqlite3.connect(filename)
+        db.executescript('''
+        CREATE TABLE metadata(name TEXT PRIMARY KEY, value TEXT);
+        INSERT INTO metadata VALUES ('version', '1');
+        CREATE TABLE runs(time REAL, tool TEXT, fingerprint TEXT, indexroot TEXT, path TEXT, seconds REAL, cpu REAL, directories INTEGER, returncode INTEGER);
+        INSERT INTO runs VALUES (0, 'gufi_find', 'x', '/', '', 1, 1, 1, 0);
+        CREATE TABLE queries(fingerprint TEXT PRIMARY KEY, sql TEXT);
+        ''')
+        db.commit()
+        db.close()
+
+        log = gufi_workload.Log(filename)
+        try:
+            self.assertEqual([], log.runs())
+            log.record('gufi_find', [], self.indexroot, self.indexroot, 1, 1, 2, 0)
+            self.assertEqual(2, log.runs()[0]['subtree_directories'])
+        finally:
+            log.close()
+
+    def test_export(self):
+        self.record(['/bin/true'], 'a', 1.5, 0.5)
+
+        out = io.StringIO() if sys.version_info.major >= 3 else io.BytesIO()
+        gufi_workload.export(self.log.runs(), out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(','.join(gufi_workload.COLUMNS), lines[0])
+        self.assertEqual(['gufi_find', gufi_workload.fingerprint([]), self.indexroot, 'a', '1.5', '0.5', '', '0'],
+                         lines[1].split(',')[1:])
+
+if __name__ == '__main__':
+    unittest.main()